@@ -1,396 +1,659 @@
+"""Análise dos dados coletados do mercado financeiro global.
+
+Pode ser usado como script (`python data/analyze_market_data.py`, a partir de
+`dashboard/`) ou importado: `MarketAnalyzer` recebe os dados já em memória ou
+os lê de `data_dir`, e cada etapa da análise é um método que pode ser chamado
+isoladamente. Com `--incremental`, o estado guardado em `<data_dir>/state`
+permite recalcular só os símbolos, correlações e grupos cujos dados mudaram
+desde a última análise (ver incremental_analytics); com `--analysis-workers N`, o
+trabalho por símbolo é dividido por fatias de símbolos entre N processos (ver
+parallel_analytics), com resultados idênticos aos de um processo.
+"""
+import argparse
 import json
 import numpy as np
-import pandas as pd
 from datetime import datetime
 import os
+import shutil
+
+import incremental_analytics
+import market_analytics
+import market_rankings
+import ohlcv_resample
+import parallel_analytics
+import record_stream
+import risk_analytics
+import run_metrics
+import timeseries_store
+
+DATA_DIR = 'data'
+
+
+def market_data_store(dataset, json_path, store_dir=None):
+    """Caminho do armazenamento colunar de `dataset` se a leitura deve usá-lo; senão None.
+
+    Ele é ignorado se não existir ou se o .json/.ndjson for mais recente (JSON
+    novo sobre um `timeseries/` antigo, por exemplo).
+    """
+    store_path = os.path.join(store_dir or os.path.join(DATA_DIR, 'timeseries'), dataset)
+    newest_json = record_stream.newest(json_path)
+    if not timeseries_store.TimeSeriesStore.exists(store_path) or (
+            newest_json and os.path.getmtime(newest_json) > timeseries_store.TimeSeriesStore.modified(store_path)):
+        return None
+    return store_path
+
+
+def load_market_data(dataset, json_path, store_dir=None, metrics=None, interval='1d'):
+    """Carrega as séries de um conjunto, preferindo o armazenamento colunar.
+
+    Sem ele (veja `market_data_store`), lê o mais recente entre o .json e o
+    .ndjson (modo streaming da coleta). Em todos os casos as colunas de
+    `indicators.quote[0]` chegam como arrays float com NaN onde faltam valores;
+    vindas do armazenamento colunar são views sobre os arquivos mapeados em
+    memória, sem cópia nem parse de JSON.
+
+    Séries com barras mais finas que `interval` (intradiárias, por exemplo)
+    chegam já reamostradas por calendário para esse intervalo.
+    """
+    store_path = market_data_store(dataset, json_path, store_dir)
+    if store_path:
+        return load_store(store_path, metrics, interval)
+    return load_json(json_path, metrics, interval)
+
+
+def load_store(store_path, metrics=None, interval='1d'):
+    if metrics:
+        metrics.read(store_path)
+    return ohlcv_resample.store_records(
+        timeseries_store.TimeSeriesStore(store_path), timeseries_store.COLUMNS, interval)
+
+
+def load_json(json_path, metrics=None, interval='1d'):
+    json_path = record_stream.newest(json_path) or json_path
+    if json_path.endswith(record_stream.NDJSON_SUFFIX):
+        # Cada registro vira arrays assim que é lido, sem uma lista do universo inteiro em listas Python
+        records = [float_quotes(record) for record in record_stream.NDJSONReader(json_path)]
+    else:
+        with open(json_path, 'r') as f:
+            records = [float_quotes(record) for record in json.load(f)]
+    if metrics:
+        metrics.read(json_path)
+    return ohlcv_resample.resample_records(records, interval)
+
+
+def float_quotes(record):
+    """Converte as colunas de `indicators.quote` do registro em arrays float, no lugar."""
+    for quote in record.get('indicators', {}).get('quote') or []:
+        for col, values in quote.items():
+            quote[col] = np.asarray(values, dtype=np.float64)
+    return record
+
+
+def correlation_value(value):
+    return None if np.isnan(value) else float(value)
+
+
+class MarketAnalyzer:
+    """Executa as etapas da análise sobre os dados coletados.
+
+    Os dados podem ser passados já carregados (por exemplo, o retorno de
+    `MarketDataCollector.run`) ou lidos de `data_dir` na primeira vez que uma
+    etapa precisar deles. Cada etapa guarda o resultado em um atributo e o
+    devolve; `save` grava os arquivos em `<data_dir>/analysis`.
+
+    As métricas são calculadas sobre barras de `interval` ('1d' ou '1wk');
+    séries mais finas, como as intradiárias, são reamostradas por calendário.
 
-print("Iniciando análise dos dados do mercado financeiro global...")
-
-# Carregar dados de índices
-with open('data/indices_data.json', 'r') as f:
-    indices_data = json.load(f)
-
-# Carregar dados de ações
-with open('data/stocks_data.json', 'r') as f:
-    stocks_data = json.load(f)
-
-# Carregar insights de ações
-with open('data/stocks_insights.json', 'r') as f:
-    stocks_insights = json.load(f)
-
-# Criar diretório para resultados da análise
-os.makedirs('data/analysis', exist_ok=True)
-
-# Análise de índices globais
-print("Analisando índices globais...")
-indices_analysis = []
-
-for index in indices_data:
-    symbol = index['symbol']
-    name = index['name']
-    region = index['region']
-    
-    # Extrair dados de preço e volume
-    timestamps = index.get('timestamp', [])
-    
-    # Verificar se há dados de indicadores
-    if 'indicators' in index and 'quote' in index['indicators'] and index['indicators']['quote']:
-        quote = index['indicators']['quote'][0]
-        
-        # Extrair preços de fechamento
-        close_prices = quote.get('close', [])
-        
-        # Calcular retornos se houver pelo menos 2 preços
-        if len(close_prices) >= 2 and None not in close_prices:
-            # Último preço disponível
-            last_price = next((p for p in reversed(close_prices) if p is not None), None)
-            
-            # Primeiro preço disponível
-            first_price = next((p for p in close_prices if p is not None), None)
-            
-            # Preço de uma semana atrás (aproximadamente 5 dias de negociação)
-            week_ago_idx = max(0, len(close_prices) - 6)
-            week_ago_price = close_prices[week_ago_idx] if week_ago_idx < len(close_prices) else first_price
-            
-            # Calcular variações
-            if first_price and last_price:
-                period_return = ((last_price / first_price) - 1) * 100
-                
-                # Variação de uma semana
-                week_return = ((last_price / week_ago_price) - 1) * 100 if week_ago_price else 0
-                
-                # Calcular volatilidade (desvio padrão dos retornos diários)
-                daily_returns = []
-                for i in range(1, len(close_prices)):
-                    if close_prices[i] is not None and close_prices[i-1] is not None:
-                        daily_return = (close_prices[i] / close_prices[i-1]) - 1
-                        daily_returns.append(daily_return)
-                
-                volatility = np.std(daily_returns) * 100 if daily_returns else 0
-                
-                # Tendência (média móvel de 5 dias vs média móvel de 20 dias)
-                ma5 = np.mean(close_prices[-5:]) if len(close_prices) >= 5 else last_price
-                ma20 = np.mean(close_prices[-20:]) if len(close_prices) >= 20 else last_price
-                trend = "Alta" if ma5 > ma20 else "Baixa" if ma5 < ma20 else "Lateral"
-                
-                # Adicionar à análise
-                indices_analysis.append({
-                    'symbol': symbol,
-                    'name': name,
-                    'region': region,
-                    'last_price': last_price,
-                    'period_return': round(period_return, 2),
-                    'week_return': round(week_return, 2),
-                    'volatility': round(volatility, 2),
-                    'trend': trend
-                })
-                
-                print(f"Análise concluída para {name}")
+    Com `incremental=True`, as métricas, as correlações e os agregados por
+    grupo partem do estado da execução anterior e só os símbolos alterados são
+    recalculados; `save` grava também o estado atualizado.
+
+    Com `risk_metrics=True`, cada linha da análise de ações ganha também os
+    campos de risco e indicadores técnicos de risk_analytics.
+
+    Com `workers` > 1 (0 usa todos os núcleos), as linhas de índices e ações
+    (matrizes, métricas, pacote de risco e junções) e as correlações são
+    calculadas por fatias de símbolos em outros processos; `run` encerra o pool
+    ao final (ou chame `close`).
+    """
+
+    def __init__(self, data_dir=DATA_DIR, indices_data=None, stocks_data=None, stocks_insights=None,
+                 corr_universe='indices', corr_window=None, corr_format='upper', corr_top_k=0,
+                 taxonomy_path=None, metrics=None, incremental=False, interval='1d',
+                 rankings_top=market_rankings.DEFAULT_TOP, rankings_page_size=market_rankings.DEFAULT_PAGE_SIZE,
+                 risk_metrics=False, risk_free_rate=0.0, workers=1):
+        self.data_dir = data_dir
+        self.output_dir = os.path.join(data_dir, 'analysis')
+        self.corr_universe = corr_universe
+        self.corr_window = corr_window
+        self.corr_format = corr_format
+        self.corr_top_k = corr_top_k
+        self.interval = interval
+        self.rankings_top = rankings_top
+        self.rankings_page_size = rankings_page_size
+        self.risk_metrics = risk_metrics
+        self.risk_free_rate = risk_free_rate
+        self.executor = parallel_analytics.ShardedExecutor(workers) if workers != 1 else None
+        self.taxonomy_path = taxonomy_path or os.path.join(data_dir, 'reference', 'taxonomy.json')
+        self.state = incremental_analytics.AnalysisState(
+            os.path.join(data_dir, 'state', interval)) if incremental else None
+        self._taxonomy = None
+        self._taxonomy_mtime = None
+        self.next_cycle(metrics, indices_data, stocks_data, stocks_insights)
+
+    def next_cycle(self, metrics, indices_data=None, stocks_data=None, stocks_insights=None):
+        """Prepara uma nova análise com outros dados, descartando os resultados da anterior.
+
+        A taxonomia (se o arquivo não mudou), o estado incremental e o pool de
+        processos continuam os mesmos, o que evita recarregá-los a cada ciclo
+        do pipeline com --every.
+        """
+        self.metrics = metrics or run_metrics.RunMetrics()
+        if self._taxonomy is not None and self._taxonomy_mtime != self.taxonomy_mtime():
+            self._taxonomy = None
+
+        # Dados já em memória (da coleta, por exemplo) passam pela mesma reamostragem da leitura
+        self._indices_data = ohlcv_resample.resample_records(indices_data, self.interval) if indices_data else indices_data
+        self._stocks_data = ohlcv_resample.resample_records(stocks_data, self.interval) if stocks_data else stocks_data
+        self._stocks_insights = stocks_insights
+        self._insights_by_symbol = None
+        self.stores = {}
+
+        self.indices_analysis = None
+        self.stocks_analysis = None
+        self.regions = None
+        self.correlations = None
+        self.top_pairs = None
+        self.sectors_analysis = None
+        self.market_summary = None
+        self.rankings = None
+
+    def path(self, *parts):
+        return os.path.join(self.data_dir, *parts)
+
+    # Dados de entrada, carregados sob demanda
+
+    def load(self, dataset):
+        """Registros de `dataset` ('indices' ou 'stocks') lidos de data_dir, como em `load_market_data`.
+
+        Guarda em `stores` o armazenamento colunar de onde vieram (ou None): com
+        `workers`, cada processo lê dele a sua fatia, sem receber os registros.
+        """
+        json_path = self.path(f'{dataset}_data.json')
+        with self.metrics.stage('analyze.load'):
+            self.stores[dataset] = market_data_store(dataset, json_path, self.path('timeseries'))
+            if self.stores[dataset]:
+                return load_store(self.stores[dataset], self.metrics, self.interval)
+            return load_json(json_path, self.metrics, self.interval)
+
+    @property
+    def indices_data(self):
+        if self._indices_data is None:
+            self._indices_data = self.load('indices')
+        return self._indices_data
+
+    @property
+    def stocks_data(self):
+        if self._stocks_data is None:
+            self._stocks_data = self.load('stocks')
+        return self._stocks_data
+
+    @property
+    def stocks_insights(self):
+        if self._stocks_insights is None:
+            path = record_stream.newest(self.path('stocks_insights.json')) or self.path('stocks_insights.json')
+            with self.metrics.stage('analyze.load'):
+                if path.endswith(record_stream.NDJSON_SUFFIX):
+                    # Lido por símbolo, sob demanda
+                    self._stocks_insights = record_stream.NDJSONReader(path)
+                else:
+                    with open(path, 'r') as f:
+                        self._stocks_insights = json.load(f)
+            self.metrics.read(path)
+        return self._stocks_insights
+
+    @property
+    def insights_by_symbol(self):
+        # Índice símbolo → insight, montado uma vez para as junções das etapas
+        if self._insights_by_symbol is None:
+            insights = self.stocks_insights
+            if isinstance(insights, record_stream.NDJSONReader):
+                self._insights_by_symbol = insights
             else:
-                print(f"Dados insuficientes para análise de {name}")
+                self._insights_by_symbol = market_analytics.index_by_symbol(insights)
+        return self._insights_by_symbol
+
+    def taxonomy_mtime(self):
+        return os.path.getmtime(self.taxonomy_path) if os.path.exists(self.taxonomy_path) else None
+
+    @property
+    def taxonomy(self):
+        # Setores e regiões vêm do arquivo de referência (ou dos insights), não do código
+        if self._taxonomy is None:
+            self._taxonomy_mtime = self.taxonomy_mtime()
+            self._taxonomy = market_analytics.load_taxonomy(self.taxonomy_path)
+        return self._taxonomy
+
+    @property
+    def market_caps(self):
+        return {
+            symbol: entry['market_cap']
+            for symbol, entry in self.taxonomy['symbols'].items() if entry.get('market_cap')
+        }
+
+    def symbol_metrics(self, dataset, records, volumes=False):
+        """Métricas por símbolo, calculadas em lote ou a partir do estado incremental."""
+        periods_per_year = ohlcv_resample.PERIODS_PER_YEAR[self.interval]
+        if self.state is None:
+            return market_analytics.compute_metrics(
+                market_analytics.field_matrix(records, 'close'),
+                market_analytics.field_matrix(records, 'volume') if volumes else None,
+                days=market_analytics.day_matrix(records),
+                periods_per_year=periods_per_year
+            )
+        state = self.state.symbols[dataset]
+        changed, rebuilt = state.update(records)
+        self.metrics.incr('analysis.incremental.changed_symbols', changed)
+        self.metrics.incr('analysis.incremental.rebuilt_symbols', rebuilt)
+        return state.metrics(volumes, periods_per_year)
+
+    def group_aggregates(self, kind, rows, group_of):
+        """{grupo: (linhas dos membros, campos agregados)}, na ordem em que os grupos aparecem."""
+        if self.state is None:
+            members = market_analytics.group_members(rows, group_of)
+            aggregates = market_analytics.group_aggregates(rows, group_of, self.market_caps)
+            return {group: (members[group], market_analytics.aggregate_fields(aggregates, group))
+                    for group in aggregates.index}
+        groups, recomputed = self.state.groups.aggregates(kind, rows, group_of, self.market_caps)
+        self.metrics.incr('analysis.incremental.recomputed_groups', recomputed)
+        return groups
+
+    @run_metrics.stage('analyze.risk')
+    def stock_risk_fields(self):
+        """{símbolo: campos de risco} das ações, com beta contra cada índice (ver risk_analytics).
+
+        Mesmo com `incremental=True` o pacote é calculado em lote sobre as séries inteiras.
+        """
+        periods_per_year = ohlcv_resample.PERIODS_PER_YEAR[self.interval]
+        if self.executor is not None:
+            return self.executor.risk_fields(
+                self.stocks_data, self.indices_data, periods_per_year, self.risk_free_rate / 100,
+                self.stores.get('stocks'), self.interval)
+        metrics, beta = risk_analytics.compute_risk_metrics(
+            self.stocks_data, self.indices_data, periods_per_year, self.risk_free_rate / 100)
+        return risk_analytics.risk_fields_by_symbol(metrics, beta)
+
+    # Etapas
+
+    @run_metrics.stage('analyze.indices')
+    def analyze_indices(self):
+        """Análise de índices globais."""
+        print("Analisando índices globais...")
+        if self.state is None and self.executor is not None:
+            self.indices_analysis, insufficient = self.executor.analysis_rows(
+                self.indices_data, self.taxonomy, ohlcv_resample.PERIODS_PER_YEAR[self.interval],
+                store=self.stores.get('indices'), interval=self.interval)
+        else:
+            index_metrics = market_analytics.metrics_by_symbol(self.symbol_metrics('indices', self.indices_data))
+            self.indices_analysis, insufficient = market_analytics.analysis_rows(
+                self.indices_data, index_metrics, self.taxonomy)
+        self.report_insufficient(insufficient)
+        print(f"Análise concluída para {len(self.indices_analysis)} de {len(self.indices_data)} índices")
+        return self.indices_analysis
+
+    @run_metrics.stage('analyze.stocks')
+    def analyze_stocks(self):
+        """Análise de ações, com recomendação e avaliação vindas dos insights."""
+        print("Analisando ações importantes...")
+        if self.state is None and self.executor is not None:
+            # Métricas, pacote de risco e linhas saem prontos de cada processo
+            self.stocks_analysis, insufficient = self.executor.analysis_rows(
+                self.stocks_data, self.taxonomy, ohlcv_resample.PERIODS_PER_YEAR[self.interval],
+                insights=self.insights_by_symbol, benchmarks=self.indices_data if self.risk_metrics else None,
+                risk_free_rate=self.risk_free_rate / 100, store=self.stores.get('stocks'), interval=self.interval)
         else:
+            stock_metrics = market_analytics.metrics_by_symbol(
+                self.symbol_metrics('stocks', self.stocks_data, volumes=True))
+            self.stocks_analysis, insufficient = market_analytics.analysis_rows(
+                self.stocks_data, stock_metrics, self.taxonomy, self.insights_by_symbol,
+                self.stock_risk_fields() if self.risk_metrics else None)
+        self.report_insufficient(insufficient)
+        print(f"Análise concluída para {len(self.stocks_analysis)} de {len(self.stocks_data)} ações")
+        return self.stocks_analysis
+
+    def report_insufficient(self, names):
+        for name in names:
             print(f"Dados insuficientes para análise de {name}")
-    else:
-        print(f"Sem dados de indicadores para {name}")
-
-# Salvar análise de índices
-with open('data/analysis/indices_analysis.json', 'w') as f:
-    json.dump(indices_analysis, f)
-print("Análise de índices salvos em data/analysis/indices_analysis.json")
-
-# Análise de ações
-print("Analisando ações importantes...")
-stocks_analysis = []
-
-for stock in stocks_data:
-    symbol = stock['symbol']
-    name = stock['name']
-    region = stock['region']
-    
-    # Extrair dados de preço e volume
-    timestamps = stock.get('timestamp', [])
-    
-    # Verificar se há dados de indicadores
-    if 'indicators' in stock and 'quote' in stock['indicators'] and stock['indicators']['quote']:
-        quote = stock['indicators']['quote'][0]
-        
-        # Extrair preços de fechamento e volume
-        close_prices = quote.get('close', [])
-        volumes = quote.get('volume', [])
-        
-        # Calcular retornos se houver pelo menos 2 preços
-        if len(close_prices) >= 2 and None not in close_prices:
-            # Último preço disponível
-            last_price = next((p for p in reversed(close_prices) if p is not None), None)
-            
-            # Primeiro preço disponível
-            first_price = next((p for p in close_prices if p is not None), None)
-            
-            # Preço de uma semana atrás (aproximadamente 5 dias de negociação)
-            week_ago_idx = max(0, len(close_prices) - 6)
-            week_ago_price = close_prices[week_ago_idx] if week_ago_idx < len(close_prices) else first_price
-            
-            # Calcular variações
-            if first_price and last_price:
-                period_return = ((last_price / first_price) - 1) * 100
-                
-                # Variação de uma semana
-                week_return = ((last_price / week_ago_price) - 1) * 100 if week_ago_price else 0
-                
-                # Calcular volatilidade (desvio padrão dos retornos diários)
-                daily_returns = []
-                for i in range(1, len(close_prices)):
-                    if close_prices[i] is not None and close_prices[i-1] is not None:
-                        daily_return = (close_prices[i] / close_prices[i-1]) - 1
-                        daily_returns.append(daily_return)
-                
-                volatility = np.std(daily_returns) * 100 if daily_returns else 0
-                
-                # Volume médio
-                avg_volume = np.mean([v for v in volumes if v is not None]) if volumes else 0
-                
-                # Tendência (média móvel de 5 dias vs média móvel de 20 dias)
-                ma5 = np.mean(close_prices[-5:]) if len(close_prices) >= 5 else last_price
-                ma20 = np.mean(close_prices[-20:]) if len(close_prices) >= 20 else last_price
-                trend = "Alta" if ma5 > ma20 else "Baixa" if ma5 < ma20 else "Lateral"
-                
-                # Buscar insights adicionais
-                stock_insight = next((si for si in stocks_insights if si['symbol'] == symbol), None)
-                recommendation = None
-                valuation = None
-                
-                if stock_insight and 'insights' in stock_insight:
-                    insights = stock_insight['insights']
-                    
-                    # Recomendação
-                    if 'recommendation' in insights and insights['recommendation']:
-                        recommendation = {
-                            'rating': insights['recommendation'].get('rating'),
-                            'targetPrice': insights['recommendation'].get('targetPrice')
-                        }
-                    
-                    # Avaliação
-                    if 'instrumentInfo' in insights and 'valuation' in insights['instrumentInfo']:
-                        valuation = {
-                            'description': insights['instrumentInfo']['valuation'].get('description'),
-                            'discount': insights['instrumentInfo']['valuation'].get('discount')
-                        }
-                
-                # Adicionar à análise
-                stocks_analysis.append({
-                    'symbol': symbol,
-                    'name': name,
-                    'region': region,
-                    'last_price': last_price,
-                    'period_return': round(period_return, 2),
-                    'week_return': round(week_return, 2),
-                    'volatility': round(volatility, 2),
-                    'avg_volume': int(avg_volume) if not np.isnan(avg_volume) else 0,
-                    'trend': trend,
-                    'recommendation': recommendation,
-                    'valuation': valuation
-                })
-                
-                print(f"Análise concluída para {name}")
+            self.metrics.incr('analysis.insufficient_data')
+
+    @run_metrics.stage('analyze.regions')
+    def analyze_regions(self):
+        """Desempenho por região, a partir da análise de índices."""
+        if self.indices_analysis is None:
+            self.analyze_indices()
+        print("Analisando desempenho por região...")
+
+        # Agrupar índices por região e calcular os agregados numa única passada
+        region_of = {index['symbol']: index['region'] for index in self.indices_analysis}
+        self.regions = {}
+        for region, (members, fields) in self.group_aggregates('regions', self.indices_analysis, region_of).items():
+            self.regions[region] = {'indices': members}
+            self.regions[region].update(fields)
+        return self.regions
+
+    @run_metrics.stage('analyze.correlations')
+    def analyze_correlations(self):
+        """Correlação entre os retornos, alinhados por data de negociação."""
+        print("Analisando correlações...")
+        corr_records = self.indices_data + (self.stocks_data if self.corr_universe == 'all' else [])
+        names = {record['symbol']: record['name'] for record in corr_records}
+        empty = [] if self.corr_format == 'pairs' else {'symbols': [], 'names': []}
+        self.top_pairs = None
+
+        try:
+            if self.state is None:
+                returns = market_analytics.aligned_returns(corr_records)
+                returns = returns.loc[:, returns.notna().any()]
+                correlation_matrix = self.executor.correlation_matrix if self.executor \
+                    else market_analytics.correlation_matrix
+                corr_matrix = correlation_matrix(returns, window=self.corr_window)
+                n_dates = len(returns)
             else:
-                print(f"Dados insuficientes para análise de {name}")
+                corr_matrix, n_dates, changed = self.state.correlations.update(corr_records, self.corr_window)
+                self.metrics.incr('analysis.incremental.changed_correlation_columns', changed)
+            corr_matrix = corr_matrix.round(2)
+            symbols = list(corr_matrix.columns)
+        except Exception as e:
+            print(f"Erro ao calcular correlações: {str(e)}")
+            self.metrics.incr('analysis.errors')
+            self.correlations = empty
+            return self.correlations
+
+        if len(symbols) < 2:
+            print("Dados insuficientes para análise de correlações")
+            self.correlations = empty
+            return self.correlations
+
+        if self.corr_format == 'pairs':
+            # Cada par aparece uma única vez (index1 vem antes de index2)
+            rows, cols = np.triu_indices(len(symbols), k=1)
+            values = corr_matrix.to_numpy()[rows, cols]
+            self.correlations = [
+                {'index1': names[symbols[r]], 'index2': names[symbols[c]], 'correlation': correlation_value(v)}
+                for r, c, v in zip(rows, cols, values)
+            ]
         else:
-            print(f"Dados insuficientes para análise de {name}")
-    else:
-        print(f"Sem dados de indicadores para {name}")
-
-# Salvar análise de ações
-with open('data/analysis/stocks_analysis.json', 'w') as f:
-    json.dump(stocks_analysis, f)
-print("Análise de ações salva em data/analysis/stocks_analysis.json")
-
-# Análise de desempenho por região
-print("Analisando desempenho por região...")
-regions = {}
-
-# Agrupar índices por região
-for index in indices_analysis:
-    region = index['region']
-    if region not in regions:
-        regions[region] = {'indices': [], 'avg_return': 0, 'count': 0}
-    
-    regions[region]['indices'].append(index)
-    regions[region]['avg_return'] += index['period_return']
-    regions[region]['count'] += 1
-
-# Calcular retorno médio por região
-for region in regions:
-    if regions[region]['count'] > 0:
-        regions[region]['avg_return'] = round(regions[region]['avg_return'] / regions[region]['count'], 2)
-
-# Salvar análise por região
-with open('data/analysis/regions_analysis.json', 'w') as f:
-    json.dump(regions, f)
-print("Análise por região salva em data/analysis/regions_analysis.json")
-
-# Análise de correlação entre índices - CORRIGIDO
-print("Analisando correlações entre índices...")
-correlations = []
-
-# Criar DataFrame com preços de fechamento dos índices
-# Primeiro, encontrar o comprimento mínimo comum para todos os arrays
-min_length = float('inf')
-index_prices = {}
-
-for index in indices_data:
-    if 'indicators' in index and 'quote' in index['indicators'] and index['indicators']['quote']:
-        close_prices = index['indicators']['quote'][0].get('close', [])
-        # Remover valores None
-        close_prices = [p for p in close_prices if p is not None]
-        if close_prices:
-            min_length = min(min_length, len(close_prices))
-            index_prices[index['name']] = close_prices
-
-# Truncar todos os arrays para o mesmo comprimento
-for name in index_prices:
-    index_prices[name] = index_prices[name][-min_length:] if min_length < len(index_prices[name]) else index_prices[name]
-
-# Agora criar o DataFrame com arrays de mesmo comprimento
-if index_prices and min_length < float('inf'):
-    try:
-        df = pd.DataFrame(index_prices)
-        
-        # Calcular matriz de correlação
-        corr_matrix = df.corr().round(2)
-        
-        # Converter para formato de lista para JSON
-        for idx, row in corr_matrix.iterrows():
-            for col in corr_matrix.columns:
-                if idx != col:  # Evitar autocorrelação
-                    correlations.append({
-                        'index1': idx,
-                        'index2': col,
-                        'correlation': row[col]
-                    })
-        
-        # Salvar análise de correlação
-        with open('data/analysis/correlations_analysis.json', 'w') as f:
-            json.dump(correlations, f)
-        print("Análise de correlações salva em data/analysis/correlations_analysis.json")
-    except Exception as e:
-        print(f"Erro ao calcular correlações: {str(e)}")
-        # Criar um arquivo vazio para correlações
-        with open('data/analysis/correlations_analysis.json', 'w') as f:
-            json.dump([], f)
-        print("Arquivo de correlações vazio criado devido a erro")
-else:
-    print("Dados insuficientes para análise de correlações")
-    # Criar um arquivo vazio para correlações
-    with open('data/analysis/correlations_analysis.json', 'w') as f:
-        json.dump([], f)
-    print("Arquivo de correlações vazio criado devido a dados insuficientes")
-
-# Análise de setores (baseada em ações)
-print("Analisando desempenho por setor...")
-sectors = {
-    'Tecnologia': ['AAPL', 'MSFT', 'GOOGL', 'META', 'NVDA'],
-    'Comércio': ['AMZN', 'BABA'],
-    'Automotivo': ['TSLA'],
-    'Financeiro': ['JPM'],
-    'Energia': ['PETR4.SA']
-}
-
-sectors_analysis = {}
-for sector_name, symbols in sectors.items():
-    sector_stocks = [s for s in stocks_analysis if s['symbol'] in symbols]
-    
-    if sector_stocks:
-        avg_return = sum(s['period_return'] for s in sector_stocks) / len(sector_stocks)
-        avg_volatility = sum(s['volatility'] for s in sector_stocks) / len(sector_stocks)
-        
-        sectors_analysis[sector_name] = {
-            'stocks': [s['symbol'] for s in sector_stocks],
-            'avg_return': round(avg_return, 2),
-            'avg_volatility': round(avg_volatility, 2)
+            self.correlations = {
+                'symbols': symbols,
+                'names': [names[s] for s in symbols],
+                'window': self.corr_window,
+                'observations': int(min(n_dates, self.corr_window or n_dates))
+            }
+            if self.corr_format == 'matrix':
+                self.correlations['matrix'] = [
+                    [correlation_value(v) for v in row] for row in corr_matrix.to_numpy()
+                ]
+            else:
+                # Linha a linha acima da diagonal: (0,1), (0,2), ..., (1,2), ...
+                self.correlations['upper_triangle'] = [
+                    correlation_value(v) for v in market_analytics.upper_triangle(corr_matrix)
+                ]
+
+        if self.corr_top_k > 0:
+            most, least = market_analytics.top_correlated(corr_matrix, self.corr_top_k)
+            values = corr_matrix.to_numpy()
+
+            def ranked(row, picks):
+                return [[symbols[p], correlation_value(values[row, p])] for p in picks if p >= 0]
+
+            self.top_pairs = {
+                symbol: {'most': ranked(row, most[row]), 'least': ranked(row, least[row])}
+                for row, symbol in enumerate(symbols)
+            }
+        return self.correlations
+
+    @run_metrics.stage('analyze.sectors')
+    def analyze_sectors(self):
+        """Desempenho por setor, a partir da análise de ações."""
+        if self.stocks_analysis is None:
+            self.analyze_stocks()
+        print("Analisando desempenho por setor...")
+
+        sector_of = {
+            stock['symbol']: market_analytics.resolve_sector(
+                stock['symbol'], self.insights_by_symbol.get(stock['symbol']), self.taxonomy)
+            for stock in self.stocks_analysis
+        }
+        self.sectors_analysis = {}
+        for sector_name, (members, fields) in self.group_aggregates('sectors', self.stocks_analysis, sector_of).items():
+            self.sectors_analysis[sector_name] = {'stocks': [s['symbol'] for s in members]}
+            self.sectors_analysis[sector_name].update(fields)
+        return self.sectors_analysis
+
+    @run_metrics.stage('analyze.summary')
+    def build_market_summary(self):
+        """Resumo geral do mercado a partir das etapas anteriores (executadas se preciso)."""
+        indices_analysis = self.indices_analysis if self.indices_analysis is not None else self.analyze_indices()
+        stocks_analysis = self.stocks_analysis if self.stocks_analysis is not None else self.analyze_stocks()
+        regions = self.regions if self.regions is not None else self.analyze_regions()
+        sectors_analysis = self.sectors_analysis if self.sectors_analysis is not None else self.analyze_sectors()
+        print("Gerando resumo geral do mercado...")
+
+        market_summary = {
+            'date': datetime.now().strftime('%Y-%m-%d'),
+            'indices_count': len(indices_analysis),
+            'stocks_count': len(stocks_analysis),
+            'best_performing_index': None,
+            'worst_performing_index': None,
+            'best_performing_stock': None,
+            'worst_performing_stock': None,
+            'highest_volatility_index': None,
+            'highest_volatility_stock': None,
+            'best_performing_region': None,
+            'best_performing_sector': None
         }
 
-# Salvar análise de setores
-with open('data/analysis/sectors_analysis.json', 'w') as f:
-    json.dump(sectors_analysis, f)
-print("Análise de setores salva em data/analysis/sectors_analysis.json")
-
-# Resumo geral do mercado
-print("Gerando resumo geral do mercado...")
-market_summary = {
-    'date': datetime.now().strftime('%Y-%m-%d'),
-    'indices_count': len(indices_analysis),
-    'stocks_count': len(stocks_analysis),
-    'best_performing_index': None,
-    'worst_performing_index': None,
-    'best_performing_stock': None,
-    'worst_performing_stock': None,
-    'highest_volatility_index': None,
-    'highest_volatility_stock': None,
-    'best_performing_region': None,
-    'best_performing_sector': None
-}
-
-# Melhor e pior índice
-if indices_analysis:
-    best_index = max(indices_analysis, key=lambda x: x['period_return'])
-    worst_index = min(indices_analysis, key=lambda x: x['period_return'])
-    highest_vol_index = max(indices_analysis, key=lambda x: x['volatility'])
-    
-    market_summary['best_performing_index'] = {
-        'name': best_index['name'],
-        'return': best_index['period_return']
-    }
-    
-    market_summary['worst_performing_index'] = {
-        'name': worst_index['name'],
-        'return': worst_index['period_return']
-    }
-    
-    market_summary['highest_volatility_index'] = {
-        'name': highest_vol_index['name'],
-        'volatility': highest_vol_index['volatility']
-    }
-
-# Melhor e pior ação
-if stocks_analysis:
-    best_stock = max(stocks_analysis, key=lambda x: x['period_return'])
-    worst_stock = min(stocks_analysis, key=lambda x: x['period_return'])
-    highest_vol_stock = max(stocks_analysis, key=lambda x: x['volatility'])
-    
-    market_summary['best_performing_stock'] = {
-        'name': best_stock['name'],
-        'return': best_stock['period_return']
-    }
-    
-    market_summary['worst_performing_stock'] = {
-        'name': worst_stock['name'],
-        'return': worst_stock['period_return']
-    }
-    
-    market_summary['highest_volatility_stock'] = {
-        'name': highest_vol_stock['name'],
-        'volatility': highest_vol_stock['volatility']
-    }
-
-# Melhor região
-if regions:
-    best_region = max(regions.items(), key=lambda x: x[1]['avg_return'])
-    market_summary['best_performing_region'] = {
-        'region': best_region[0],
-        'return': best_region[1]['avg_return']
-    }
-
-# Melhor setor
-if sectors_analysis:
-    best_sector = max(sectors_analysis.items(), key=lambda x: x[1]['avg_return'])
-    market_summary['best_performing_sector'] = {
-        'sector': best_sector[0],
-        'return': best_sector[1]['avg_return']
-    }
-
-# Salvar resumo do mercado
-with open('data/analysis/market_summary.json', 'w') as f:
-    json.dump(market_summary, f)
-print("Resumo do mercado salvo em data/analysis/market_summary.json")
-
-print("Análise de dados concluída com sucesso!")
+        # Melhor e pior índice
+        if indices_analysis:
+            best_index = max(indices_analysis, key=lambda x: x['period_return'])
+            worst_index = min(indices_analysis, key=lambda x: x['period_return'])
+            highest_vol_index = max(indices_analysis, key=lambda x: x['volatility'])
+
+            market_summary['best_performing_index'] = {
+                'name': best_index['name'],
+                'return': best_index['period_return']
+            }
+
+            market_summary['worst_performing_index'] = {
+                'name': worst_index['name'],
+                'return': worst_index['period_return']
+            }
+
+            market_summary['highest_volatility_index'] = {
+                'name': highest_vol_index['name'],
+                'volatility': highest_vol_index['volatility']
+            }
+
+        # Melhor e pior ação
+        if stocks_analysis:
+            best_stock = max(stocks_analysis, key=lambda x: x['period_return'])
+            worst_stock = min(stocks_analysis, key=lambda x: x['period_return'])
+            highest_vol_stock = max(stocks_analysis, key=lambda x: x['volatility'])
+
+            market_summary['best_performing_stock'] = {
+                'name': best_stock['name'],
+                'return': best_stock['period_return']
+            }
+
+            market_summary['worst_performing_stock'] = {
+                'name': worst_stock['name'],
+                'return': worst_stock['period_return']
+            }
+
+            market_summary['highest_volatility_stock'] = {
+                'name': highest_vol_stock['name'],
+                'volatility': highest_vol_stock['volatility']
+            }
+
+        # Melhor região
+        if regions:
+            best_region = max(regions.items(), key=lambda x: x[1]['avg_return'])
+            market_summary['best_performing_region'] = {
+                'region': best_region[0],
+                'return': best_region[1]['avg_return']
+            }
+
+        # Melhor setor
+        if sectors_analysis:
+            best_sector = max(sectors_analysis.items(), key=lambda x: x[1]['avg_return'])
+            market_summary['best_performing_sector'] = {
+                'sector': best_sector[0],
+                'return': best_sector[1]['avg_return']
+            }
+
+        self.market_summary = market_summary
+        return self.market_summary
+
+    @run_metrics.stage('analyze.rankings')
+    def build_rankings(self):
+        """Os N primeiros de cada ranking do dashboard (ver market_rankings)."""
+        indices_analysis = self.indices_analysis if self.indices_analysis is not None else self.analyze_indices()
+        stocks_analysis = self.stocks_analysis if self.stocks_analysis is not None else self.analyze_stocks()
+        regions = self.regions if self.regions is not None else self.analyze_regions()
+        sectors_analysis = self.sectors_analysis if self.sectors_analysis is not None else self.analyze_sectors()
+        print("Gerando rankings do dashboard...")
+        self.rankings = market_rankings.build_rankings(
+            indices_analysis, stocks_analysis, regions, sectors_analysis, self.rankings_top)
+        return self.rankings
+
+    # Saída
+
+    @run_metrics.stage('analyze.save')
+    def save(self):
+        """Grava em `<data_dir>/analysis` os resultados das etapas já executadas."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        outputs = [
+            ('indices_analysis.json', self.indices_analysis, "Análise de índices"),
+            ('stocks_analysis.json', self.stocks_analysis, "Análise de ações"),
+            ('regions_analysis.json', self.regions, "Análise por região"),
+            ('correlations_analysis.json', self.correlations, "Análise de correlações"),
+            ('correlations_top.json', self.top_pairs, "Lista de pares mais e menos correlacionados"),
+            ('sectors_analysis.json', self.sectors_analysis, "Análise de setores"),
+            ('market_summary.json', self.market_summary, "Resumo do mercado"),
+        ]
+        # Saídas opcionais e a etapa que as gera: se ela rodou sem gerá-las (sem
+        # --corr-top-k, por exemplo), o arquivo de uma execução anterior não vale mais
+        optional = {'correlations_top.json': self.correlations}
+        for name, data, label in outputs:
+            path = os.path.join(self.output_dir, name)
+            if data is None:
+                if optional.get(name) is not None and os.path.exists(path):
+                    os.remove(path)
+                    print(f"{label} anterior removida de {path}")
+                continue
+            with open(path, 'w') as f:
+                json.dump(data, f)
+            self.metrics.written(path)
+            print(f"{label} salva em {path}")
+        rankings_dir = os.path.join(self.output_dir, 'rankings')
+        if self.rankings is None and self.rankings_top <= 0 and os.path.isdir(rankings_dir):
+            # Rankings desativados: os de uma execução anterior não correspondem mais à análise
+            shutil.rmtree(rankings_dir)
+            print(f"Rankings anteriores removidos de {rankings_dir}")
+        if self.rankings is not None:
+            # Mesma data do resumo, para o dashboard reconhecer os arquivos de uma mesma execução
+            date = (self.market_summary or {}).get('date') or datetime.now().strftime('%Y-%m-%d')
+            index_path = market_rankings.write_rankings(
+                self.rankings, rankings_dir, self.rankings_page_size, self.rankings_top, date)
+            self.metrics.written(rankings_dir)
+            print(f"Rankings do dashboard salvos em {index_path}")
+        if self.state is not None:
+            self.state.save()
+            self.metrics.written(self.state.state_dir)
+
+    def close(self):
+        """Encerra os processos do modo com `workers`, se houver."""
+        if self.executor is not None:
+            self.metrics.incr('analysis.parallel.shards', self.executor.shards)
+            self.executor.shards = 0
+            self.executor.close()
+
+    @run_metrics.stage('analyze')
+    def run(self):
+        """Executa todas as etapas e grava os resultados."""
+        print("Iniciando análise dos dados do mercado financeiro global...")
+        try:
+            self.analyze_indices()
+            self.analyze_stocks()
+            self.analyze_regions()
+            self.analyze_correlations()
+            self.analyze_sectors()
+            self.build_market_summary()
+            if self.rankings_top > 0:
+                self.build_rankings()
+        finally:
+            self.close()
+        self.save()
+        print("Análise de dados concluída com sucesso!")
+        return self
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Analisa os dados coletados do mercado financeiro global.')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='Diretório com os dados coletados; os resultados vão para <data-dir>/analysis')
+    parser.add_argument('--corr-universe', choices=['indices', 'all'], default='indices',
+                        help='Símbolos incluídos na matriz de correlação (índices ou índices + ações)')
+    parser.add_argument('--corr-window', type=int, default=None,
+                        help='Usa apenas as últimas N datas na correlação (janela móvel mais recente)')
+    parser.add_argument('--corr-format', choices=['upper', 'matrix', 'pairs'], default='upper',
+                        help='Triângulo superior compacto, matriz completa ou lista de pares únicos')
+    parser.add_argument('--corr-top-k', type=int, default=0,
+                        help='Salva os K pares mais e menos correlacionados de cada símbolo')
+    parser.add_argument('--rankings-top', type=int, default=market_rankings.DEFAULT_TOP,
+                        help='Itens de cada ranking pré-calculado do dashboard (0 desativa e remove os rankings salvos)')
+    parser.add_argument('--rankings-page-size', type=int, default=market_rankings.DEFAULT_PAGE_SIZE,
+                        help='Itens por página dos rankings')
+    parser.add_argument('--risk-metrics', action='store_true',
+                        help='Inclui na análise de ações drawdown, Sharpe/Sortino, beta por índice, RSI, MACD e ATR')
+    parser.add_argument('--risk-free-rate', type=float, default=0.0,
+                        help='Taxa livre de risco anual (%%) usada no Sharpe e no Sortino')
+    parser.add_argument('--analysis-workers', type=int, default=1,
+                        help='Processos para os cálculos em lote, por fatias de símbolos (0 = todos os núcleos)')
+    parser.add_argument('--analysis-interval', choices=ohlcv_resample.ANALYSIS_INTERVALS, default='1d',
+                        help='Intervalo das barras analisadas; séries intradiárias são reamostradas por calendário')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Recalcula só os símbolos alterados desde a última análise (estado em <data-dir>/state)')
+    run_metrics.add_metrics_arguments(parser)
+    return parser
+
+
+def analyzer_from_args(args, metrics=None, **data):
+    """Cria um MarketAnalyzer com as opções da linha de comando e, opcionalmente, dados em memória."""
+    return MarketAnalyzer(
+        data_dir=args.data_dir,
+        corr_universe=args.corr_universe,
+        corr_window=args.corr_window,
+        corr_format=args.corr_format,
+        corr_top_k=args.corr_top_k,
+        metrics=metrics,
+        incremental=args.incremental,
+        interval=args.analysis_interval,
+        rankings_top=args.rankings_top,
+        rankings_page_size=args.rankings_page_size,
+        risk_metrics=args.risk_metrics,
+        risk_free_rate=args.risk_free_rate,
+        workers=args.analysis_workers,
+        **data
+    )
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    metrics = run_metrics.metrics_from_args(args)
+    analyzer_from_args(args, metrics).run()
+    run_metrics.write_reports(metrics, args)
+
+
+if __name__ == '__main__':
+    main()
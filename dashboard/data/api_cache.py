@@ -0,0 +1,144 @@
+"""Cache em disco das respostas da API, endereçado pelo conteúdo da consulta.
+
+Cada resposta é gravada em `<cache_dir>/<ab>/<hash>.json`, onde o hash é o
+SHA-256 de (endpoint, query). As entradas expiram conforme o TTL do endpoint e
+o diretório é limitado em bytes, descartando primeiro as menos usadas (LRU).
+
+No modo offline o TTL é ignorado e nada é buscado na rede: uma consulta sem
+entrada no cache levanta CacheMiss.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Validade (s) das respostas por endpoint: preços mudam ao longo do pregão,
+# insights e recomendações quase não mudam no dia
+DEFAULT_TTLS = {
+    'YahooFinance/get_stock_chart': 15 * 60,
+    'YahooFinance/get_stock_insights': 24 * 60 * 60,
+}
+DEFAULT_TTL = 60 * 60
+
+# Parâmetros que variam a cada execução sem mudar a resposta (o fim da janela
+# incremental é sempre "agora") e por isso não entram na chave
+IGNORED_QUERY_KEYS = ('period2',)
+
+CACHE_DIR = 'data/cache'
+
+
+class CacheMiss(Exception):
+    """Consulta sem resposta no cache durante o modo offline."""
+
+
+class ResponseCache:
+    """Cache LRU de respostas em disco, seguro para uso por várias threads."""
+
+    def __init__(self, cache_dir=CACHE_DIR, ttls=None, max_bytes=200 * 1024 * 1024, offline=False, namespace=None):
+        self.cache_dir = cache_dir
+        # Separa respostas de provedores diferentes para a mesma consulta
+        self.namespace = namespace
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # chave → tamanho em bytes, da entrada menos para a mais recentemente usada
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        found = []
+        for bucket in os.scandir(self.cache_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name[:-len('.json')], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def key(self, endpoint, query):
+        query = {k: v for k, v in (query or {}).items() if k not in IGNORED_QUERY_KEYS}
+        parts = [endpoint, query] if self.namespace is None else [self.namespace, endpoint, query]
+        payload = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def _entry(self, endpoint, query):
+        """(chave, entrada) válida para a consulta, ou None."""
+        key = self.key(endpoint, query)
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        ttl = self.ttls.get(endpoint, DEFAULT_TTL)
+        if not self.offline and time.time() - entry['stored_at'] > ttl:
+            return None
+        return key, entry
+
+    def get(self, endpoint, query, *alternatives):
+        """Resposta guardada para a consulta, ou None se não houver uma válida.
+
+        Sem resposta para `query`, vale a da primeira de `alternatives` que
+        tiver uma; a busca conta como um único acerto ou falha.
+        """
+        for candidate in (query, *alternatives):
+            found = self._entry(endpoint, candidate)
+            if found is not None:
+                break
+        else:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        key, entry = found
+        path = self._path(key)
+        with self.lock:
+            self.hits += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        # A data de modificação guarda a ordem LRU entre execuções
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['response']
+
+    def put(self, endpoint, query, response):
+        if self.offline:
+            return
+        key = self.key(endpoint, query)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'endpoint': endpoint, 'query': query, 'stored_at': time.time(), 'response': response}, f)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self._evict()
+
+    def _evict(self):
+        """Remove as entradas menos usadas até o cache caber em max_bytes (chamado com o lock)."""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
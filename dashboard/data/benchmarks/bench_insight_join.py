@@ -0,0 +1,70 @@
+"""Benchmark da junção ações × insights e ações × setores.
+
+Compara a busca linear por símbolo usada antes (`next(...)` sobre a lista de
+insights e `symbol in lista` por setor) com os índices por símbolo de
+market_analytics, para universos sintéticos de até 5 mil símbolos. Com os
+índices o tempo por símbolo fica constante (escala linear); com a busca
+linear ele cresce com o universo (escala quadrática).
+
+    python data/benchmarks/bench_insight_join.py [--sizes 625 1250 2500 5000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import market_analytics
+
+SECTORS = ['Tecnologia', 'Comércio', 'Automotivo', 'Financeiro', 'Energia']
+
+
+def synthetic_universe(n):
+    rows = [{'symbol': f'SYM{i:06d}', 'period_return': float(i % 17), 'volatility': float(i % 5)} for i in range(n)]
+    # Insights em ordem inversa, para que a busca linear percorra em média metade da lista
+    insights = [
+        {'symbol': row['symbol'], 'insights': {'recommendation': {'rating': 'BUY', 'targetPrice': 1.0}}}
+        for row in reversed(rows)
+    ]
+    sectors = {sector: [row['symbol'] for row in rows[i::len(SECTORS)]] for i, sector in enumerate(SECTORS)}
+    return rows, insights, sectors
+
+
+def linear_join(rows, insights, sectors):
+    for row in rows:
+        market_analytics.insight_fields(next((si for si in insights if si['symbol'] == row['symbol']), None))
+    for symbols in sectors.values():
+        [row for row in rows if row['symbol'] in symbols]
+
+
+def indexed_join(rows, insights, sectors):
+    insights_by_symbol = market_analytics.index_by_symbol(insights)
+    for row in rows:
+        market_analytics.insight_fields(insights_by_symbol.get(row['symbol']))
+    sector_of = {symbol: sector for sector, symbols in sectors.items() for symbol in symbols}
+    market_analytics.group_members(rows, sector_of)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[625, 1250, 2500, 5000])
+    parser.add_argument('--skip-linear', action='store_true', help='Mede apenas a junção indexada')
+    args = parser.parse_args()
+
+    print(f"{'símbolos':>9} {'linear (s)':>11} {'indexada (s)':>13} {'µs/símbolo':>11}")
+    for n in args.sizes:
+        rows, insights, sectors = synthetic_universe(n)
+        linear = float('nan') if args.skip_linear else timed(linear_join, rows, insights, sectors)
+        indexed = timed(indexed_join, rows, insights, sectors)
+        print(f"{n:>9} {linear:>11.4f} {indexed:>13.4f} {indexed / n * 1e6:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Benchmark das etapas da análise com universos sintéticos.
+
+Gera indices_data.json, stocks_data.json, stocks_insights.json e o
+armazenamento colunar para universos de N ações com históricos de vários anos
+(via data_providers.LocalProvider, com data final fixa, para que a entrada
+seja a mesma em qualquer commit) e mede cada etapa de MarketAnalyzer: tempo,
+pico de memória (RSS) e tamanho dos arquivos JSON de entrada e saída.
+
+Cada universo é analisado num processo separado, para que o pico de memória
+de um tamanho não contamine o do seguinte. Os universos gerados ficam em
+--workdir e são reaproveitados nas execuções seguintes.
+
+    python data/benchmarks/bench_pipeline.py [--sizes 10 1000 10000] [--years 2]
+        [--analysis-workers 4] [--output antes.json] [--compare antes.json]
+
+Universos de 100 mil ações (`--sizes 100000`) pedem alguns GB de memória e de
+disco por ano de histórico.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DATA_DIR)
+
+import numpy as np
+
+import analyze_market_data
+import collect_market_data
+import data_providers
+import timeseries_store
+
+SIZES = [10, 1000, 10000]
+TRADING_DAYS_PER_YEAR = 252
+# Fim fixo das séries sintéticas (2025-03-07, sexta-feira)
+END = 1741392000
+INPUT_FILES = ('indices_data.json', 'stocks_data.json', 'stocks_insights.json')
+
+
+def universe_dir(workdir, size, years):
+    return os.path.join(workdir, f'universe_{size}_{years:g}y')
+
+
+def write_json_list(path, records, after=None):
+    """Grava uma lista JSON registro a registro, sem montar a string inteira na memória."""
+    with open(path, 'w') as f:
+        f.write('[')
+        for i, record in enumerate(records):
+            if i:
+                f.write(', ')
+            json.dump(record, f)
+            if after:
+                after(record)
+        f.write(']')
+
+
+def chart_records(provider, assets):
+    """Registros no formato de stocks_data.json, gerados um a um pelo provedor local."""
+    for asset in assets:
+        query = collect_market_data.MarketDataCollector.chart_query(asset)
+        result = provider.chart_result(provider.chart_payload(query))
+        yield {
+            'symbol': asset['symbol'],
+            'name': asset['name'],
+            'region': asset['region'],
+            'meta': result['meta'],
+            'timestamp': result['timestamp'],
+            'indicators': result['indicators']
+        }
+
+
+def as_arrays(record):
+    indicators = record['indicators']
+    indicators['quote'] = [{k: np.asarray(v, dtype=np.float64) for k, v in indicators['quote'][0].items()}]
+    indicators['adjclose'] = [{'adjclose': np.asarray(indicators['adjclose'][0]['adjclose'], dtype=np.float64)}]
+    record['timestamp'] = np.asarray(record['timestamp'], dtype=np.int64)
+    return record
+
+
+def generate_universe(path, size, years):
+    """Gera os arquivos de entrada da análise em `path`, se ainda não existirem."""
+    marker = os.path.join(path, 'universe.json')
+    if os.path.exists(marker):
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(os.path.join(path, 'reference'))
+    shutil.copy(os.path.join(DATA_DIR, 'reference', 'taxonomy.json'), os.path.join(path, 'reference'))
+
+    provider = data_providers.LocalProvider(bars=int(years * TRADING_DAYS_PER_YEAR), end=END)
+    stocks = data_providers.synthetic_assets(size)
+    for name, assets, store in (('indices_data.json', collect_market_data.INDICES, 'indices'),
+                                ('stocks_data.json', stocks, 'stocks')):
+        # Cada registro vai para o JSON com listas e fica na memória só como arrays,
+        # bem mais compactos, até a gravação do armazenamento colunar
+        records = []
+        write_json_list(os.path.join(path, name), chart_records(provider, assets),
+                        after=lambda record: records.append(as_arrays(record)))
+        timeseries_store.write_store(records, os.path.join(path, 'timeseries', store))
+
+    write_json_list(os.path.join(path, 'stocks_insights.json'), (
+        {'symbol': stock['symbol'], 'name': stock['name'],
+         'insights': provider.insights_result(provider.insights_payload({'symbol': stock['symbol']}))}
+        for stock in stocks
+    ))
+    with open(marker, 'w') as f:
+        json.dump({'size': size, 'years': years, 'end': END}, f)
+
+
+def peak_rss_mb():
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_stages(path, corr_universe, workers=1):
+    """Executa as etapas da análise sobre `path` e devolve tempo e pico de memória de cada uma.
+
+    Com `workers` > 1, o pico de memória é só o do processo principal.
+    """
+    analyzer = analyze_market_data.MarketAnalyzer(data_dir=path, corr_universe=corr_universe, workers=workers)
+
+    def load():
+        return (analyzer.indices_data, analyzer.stocks_data, analyzer.stocks_insights,
+                analyzer.insights_by_symbol, analyzer.taxonomy)
+
+    stages = [
+        ('load', load),
+        ('indices', analyzer.analyze_indices),
+        ('stocks', analyzer.analyze_stocks),
+        # Pacote de risco (--risk-metrics) medido à parte, fora da etapa de ações
+        ('risk', analyzer.stock_risk_fields),
+        ('regions', analyzer.analyze_regions),
+        ('correlations', analyzer.analyze_correlations),
+        ('sectors', analyzer.analyze_sectors),
+        ('summary', analyzer.build_market_summary),
+        ('rankings', analyzer.build_rankings),
+        ('save', analyzer.save),
+    ]
+    results = {}
+    for name, stage in stages:
+        # As mensagens de progresso da análise não entram na medição
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            stage()
+            elapsed = time.perf_counter() - start
+        results[name] = {'seconds': round(elapsed, 4), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+    analyzer.close()
+    return results
+
+
+def file_sizes(path, names):
+    return {name: os.path.getsize(os.path.join(path, name))
+            for name in names if os.path.exists(os.path.join(path, name))}
+
+
+def measure(size, years, workdir, corr_universe, workers=1):
+    path = universe_dir(workdir, size, years)
+    start = time.perf_counter()
+    generate_universe(path, size, years)
+    generated = time.perf_counter() - start
+
+    # Processo novo por universo: o pico de RSS é o da análise deste tamanho
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-stages', path, '--corr-universe', corr_universe,
+         '--analysis-workers', str(workers)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    stages = json.loads(output.strip().splitlines()[-1])
+
+    analysis_dir = os.path.join(path, 'analysis')
+    return {
+        'size': size,
+        'years': years,
+        'generate_seconds': round(generated, 2),
+        'stages': stages,
+        'total_seconds': round(sum(stage['seconds'] for stage in stages.values()), 4),
+        'peak_rss_mb': max(stage['peak_rss_mb'] for stage in stages.values()),
+        'input_bytes': file_sizes(path, INPUT_FILES),
+        'output_bytes': file_sizes(analysis_dir, sorted(os.listdir(analysis_dir))),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DATA_DIR,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    stage_names = list(report['results'][0]['stages']) if report['results'] else []
+    print(f"commit {report['commit']}, {report['years']} ano(s) de histórico, correlação: {report['corr_universe']}, "
+          f"processos: {report.get('analysis_workers', 1)}")
+    print(f"{'símbolos':>9} " + ' '.join(f'{name:>12}' for name in stage_names) + f" {'total (s)':>10} {'RSS (MB)':>9}")
+    for result in report['results']:
+        stages = ' '.join(f"{result['stages'][name]['seconds']:>12.4f}" for name in stage_names)
+        print(f"{result['size']:>9} {stages} {result['total_seconds']:>10.3f} {result['peak_rss_mb']:>9.1f}")
+    print()
+    print(f"{'símbolos':>9} " + ' '.join(f'{name:>22}' for name in INPUT_FILES) + f" {'saída (bytes)':>14}")
+    for result in report['results']:
+        inputs = ' '.join(f"{result['input_bytes'].get(name, 0):>22}" for name in INPUT_FILES)
+        print(f"{result['size']:>9} {inputs} {sum(result['output_bytes'].values()):>14}")
+
+
+def print_comparison(report, baseline):
+    """Razão atual/base do tempo de cada etapa e do pico de memória, por tamanho."""
+    base_by_size = {result['size']: result for result in baseline['results']}
+    print()
+    print(f"comparação com {baseline.get('commit')} (atual / base; > 1 é mais lento)")
+    for key in ('years', 'corr_universe', 'analysis_workers'):
+        if baseline.get(key, 1 if key == 'analysis_workers' else None) != report[key]:
+            print(f"aviso: {key} difere da base ({baseline.get(key)} x {report[key]})")
+    for result in report['results']:
+        base = base_by_size.get(result['size'])
+        if base is None:
+            continue
+        ratios = []
+        for name, stage in result['stages'].items():
+            base_seconds = base['stages'].get(name, {}).get('seconds')
+            if base_seconds:
+                ratios.append(f"{name} {stage['seconds'] / base_seconds:.2f}x")
+        ratios.append(f"RSS {result['peak_rss_mb'] / base['peak_rss_mb']:.2f}x")
+        print(f"{result['size']:>9}  " + ', '.join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Números de ações dos universos')
+    parser.add_argument('--years', type=float, default=2.0, help='Anos de histórico diário por símbolo')
+    parser.add_argument('--corr-universe', choices=['indices', 'all'], default='indices',
+                        help="Universo da correlação; 'all' mostra o custo quadrático em símbolos")
+    parser.add_argument('--analysis-workers', type=int, default=1,
+                        help='Processos da análise (0 = todos os núcleos), para medir a escala com o modo paralelo')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'rp_finances_bench'),
+                        help='Onde os universos sintéticos são gerados e reaproveitados')
+    parser.add_argument('--output', help='Grava os resultados em JSON, para comparar com outro commit')
+    parser.add_argument('--compare', help='Resultados JSON de outra execução para comparar')
+    parser.add_argument('--run-stages', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stages:
+        print(json.dumps(run_stages(args.run_stages, args.corr_universe, args.analysis_workers)))
+        return
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'years': args.years,
+        'corr_universe': args.corr_universe,
+        'analysis_workers': args.analysis_workers,
+        'results': [measure(size, args.years, args.workdir, args.corr_universe, args.analysis_workers)
+                    for size in args.sizes],
+    }
+    print_report(report)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
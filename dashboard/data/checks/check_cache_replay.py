@@ -0,0 +1,93 @@
+"""Verifica que o cache de respostas cobre uma nova coleta e o modo offline.
+
+Com o provedor local, coleta um pequeno universo sintético em que um símbolo
+falha e, no mesmo diretório, repete a coleta: só o símbolo que falhou pode
+voltar ao provedor. Depois, uma coleta seguinte e uma com --offline não podem
+fazer nenhuma chamada nem registrar falhas. Roda nos modos em memória e
+streaming; termina com erro se alguma verificação falhar.
+
+    python data/checks/check_cache_replay.py [--stocks 4]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_cache
+import collect_market_data
+import data_providers
+import run_metrics
+
+# Data final fixa das séries sintéticas (2025-04-07)
+END = 1744000000
+
+
+class CountingProvider(data_providers.LocalProvider):
+    """Provedor local que registra os símbolos pedidos e falha para `failing`."""
+
+    def __init__(self, failing=()):
+        super().__init__(end=END, max_batch_size=1)
+        self.failing = set(failing)
+        self.calls = []
+
+    def call_batch(self, endpoint, queries):
+        self.calls += [query['symbol'] for query in queries]
+        if any(query['symbol'] in self.failing for query in queries):
+            raise ConnectionError('falha simulada')
+        return super().call_batch(endpoint, queries)
+
+
+def collect(data_dir, stocks, failing=(), offline=False, stream=False):
+    """Uma coleta; devolve (símbolos pedidos ao provedor, contadores da execução)."""
+    provider = CountingProvider(failing)
+    cache = api_cache.ResponseCache(os.path.join(data_dir, 'cache'), offline=offline, namespace=provider.name)
+    metrics = run_metrics.RunMetrics()
+    collector = collect_market_data.MarketDataCollector(
+        data_dir, indices=[], stocks=stocks, provider=provider, response_cache=cache, offline=offline,
+        workers=1, rate_limit=0, max_retries=0, metrics=metrics, stream=stream)
+    with contextlib.redirect_stdout(io.StringIO()):
+        collector.run()
+    return provider.calls, metrics.counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stocks', type=int, default=4, help='Ações no universo sintético')
+    args = parser.parse_args()
+
+    stocks = data_providers.synthetic_assets(args.stocks)
+    failing = stocks[1]['symbol']
+    errors = []
+    for stream in (False, True):
+        mode = 'streaming' if stream else 'em memória'
+        data_dir = tempfile.mkdtemp(prefix='rp_finances_cache_')
+        try:
+            collect(data_dir, stocks, failing={failing}, stream=stream)
+            runs = [
+                ('nova coleta após falha', collect(data_dir, stocks, stream=stream), {failing}),
+                ('nova coleta', collect(data_dir, stocks, stream=stream), set()),
+                ('offline', collect(data_dir, stocks, offline=True, stream=stream), set()),
+            ]
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+        for label, (calls, counters), expected in runs:
+            failures = {k: v for k, v in counters.items() if k.startswith('failures')}
+            ok = set(calls) == expected and not failures
+            print(f"{mode:>10} | {label:<24} | chamadas: {len(calls):>2} | "
+                  f"cache: {counters.get('cache.hits', 0)} acertos, {counters.get('cache.misses', 0)} faltas | "
+                  f"{'ok' if ok else 'FALHOU'}")
+            if not ok:
+                errors.append(f'{mode}, {label}: chamadas {sorted(calls)}, falhas {failures}')
+
+    if errors:
+        sys.exit('\n'.join(errors))
+
+
+if __name__ == '__main__':
+    main()
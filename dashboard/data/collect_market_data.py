@@ -1,27 +1,61 @@
-import sys
-sys.path.append('/opt/.manus/.sandbox-runtime')
-from data_api import ApiClient
+"""Coleta de dados de índices e ações globais.
+
+Pode ser usado como script (`python data/collect_market_data.py`, a partir de
+`dashboard/`) ou importado: `MarketDataCollector.run` grava os arquivos em
+`data_dir` e devolve os dados coletados, que podem ir direto para
+`analyze_market_data.MarketAnalyzer` sem serem relidos do disco.
+
+Com `--interval` (1m, 5m, 1h, ...) as séries são coletadas em barras
+intradiárias; a análise as reamostra por calendário (veja ohlcv_resample).
+Use um `--data-dir` próprio para cada intervalo.
+"""
+import argparse
+import bisect
+import calendar
+import datetime
 import json
 import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api_cache
+import data_providers
+import insights_store
+import ohlcv_resample
+import record_stream
+import run_metrics
+import timeseries_store
 
-client = ApiClient()
+DATA_DIR = 'data'
+
+# Regiões aceitas pelo parâmetro `region` da API; as demais consultam com 'US'
+API_REGIONS = {'US', 'BR', 'AU', 'CA', 'FR', 'DE', 'HK', 'IN', 'IT', 'ES', 'GB', 'SG'}
+
+# Histórico pedido na primeira coleta de cada intervalo e mantido nas seguintes
+# (trim_series); a API limita as barras de 1 minuto aos últimos 7 dias e as
+# intradiárias em geral aos últimos 60
+DEFAULT_RANGES = {'1m': '5d', '1wk': '1y'}
+DEFAULT_RANGE = '1mo'
 
 # Lista de índices globais importantes
-indices = [
+INDICES = [
     {"symbol": "^GSPC", "name": "S&P 500", "region": "US"},           # S&P 500 (EUA)
     {"symbol": "^DJI", "name": "Dow Jones", "region": "US"},          # Dow Jones (EUA)
     {"symbol": "^IXIC", "name": "Nasdaq", "region": "US"},            # Nasdaq (EUA)
     {"symbol": "^FTSE", "name": "FTSE 100", "region": "GB"},          # FTSE 100 (Reino Unido)
     {"symbol": "^GDAXI", "name": "DAX", "region": "DE"},              # DAX (Alemanha)
     {"symbol": "^FCHI", "name": "CAC 40", "region": "FR"},            # CAC 40 (França)
-    {"symbol": "^N225", "name": "Nikkei 225", "region": "US"},        # Nikkei 225 (Japão)
+    {"symbol": "^N225", "name": "Nikkei 225", "region": "JP"},        # Nikkei 225 (Japão)
     {"symbol": "^HSI", "name": "Hang Seng", "region": "HK"},          # Hang Seng (Hong Kong)
     {"symbol": "^BVSP", "name": "Ibovespa", "region": "BR"},          # Ibovespa (Brasil)
-    {"symbol": "000001.SS", "name": "SSE Composite", "region": "US"}  # SSE Composite (China)
+    {"symbol": "000001.SS", "name": "SSE Composite", "region": "CN"}  # SSE Composite (China)
 ]
 
 # Lista de ações importantes globalmente
-stocks = [
+STOCKS = [
     {"symbol": "AAPL", "name": "Apple", "region": "US"},
     {"symbol": "MSFT", "name": "Microsoft", "region": "US"},
     {"symbol": "AMZN", "name": "Amazon", "region": "US"},
@@ -34,94 +68,637 @@ stocks = [
     {"symbol": "PETR4.SA", "name": "Petrobras", "region": "BR"}
 ]
 
-# Coletar dados de índices
-print("Coletando dados de índices globais...")
-indices_data = []
-for index in indices:
-    try:
-        data = client.call_api('YahooFinance/get_stock_chart', query={
-            'symbol': index["symbol"],
-            'region': index["region"],
-            'interval': '1d',
-            'range': '1mo',
+# Mensagens das threads de coleta saem uma por linha, sem se misturar
+_print_lock = threading.Lock()
+
+
+def log(message):
+    with _print_lock:
+        print(message)
+
+
+class HostRateLimiter:
+    """Espaça as chamadas de cada host para no máximo `rate` requisições por segundo."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def last_timestamp(record):
+    timestamps = record.get('timestamp') if record else None
+    return max(timestamps) if timestamps else None
+
+
+def merge_series(stored, fresh):
+    """Junta as barras novas à série armazenada, sem timestamps duplicados e em ordem.
+
+    Em caso de duplicata vale a barra nova, que corrige a última barra (parcial) salva.
+    """
+    bars = {}
+    quote_keys = []
+    has_adjclose = False
+    for record in (stored, fresh):
+        indicators = record.get('indicators', {})
+        quote = (indicators.get('quote') or [{}])[0]
+        adjclose = (indicators.get('adjclose') or [{}])[0].get('adjclose', [])
+        has_adjclose = has_adjclose or bool(indicators.get('adjclose'))
+        quote_keys += [k for k in quote if k not in quote_keys]
+        for i, ts in enumerate(record.get('timestamp', [])):
+            bars[ts] = (
+                {k: v[i] for k, v in quote.items() if i < len(v)},
+                adjclose[i] if i < len(adjclose) else None
+            )
+
+    timestamps = sorted(bars)
+    indicators = {'quote': [{k: [bars[ts][0].get(k) for ts in timestamps] for k in quote_keys}]}
+    if has_adjclose:
+        indicators['adjclose'] = [{'adjclose': [bars[ts][1] for ts in timestamps]}]
+
+    merged = dict(fresh)
+    merged['timestamp'] = timestamps
+    merged['indicators'] = indicators
+    return merged
+
+
+def range_start(history_range, timestamps, gmtoffset=0):
+    """Primeiro timestamp dentro de `history_range` ('5d', '1mo', '1y', 'ytd', ...) contado até a última barra.
+
+    Ranges em dias contam pregões (dias com barras), como na API; os demais
+    voltam no calendário a partir da data local da última barra. None para
+    'max' ou um range desconhecido, que não limitam o histórico.
+    """
+    match = re.fullmatch(r'(\d+)(d|wk|mo|y)|ytd', history_range or '')
+    if not match or not timestamps:
+        return None
+    count, unit = int(match[1] or 0), match[2]
+    if unit == 'd':
+        days = sorted({(ts + gmtoffset) // ohlcv_resample.SECONDS_PER_DAY for ts in timestamps})
+        return days[-count] * ohlcv_resample.SECONDS_PER_DAY - gmtoffset if 0 < count <= len(days) else None
+
+    last = datetime.datetime.fromtimestamp(timestamps[-1] + gmtoffset, datetime.timezone.utc).date()
+    if unit == 'wk':
+        start = last - datetime.timedelta(weeks=count)
+    elif unit in ('mo', 'y'):
+        months = last.year * 12 + last.month - 1 - count * (12 if unit == 'y' else 1)
+        year, month = divmod(months, 12)
+        start = datetime.date(year, month + 1, min(last.day, calendar.monthrange(year, month + 1)[1]))
+    else:
+        start = datetime.date(last.year, 1, 1)
+    return calendar.timegm(start.timetuple()) - gmtoffset
+
+
+def trim_series(record, history_range):
+    """Descarta as barras anteriores a `history_range` (ver range_start).
+
+    A coleta incremental só acrescenta barras; sem o corte, a série salva
+    cresceria a cada execução e o retorno do período e a volatilidade da
+    análise deixariam de cobrir o range configurado.
+    """
+    timestamps = record.get('timestamp') or []
+    start = range_start(history_range, timestamps, int((record.get('meta') or {}).get('gmtoffset') or 0))
+    first = bisect.bisect_left(timestamps, start) if start is not None else 0
+    if first == 0:
+        return record
+
+    indicators = dict(record.get('indicators', {}))
+    indicators['quote'] = [{k: v[first:] for k, v in quote.items()} for quote in indicators.get('quote') or []]
+    if indicators.get('adjclose'):
+        indicators['adjclose'] = [{k: v[first:] for k, v in adj.items()} for adj in indicators['adjclose']]
+    trimmed = dict(record)
+    trimmed['timestamp'] = timestamps[first:]
+    trimmed['indicators'] = indicators
+    return trimmed
+
+
+def batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class MarketDataCollector:
+    """Coleta séries de preços e insights e grava os arquivos em `data_dir`.
+
+    Cada instância guarda seu próprio cache, limitador de taxa e histórico
+    salvo, então várias coletas podem rodar no mesmo processo sem estado global.
+    Os dados vêm de `provider` (por padrão a API do Yahoo Finance), em lotes de
+    até `provider.max_batch_size` símbolos por chamada.
+
+    Com `stream=True`, os registros são gravados em NDJSON à medida que cada
+    lote termina (veja record_stream) e o histórico salvo é lido por símbolo,
+    sob demanda, de modo que a memória não cresce com o universo.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, indices=None, stocks=None, workers=8, rate_limit=5.0,
+                 max_retries=3, backoff=1.0, full_refresh=False, response_cache=None, offline=False,
+                 provider=None, metrics=None, stream=False, interval='1d', history_range=None):
+        if offline and response_cache is None:
+            raise ValueError('o modo offline precisa de um cache de respostas')
+        self.data_dir = data_dir
+        self.archive_dir = os.path.join(data_dir, 'insights_archive')
+        self.indices = INDICES if indices is None else indices
+        self.stocks = STOCKS if stocks is None else stocks
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.full_refresh = full_refresh
+        self.response_cache = response_cache
+        self.offline = offline
+        self.provider = provider or data_providers.YahooFinanceProvider()
+        self.batch_size = max(1, self.provider.max_batch_size)
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.metrics = metrics or run_metrics.RunMetrics()
+        self.stream = stream
+        self.interval = interval
+        self.history_range = history_range or DEFAULT_RANGES.get(interval, DEFAULT_RANGE)
+
+        self.stored_indices = {}
+        self.stored_stocks = {}
+        self.stored_insights = {}
+        # Registros gravados pela última coleta desta instância, por caminho:
+        # (mtime, registros por símbolo). Com --every, o ciclo seguinte os usa
+        # como histórico salvo em vez de reler o arquivo, se ele não mudou.
+        self.written = {}
+
+    def path(self, *parts):
+        return os.path.join(self.data_dir, *parts)
+
+    def _call_provider(self, endpoint, queries):
+        """Uma chamada em lote ao provedor, repetida com backoff exponencial em caso de erro."""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(self.provider.host)
+            start = time.perf_counter()
+            try:
+                data = self.provider.call_batch(endpoint, queries)
+                self.metrics.observe_call(endpoint, time.perf_counter() - start, batch_size=len(queries))
+                return data
+            except Exception:
+                self.metrics.observe_call(endpoint, time.perf_counter() - start, ok=False, batch_size=len(queries))
+                if attempt == self.max_retries:
+                    raise
+                self.metrics.retry([query.get('symbol') for query in queries])
+                # Backoff exponencial com jitter para não sincronizar as threads
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def call_api_batch(self, endpoint, queries, cache_keys=None):
+        """Respostas de várias consultas a um endpoint, na ordem das consultas.
+
+        Respostas válidas no cache são devolvidas sem acessar o provedor; as
+        demais são pedidas em lotes de até `batch_size`. Uma consulta que falhou
+        tem a exceção no lugar da resposta (api_cache.CacheMiss no modo offline).
+
+        `cache_keys`, se dado, tem para cada consulta a lista de consultas usadas
+        como chave no cache: a resposta é gravada sob a primeira e lida da
+        primeira que tiver uma.
+        """
+        cache_keys = cache_keys or [[query] for query in queries]
+        responses = [None] * len(queries)
+        pending = list(range(len(queries)))
+        if self.response_cache:
+            pending = []
+            for i, query in enumerate(queries):
+                cached = self.response_cache.get(endpoint, *cache_keys[i])
+                if cached is not None:
+                    responses[i] = cached
+                elif self.offline:
+                    responses[i] = api_cache.CacheMiss(f"{endpoint} {query.get('symbol')} não está no cache")
+                else:
+                    pending.append(i)
+
+        for chunk in batches(pending, self.batch_size):
+            try:
+                fetched = self._call_provider(endpoint, [queries[i] for i in chunk])
+            except Exception as e:
+                fetched = [e] * len(chunk)
+            for i, data in zip(chunk, fetched):
+                responses[i] = data
+                if self.response_cache and data and not isinstance(data, Exception):
+                    self.response_cache.put(endpoint, cache_keys[i][0], data)
+        return responses
+
+    def call_api(self, endpoint, query):
+        """Resposta de uma consulta; levanta o erro se ela falhar."""
+        response = self.call_api_batch(endpoint, [query])[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def load_stored(self, path):
+        """Lê registros já salvos, indexados por símbolo (vazio em full_refresh).
+
+        Usa o mais recente entre o arquivo .json e o .ndjson; no modo streaming,
+        um .ndjson é lido sob demanda em vez de carregado inteiro. Um arquivo
+        gravado pela coleta anterior e não alterado desde então não é relido.
+        """
+        path = record_stream.newest(path)
+        if self.full_refresh or path is None:
+            return {}
+        written = self.written.get(path)
+        if written is not None and written[0] == os.stat(path).st_mtime_ns:
+            return written[1]
+        try:
+            self.metrics.read(path)
+            if path.endswith(record_stream.NDJSON_SUFFIX):
+                reader = record_stream.NDJSONReader(path)
+                if self.stream:
+                    reader.symbols  # monta o índice já, para que erros de leitura apareçam aqui
+                    return reader
+                return {record['symbol']: record for record in reader}
+            with open(path, 'r') as f:
+                records = json.load(f)
+            return {record['symbol']: record for record in records}
+        except (ValueError, KeyError, TypeError) as e:
+            log(f"Ignorando {path} ilegível, histórico completo será baixado: {str(e)}")
+            return {}
+
+    @staticmethod
+    def chart_query(asset, stored=None, interval='1d', history_range=DEFAULT_RANGE):
+        """Consulta da série de um ativo: `history_range` (o último mês) ou, com histórico salvo, só as barras novas."""
+        query = {
+            'symbol': asset["symbol"],
+            'region': asset["region"] if asset["region"] in API_REGIONS else 'US',
+            'interval': interval,
             'includeAdjustedClose': True
-        })
-        
-        if data and 'chart' in data and 'result' in data['chart'] and data['chart']['result']:
-            result = data['chart']['result'][0]
-            index_data = {
-                'symbol': index["symbol"],
-                'name': index["name"],
-                'region': index["region"],
-                'meta': result.get('meta', {}),
-                'timestamp': result.get('timestamp', []),
-                'indicators': result.get('indicators', {})
-            }
-            indices_data.append(index_data)
-            print(f"Dados coletados para {index['name']}")
+        }
+        since = last_timestamp(stored)
+        if since:
+            query['period1'] = since
+            query['period2'] = int(time.time())
         else:
-            print(f"Falha ao coletar dados para {index['name']}")
-    except Exception as e:
-        print(f"Erro ao coletar dados para {index['name']}: {str(e)}")
-
-# Salvar dados de índices
-with open('data/indices_data.json', 'w') as f:
-    json.dump(indices_data, f)
-print("Dados de índices salvos em data/indices_data.json")
-
-# Coletar dados de ações
-print("Coletando dados de ações importantes...")
-stocks_data = []
-stocks_insights = []
-for stock in stocks:
-    try:
-        # Dados de preços
-        data = client.call_api('YahooFinance/get_stock_chart', query={
-            'symbol': stock["symbol"],
-            'region': stock["region"],
-            'interval': '1d',
-            'range': '1mo',
-            'includeAdjustedClose': True
-        })
-        
-        if data and 'chart' in data and 'result' in data['chart'] and data['chart']['result']:
-            result = data['chart']['result'][0]
-            stock_data = {
-                'symbol': stock["symbol"],
-                'name': stock["name"],
-                'region': stock["region"],
+            query['range'] = history_range
+        return query
+
+    def chart_cache_keys(self, query):
+        """Chaves de cache de uma consulta de série, sem a janela incremental.
+
+        period1 (a última barra salva) muda a cada execução; a chave é a consulta
+        estável (símbolo, região, intervalo), marcada se incremental. Uma consulta
+        incremental também aceita a resposta completa guardada (as barras já
+        salvas são descartadas em merge_series), mas a completa não aceita uma
+        incremental, que não traz o histórico inteiro.
+        """
+        stable = {k: v for k, v in query.items() if k not in ('period1', 'period2')}
+        if 'range' in query:
+            return [stable]
+        return [dict(stable, incremental=True), dict(stable, range=self.history_range)]
+
+    def same_interval(self, stored):
+        """Se o histórico salvo tem barras do intervalo coletado (outro intervalo não é mesclado)."""
+        seconds = ohlcv_resample.INTERVAL_SECONDS
+        return seconds.get(ohlcv_resample.granularity(stored)) == seconds[self.interval]
+
+    def fetch_charts(self, assets, stored_records):
+        """Séries de preços de vários ativos, fundidas ao histórico salvo de cada um.
+
+        Cada item é o registro do ativo, None se o provedor não trouxer
+        resultado, ou a exceção da consulta que falhou.
+        """
+        stored_records = [stored if stored and self.same_interval(stored) else None for stored in stored_records]
+        queries = [self.chart_query(asset, stored, self.interval, self.history_range)
+                   for asset, stored in zip(assets, stored_records)]
+        payloads = self.call_api_batch(data_providers.CHART_ENDPOINT, queries,
+                                       [self.chart_cache_keys(query) for query in queries])
+        results = []
+        for asset, stored, payload in zip(assets, stored_records, payloads):
+            if isinstance(payload, Exception):
+                results.append(payload)
+                continue
+            result = self.provider.chart_result(payload)
+            if result is None:
+                results.append(None)
+                continue
+            asset_data = {
+                'symbol': asset["symbol"],
+                'name': asset["name"],
+                'region': asset["region"],
                 'meta': result.get('meta', {}),
                 'timestamp': result.get('timestamp', []),
                 'indicators': result.get('indicators', {})
             }
-            stocks_data.append(stock_data)
-            
-            # Insights
-            insights = client.call_api('YahooFinance/get_stock_insights', query={
-                'symbol': stock["symbol"]
-            })
-            
-            if insights and 'finance' in insights and 'result' in insights['finance']:
-                stocks_insights.append({
+            results.append(trim_series(merge_series(stored, asset_data), self.history_range)
+                           if stored else asset_data)
+        return results
+
+    def fetch_chart(self, asset, stored=None):
+        """Série de preços de um ativo; retorna None se o provedor não trouxer resultado."""
+        result = self.fetch_charts([asset], [stored])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def collect_index_batch(self, batch):
+        stored_records = [self.stored_indices.get(index['symbol']) for index in batch]
+        collected = []
+        for index, stored, index_data in zip(batch, stored_records, self.fetch_charts(batch, stored_records)):
+            if isinstance(index_data, Exception):
+                log(f"Erro ao coletar dados para {index['name']}: {str(index_data)}")
+                self.metrics.failure(index['symbol'], 'chart', index_data)
+            elif index_data:
+                log(f"Dados coletados para {index['name']}")
+                collected.append(index_data)
+                continue
+            else:
+                log(f"Falha ao coletar dados para {index['name']}")
+                self.metrics.failure(index['symbol'], 'chart')
+            # Em modo incremental, uma falha mantém o histórico já salvo
+            collected.append(stored)
+        return collected
+
+    def collect_stock_batch(self, batch):
+        """Retorna (dados de preço, insights) de cada ação do lote; qualquer um pode ser None."""
+        stored_records = [self.stored_stocks.get(stock['symbol']) for stock in batch]
+        results = [(stored, self.stored_insights.get(stock['symbol']))
+                   for stock, stored in zip(batch, stored_records)]
+
+        # Dados de preços
+        with_prices = []
+        for i, (stock, stock_data) in enumerate(zip(batch, self.fetch_charts(batch, stored_records))):
+            if isinstance(stock_data, Exception):
+                log(f"Erro ao coletar dados para {stock['name']}: {str(stock_data)}")
+                self.metrics.failure(stock['symbol'], 'chart', stock_data)
+                continue
+            if not stock_data:
+                self.metrics.failure(stock['symbol'], 'chart')
+            stock_data = stock_data or stored_records[i]
+            if not stock_data:
+                log(f"Falha ao coletar dados para {stock['name']}")
+                results[i] = (None, None)
+                continue
+            results[i] = (stock_data, results[i][1])
+            with_prices.append(i)
+
+        # Insights
+        payloads = self.call_api_batch(data_providers.INSIGHTS_ENDPOINT,
+                                       [{'symbol': batch[i]["symbol"]} for i in with_prices])
+        for i, payload in zip(with_prices, payloads):
+            stock = batch[i]
+            if isinstance(payload, Exception):
+                log(f"Erro ao coletar dados para {stock['name']}: {str(payload)}")
+                self.metrics.failure(stock['symbol'], 'insights', payload)
+                continue
+            insights = self.provider.insights_result(payload)
+            if insights is None:
+                self.metrics.failure(stock['symbol'], 'insights')
+            else:
+                # Relatórios vão para o arquivo por símbolo; a análise usa só a projeção
+                results[i] = (results[i][0], insights_store.slim_record({
                     'symbol': stock["symbol"],
                     'name': stock["name"],
-                    'insights': insights['finance']['result']
-                })
-            
-            print(f"Dados coletados para {stock['name']}")
+                    'insights': insights
+                }, self.archive_dir))
+            log(f"Dados coletados para {stock['name']}")
+        return results
+
+    def collect_index(self, index):
+        return self.collect_index_batch([index])[0]
+
+    def collect_stock(self, stock):
+        return self.collect_stock_batch([stock])[0]
+
+    def write_json(self, name, data, label):
+        path = self.path(name)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        self.written[path] = (os.stat(path).st_mtime_ns, {record['symbol']: record for record in data})
+        self.metrics.written(path)
+        log(f"{label} salvos em {path}")
+
+    def write_store(self, records, dataset, label):
+        path = self.path('timeseries', dataset)
+        timeseries_store.write_store(records, path)
+        self.metrics.written(path)
+        log(f"Série colunar de {label} salva em {path}")
+
+    @run_metrics.stage('collect')
+    def run(self):
+        """Coleta índices e ações, grava os arquivos e devolve os dados em memória.
+
+        O retorno tem as chaves indices_data, stocks_data e stocks_insights,
+        as mesmas aceitas por `MarketAnalyzer`.
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        cache_hits, cache_misses = (self.response_cache.hits, self.response_cache.misses) if self.response_cache else (0, 0)
+
+        # Histórico já salvo, usado para buscar só as barras que faltam
+        with self.metrics.stage('collect.load_stored'):
+            self.stored_indices = self.load_stored(self.path('indices_data.json'))
+            self.stored_stocks = self.load_stored(self.path('stocks_data.json'))
+            self.stored_insights = self.load_stored(self.path('stocks_insights.json'))
+        if self.stored_indices or self.stored_stocks:
+            log("Modo incremental: buscando apenas barras após o último timestamp salvo")
+
+        if self.stream:
+            data, index_count, stock_count = self._collect_streaming()
         else:
-            print(f"Falha ao coletar dados para {stock['name']}")
-    except Exception as e:
-        print(f"Erro ao coletar dados para {stock['name']}: {str(e)}")
+            data = self._collect_in_memory()
+            index_count, stock_count = len(data['indices_data']), len(data['stocks_data'])
+
+        self.metrics.incr('symbols.indices', index_count)
+        self.metrics.incr('symbols.stocks', stock_count)
+        if self.response_cache:
+            self.metrics.incr('cache.hits', self.response_cache.hits - cache_hits)
+            self.metrics.incr('cache.misses', self.response_cache.misses - cache_misses)
+            log(f"Cache de respostas: {self.response_cache.hits} acertos, {self.response_cache.misses} faltas")
+
+        log("Coleta de dados concluída!")
+        return data
+
+    def _collect_in_memory(self):
+        # Os lotes terminam em qualquer ordem, mas executor.map devolve os resultados
+        # na ordem das listas de ativos, o que mantém os arquivos JSON determinísticos.
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Coletar dados de índices
+            log("Coletando dados de índices globais...")
+            with self.metrics.stage('collect.indices'):
+                index_batches = executor.map(self.collect_index_batch, batches(self.indices, self.batch_size))
+                indices_data = [d for batch in index_batches for d in batch if d]
+
+            # Salvar dados de índices
+            with self.metrics.stage('collect.write'):
+                self.write_json('indices_data.json', indices_data, "Dados de índices")
+                self.write_store(indices_data, 'indices', "índices")
+
+            # Coletar dados de ações
+            log("Coletando dados de ações importantes...")
+            with self.metrics.stage('collect.stocks'):
+                stock_batches = executor.map(self.collect_stock_batch, batches(self.stocks, self.batch_size))
+                stock_results = [result for batch in stock_batches for result in batch]
+
+        stocks_data = [data for data, _ in stock_results if data]
+        # Insights salvos por versões anteriores ainda podem ter o payload completo
+        stocks_insights = [insights_store.slim_record(insight, self.archive_dir)
+                           for _, insight in stock_results if insight]
+
+        # Salvar dados de ações
+        with self.metrics.stage('collect.write'):
+            self.write_json('stocks_data.json', stocks_data, "Dados de ações")
+            self.write_store(stocks_data, 'stocks', "ações")
+
+            # Salvar insights de ações
+            self.write_json('stocks_insights.json', stocks_insights, "Insights de ações")
+
+        return {
+            'indices_data': indices_data,
+            'stocks_data': stocks_data,
+            'stocks_insights': stocks_insights,
+        }
+
+    def _collect_streaming(self):
+        """Coleta gravando cada lote em NDJSON assim que termina; devolve ({}, índices, ações).
+
+        O dicionário vazio faz a análise ler os arquivos gravados, sob demanda.
+        """
+        writers = {
+            name: record_stream.NDJSONWriter(record_stream.ndjson_path(self.path(name)))
+            for name in ('indices_data.json', 'stocks_data.json', 'stocks_insights.json')
+        }
+        recovered = sum(writer.recovered for writer in writers.values())
+        if recovered:
+            log(f"Retomando coleta interrompida: {recovered} registros já gravados")
+        # Registros da execução interrompida são mais novos que os do último arquivo completo
+        self.stored_indices = record_stream.Layered(writers['indices_data.json'], self.stored_indices)
+        self.stored_stocks = record_stream.Layered(writers['stocks_data.json'], self.stored_stocks)
+        self.stored_insights = record_stream.Layered(writers['stocks_insights.json'], self.stored_insights)
+
+        def stream_indices(batch):
+            for record in self.collect_index_batch(batch):
+                if record:
+                    writers['indices_data.json'].write(record)
+
+        def stream_stocks(batch):
+            for stock_data, insight in self.collect_stock_batch(batch):
+                if stock_data:
+                    writers['stocks_data.json'].write(stock_data)
+                if insight:
+                    # Insights salvos por versões anteriores ainda podem ter o payload completo
+                    writers['stocks_insights.json'].write(insights_store.slim_record(insight, self.archive_dir))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            log("Coletando dados de índices globais...")
+            with self.metrics.stage('collect.indices'):
+                list(executor.map(stream_indices, batches(self.indices, self.batch_size)))
+            log("Coletando dados de ações importantes...")
+            with self.metrics.stage('collect.stocks'):
+                list(executor.map(stream_stocks, batches(self.stocks, self.batch_size)))
+
+        # Ordem final determinística: a das listas de ativos
+        outputs = (
+            ('indices_data.json', self.indices, "Dados de índices", ('indices', "índices")),
+            ('stocks_data.json', self.stocks, "Dados de ações", ('stocks', "ações")),
+            ('stocks_insights.json', self.stocks, "Insights de ações", None),
+        )
+        counts = {}
+        with self.metrics.stage('collect.write'):
+            for name, assets, label, store in outputs:
+                reader = writers[name].finish([asset['symbol'] for asset in assets])
+                self.metrics.written(reader.path)
+                log(f"{label} salvos em {reader.path}")
+                if store:
+                    # O armazenamento colunar é montado percorrendo o NDJSON, registro a registro
+                    self.write_store(reader, *store)
+                counts[name] = len(reader.symbols)
+        return {}, counts['indices_data.json'], counts['stocks_data.json']
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Coleta dados de índices e ações globais.')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='Diretório onde os dados coletados são lidos e gravados')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Número máximo de requisições simultâneas (1 = coleta sequencial)')
+    parser.add_argument('--rate-limit', type=float, default=5.0,
+                        help='Requisições por segundo permitidas por host (0 desativa o limite)')
+    parser.add_argument('--max-retries', type=int, default=3,
+                        help='Número de novas tentativas após erro em uma chamada')
+    parser.add_argument('--backoff', type=float, default=1.0,
+                        help='Espera base (s) entre tentativas, dobrada a cada nova tentativa')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='Baixa o histórico completo em vez de apenas as barras novas')
+    parser.add_argument('--interval', choices=list(ohlcv_resample.INTERVAL_SECONDS), default='1d',
+                        help='Intervalo das barras coletadas (1m, 5m, 1h, ... para séries intradiárias)')
+    parser.add_argument('--range', dest='history_range', default=None,
+                        help=f'Histórico da primeira coleta e janela mantida nas incrementais '
+                             f'(padrão: {DEFAULT_RANGE}; 5d para 1m, 1y para 1wk)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Diretório do cache de respostas da API (padrão: <data-dir>/cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Não lê nem grava respostas no cache')
+    parser.add_argument('--cache-max-mb', type=float, default=200,
+                        help='Tamanho máximo do cache; as respostas menos usadas são descartadas')
+    parser.add_argument('--chart-ttl', type=int, default=api_cache.DEFAULT_TTLS[data_providers.CHART_ENDPOINT],
+                        help='Validade (s) das séries de preços em cache')
+    parser.add_argument('--insights-ttl', type=int, default=api_cache.DEFAULT_TTLS[data_providers.INSIGHTS_ENDPOINT],
+                        help='Validade (s) dos insights em cache')
+    parser.add_argument('--offline', action='store_true',
+                        help='Usa apenas respostas do cache, mesmo expiradas, sem acessar a rede')
+    parser.add_argument('--stream', action='store_true',
+                        help='Grava os registros em NDJSON à medida que cada símbolo termina, '
+                             'com memória constante e retomada após uma queda')
+    data_providers.add_provider_arguments(parser)
+    run_metrics.add_metrics_arguments(parser)
+    return parser
+
+
+def collector_from_args(args, parser=None, metrics=None):
+    """Cria um MarketDataCollector com as opções da linha de comando."""
+    if args.no_cache and args.offline:
+        (parser or build_arg_parser()).error('--offline precisa do cache; remova --no-cache')
+
+    provider = data_providers.provider_from_args(args)
+    stocks = None
+    if args.synthetic_stocks is not None:
+        if args.provider != data_providers.LocalProvider.name:
+            (parser or build_arg_parser()).error('--synthetic-stocks exige --provider local')
+        stocks = data_providers.synthetic_assets(args.synthetic_stocks)
+
+    response_cache = None if args.no_cache else api_cache.ResponseCache(
+        args.cache_dir or os.path.join(args.data_dir, 'cache'),
+        ttls={
+            data_providers.CHART_ENDPOINT: args.chart_ttl,
+            data_providers.INSIGHTS_ENDPOINT: args.insights_ttl,
+        },
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        offline=args.offline,
+        # Respostas do provedor local não se misturam com as da API real
+        namespace=None if provider.name == data_providers.YahooFinanceProvider.name else provider.name
+    )
+    return MarketDataCollector(
+        data_dir=args.data_dir,
+        stocks=stocks,
+        provider=provider,
+        metrics=metrics,
+        stream=args.stream,
+        interval=args.interval,
+        history_range=args.history_range,
+        workers=args.workers,
+        rate_limit=args.rate_limit,
+        max_retries=args.max_retries,
+        backoff=args.backoff,
+        full_refresh=args.full_refresh,
+        response_cache=response_cache,
+        offline=args.offline
+    )
+
 
-# Salvar dados de ações
-with open('data/stocks_data.json', 'w') as f:
-    json.dump(stocks_data, f)
-print("Dados de ações salvos em data/stocks_data.json")
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    metrics = run_metrics.metrics_from_args(args)
+    data = collector_from_args(args, parser, metrics).run()
+    run_metrics.write_reports(metrics, args)
+    return data
 
-# Salvar insights de ações
-with open('data/stocks_insights.json', 'w') as f:
-    json.dump(stocks_insights, f)
-print("Insights de ações salvos em data/stocks_insights.json")
 
-print("Coleta de dados concluída!")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""Fontes de dados usadas pela coleta.
+
+Um provedor recebe consultas no formato da API do Yahoo Finance (endpoint e
+query) e devolve payloads no mesmo formato, que o coletor interpreta com
+`chart_result` e `insights_result`. Provedores cujo backend aceita vários
+símbolos por chamada informam isso em `max_batch_size` e atendem o lote
+inteiro em `call_batch`.
+
+- `YahooFinanceProvider`: a API real, via `data_api.ApiClient`.
+- `LocalProvider`: serve payloads gravados numa coleta anterior ou gerados
+  sinteticamente, com latência configurável; permite testar a coleta e a
+  análise com milhares de símbolos numa máquina sem rede.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import insights_store
+import ohlcv_resample
+import record_stream
+
+CHART_ENDPOINT = 'YahooFinance/get_stock_chart'
+INSIGHTS_ENDPOINT = 'YahooFinance/get_stock_insights'
+
+# Diretório do runtime que fornece o módulo data_api (ApiClient)
+DATA_API_RUNTIME = os.environ.get('DATA_API_RUNTIME', '/opt/.manus/.sandbox-runtime')
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# Pregão sintético: das 13h30 às 20h UTC (o horário regular de Nova York)
+SESSION_OPEN = 13 * 3600 + 30 * 60
+SESSION_SECONDS = 390 * 60
+
+
+class DataProvider:
+    """Interface dos provedores; as subclasses implementam `call` e, se puderem, `call_batch`."""
+
+    name = None
+    # Host usado pelo limitador de taxa do coletor
+    host = None
+    # Quantas consultas do mesmo endpoint cabem numa chamada
+    max_batch_size = 1
+
+    def call(self, endpoint, query):
+        raise NotImplementedError
+
+    def call_batch(self, endpoint, queries):
+        """Uma resposta por consulta, na mesma ordem; por padrão, uma chamada por consulta."""
+        return [self.call(endpoint, query) for query in queries]
+
+    @staticmethod
+    def chart_result(payload):
+        """Série de um payload de CHART_ENDPOINT ({meta, timestamp, indicators}), ou None."""
+        if payload and 'chart' in payload and 'result' in payload['chart'] and payload['chart']['result']:
+            return payload['chart']['result'][0]
+        return None
+
+    @staticmethod
+    def insights_result(payload):
+        """Insights de um payload de INSIGHTS_ENDPOINT, ou None."""
+        if payload and 'finance' in payload and 'result' in payload['finance']:
+            return payload['finance']['result']
+        return None
+
+
+class YahooFinanceProvider(DataProvider):
+    """API do Yahoo Finance, um símbolo por chamada."""
+
+    name = 'yahoo'
+    host = 'YahooFinance'
+
+    def __init__(self):
+        # Um cliente por thread, já que o ApiClient não garante ser thread-safe
+        self._thread_local = threading.local()
+
+    def client(self):
+        if not hasattr(self._thread_local, 'client'):
+            # Importado só quando há acesso à rede, para o modo offline rodar sem o runtime da API
+            if DATA_API_RUNTIME not in sys.path:
+                sys.path.append(DATA_API_RUNTIME)
+            from data_api import ApiClient
+            self._thread_local.client = ApiClient()
+        return self._thread_local.client
+
+    def call(self, endpoint, query):
+        return self.client().call_api(endpoint, query=query)
+
+
+def synthetic_assets(count, prefix='SYN'):
+    """Universo de `count` ações sintéticas, distribuídas entre algumas regiões."""
+    regions = ('US', 'BR', 'GB', 'DE', 'JP', 'HK')
+    width = len(str(count))
+    return [
+        {"symbol": f"{prefix}{i:0{width}d}", "name": f"Sintética {i}", "region": regions[i % len(regions)]}
+        for i in range(count)
+    ]
+
+
+def _noise(seed, days, salt):
+    """Ruído determinístico em [-0.5, 0.5) para cada dia, sem estado entre chamadas."""
+    h = (days.astype(np.uint64) * np.uint64(2654435761) + np.uint64((seed + salt * 40503) % 2 ** 32)) % np.uint64(2 ** 32)
+    h = ((h ^ (h >> np.uint64(16))) * np.uint64(0x45d9f3b)) % np.uint64(2 ** 32)
+    h = h ^ (h >> np.uint64(16))
+    return h.astype(np.float64) / 2 ** 32 - 0.5
+
+
+class LocalProvider(DataProvider):
+    """Provedor local, sem rede, para testes de carga e uso offline.
+
+    Com `recorded_dir`, serve as séries e insights salvos nesse diretório
+    (o formato de `data/`) e filtra as barras por period1/period2. Símbolos sem
+    gravação recebem payloads sintéticos, determinísticos por símbolo e dia,
+    a menos que `synthetic=False`; com um intervalo intradiário na consulta,
+    as barras sintéticas cobrem o pregão de cada um dos `bars` dias.
+
+    Cada chamada (de uma consulta ou de um lote) espera `latency` segundos mais
+    um valor aleatório até `jitter`, e falha com probabilidade `failure_rate`.
+    """
+
+    name = 'local'
+    host = 'local'
+
+    def __init__(self, recorded_dir=None, synthetic=True, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 max_batch_size=100, bars=22, end=None):
+        self.synthetic = synthetic
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.max_batch_size = max(1, max_batch_size)
+        self.bars = bars
+        # Fim das séries sintéticas; fixo, deixa as execuções reprodutíveis
+        self.end = end
+        self.charts = {}
+        self.insights = {}
+        if recorded_dir:
+            self._load_recorded(recorded_dir)
+
+    def _load_recorded(self, recorded_dir):
+        for name in ('indices_data.json', 'stocks_data.json'):
+            for record in self._read_records(os.path.join(recorded_dir, name)):
+                self.charts[record['symbol']] = record
+        archive_dir = os.path.join(recorded_dir, 'insights_archive')
+        for record in self._read_records(os.path.join(recorded_dir, 'stocks_insights.json')):
+            self.insights[record['symbol']] = insights_store.load_full_insights(record, archive_dir)
+
+    @staticmethod
+    def _read_records(json_path):
+        # Coletas em modo streaming gravam .ndjson no lugar do .json
+        path = record_stream.newest(json_path)
+        if path is None:
+            return []
+        if path.endswith(record_stream.NDJSON_SUFFIX):
+            return record_stream.NDJSONReader(path)
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _wait(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError('falha simulada do provedor local')
+
+    def call(self, endpoint, query):
+        return self.call_batch(endpoint, [query])[0]
+
+    def call_batch(self, endpoint, queries):
+        self._wait()
+        if endpoint == CHART_ENDPOINT:
+            return [self.chart_payload(query) for query in queries]
+        if endpoint == INSIGHTS_ENDPOINT:
+            return [self.insights_payload(query) for query in queries]
+        raise ValueError(f'endpoint não suportado pelo provedor local: {endpoint}')
+
+    def chart_payload(self, query):
+        symbol = query['symbol']
+        record = self.charts.get(symbol)
+        if record is not None:
+            result = self._recorded_chart(record, query)
+        elif self.synthetic:
+            result = self._synthetic_chart(symbol, query)
+        else:
+            return {'chart': {'result': None, 'error': {'code': 'Not Found'}}}
+        return {'chart': {'result': [result], 'error': None}}
+
+    def insights_payload(self, query):
+        symbol = query['symbol']
+        insights = self.insights.get(symbol)
+        if insights is None and self.synthetic:
+            insights = self._synthetic_insights(symbol)
+        return {'finance': {'result': insights, 'error': None}}
+
+    @staticmethod
+    def _recorded_chart(record, query):
+        timestamps = record.get('timestamp', [])
+        period1 = query.get('period1', float('-inf'))
+        period2 = query.get('period2', float('inf'))
+        keep = [i for i, ts in enumerate(timestamps) if period1 <= ts <= period2]
+        indicators = record.get('indicators', {})
+        quote = (indicators.get('quote') or [{}])[0]
+        selected = {'quote': [{k: [v[i] for i in keep if i < len(v)] for k, v in quote.items()}]}
+        if indicators.get('adjclose'):
+            adjclose = indicators['adjclose'][0].get('adjclose', [])
+            selected['adjclose'] = [{'adjclose': [adjclose[i] for i in keep if i < len(adjclose)]}]
+        return {
+            'meta': record.get('meta', {}),
+            'timestamp': [timestamps[i] for i in keep],
+            'indicators': selected
+        }
+
+    def _trading_days(self, query):
+        """Dias (desde a época) com pregão pedidos pela consulta, de segunda a sexta."""
+        end = query.get('period2') or self.end or int(time.time())
+        last = end // SECONDS_PER_DAY
+        if 'period1' in query:
+            first = query['period1'] // SECONDS_PER_DAY
+        else:
+            # Dias corridos suficientes para `bars` pregões
+            first = last - (self.bars * 7) // 5 - 2
+        days = np.arange(first, last + 1, dtype=np.int64)
+        # 1970-01-01 foi uma quinta-feira
+        days = days[(days + 3) % 7 < 5]
+        if 'period1' not in query:
+            days = days[-self.bars:]
+        return days
+
+    def _synthetic_chart(self, symbol, query):
+        seed = zlib.crc32(symbol.encode('utf-8'))
+        days = self._trading_days(query)
+        base = 10.0 + seed % 490
+        phase = (seed % 628) / 100.0
+        # Barras às 13h30 UTC, como as diárias do Yahoo para a bolsa de Nova York
+        timestamps = days * SECONDS_PER_DAY + SESSION_OPEN
+        step = ohlcv_resample.INTERVAL_SECONDS.get(query.get('interval', '1d'), SECONDS_PER_DAY)
+        ticks, bar_volume = days, 1.0
+        if step < SECONDS_PER_DAY:
+            # Intradiário: barras de `step` segundos ao longo do pregão de cada dia
+            per_day = SESSION_SECONDS // step
+            timestamps = (timestamps[:, None] + np.arange(per_day) * step).ravel()
+            timestamps = timestamps[(timestamps >= query.get('period1', 0))
+                                    & (timestamps <= (query.get('period2') or timestamps.max(initial=0)))]
+            ticks, bar_volume = timestamps // step, 1.0 / per_day
+        position = (timestamps - SESSION_OPEN) / SECONDS_PER_DAY
+        day_noise = _noise(seed, timestamps // SECONDS_PER_DAY, 1)
+        close = base * np.exp(0.08 * np.sin(position / 9.0 + phase) + 0.03 * day_noise
+                              + (0.002 * _noise(seed, ticks, 6) if step < SECONDS_PER_DAY else 0.0))
+        open_ = close * (1 + 0.02 * bar_volume ** 0.5 * _noise(seed, ticks, 2))
+        high = np.maximum(open_, close) * (1 + 0.01 * np.abs(_noise(seed, ticks, 3)))
+        low = np.minimum(open_, close) * (1 - 0.01 * np.abs(_noise(seed, ticks, 4)))
+        volume = np.round(1e5 * (1 + seed % 97) * (1 + _noise(seed, ticks, 5)) * bar_volume)
+        return {
+            'meta': {
+                'symbol': symbol,
+                'currency': 'USD',
+                'instrumentType': 'EQUITY',
+                'gmtoffset': 0,
+                'timezone': 'UTC',
+                'dataGranularity': query.get('interval', '1d'),
+                'regularMarketPrice': round(float(close[-1]), 2) if len(close) else None,
+            },
+            'timestamp': timestamps.tolist(),
+            'indicators': {
+                'quote': [{
+                    'open': np.round(open_, 4).tolist(),
+                    'high': np.round(high, 4).tolist(),
+                    'low': np.round(low, 4).tolist(),
+                    'close': np.round(close, 4).tolist(),
+                    'volume': volume.astype(np.int64).tolist(),
+                }],
+                'adjclose': [{'adjclose': np.round(close, 4).tolist()}]
+            }
+        }
+
+    @staticmethod
+    def _synthetic_insights(symbol):
+        seed = zlib.crc32(symbol.encode('utf-8'))
+        sectors = ('Technology', 'Financial Services', 'Energy', 'Healthcare', 'Industrials', 'Consumer Cyclical')
+        ratings = ('BUY', 'HOLD', 'SELL')
+        valuations = (('Undervalued', '12%'), ('Near Fair Value', '1%'), ('Overvalued', '-9%'))
+        sector = sectors[seed % len(sectors)]
+        description, discount = valuations[(seed >> 8) % len(valuations)]
+        return {
+            'symbol': symbol,
+            'instrumentInfo': {
+                'technicalEvents': {'sector': sector},
+                'valuation': {'description': description, 'discount': discount}
+            },
+            'companySnapshot': {'sectorInfo': sector},
+            'recommendation': {'rating': ratings[(seed >> 4) % len(ratings)],
+                               'targetPrice': round(11.0 + seed % 539, 2)}
+        }
+
+
+PROVIDERS = {
+    YahooFinanceProvider.name: YahooFinanceProvider,
+    LocalProvider.name: LocalProvider,
+}
+
+
+def add_provider_arguments(parser):
+    """Opções de linha de comando para escolher e configurar o provedor."""
+    parser.add_argument('--provider', choices=sorted(PROVIDERS), default=YahooFinanceProvider.name,
+                        help='Fonte dos dados: API do Yahoo Finance ou provedor local (sem rede)')
+    parser.add_argument('--recorded-dir', default=None,
+                        help='Provedor local: diretório com dados de uma coleta anterior para servir')
+    parser.add_argument('--no-synthetic', action='store_true',
+                        help='Provedor local: não gera dados para símbolos sem gravação')
+    parser.add_argument('--synthetic-stocks', type=int, default=None,
+                        help='Provedor local: substitui a lista de ações por N ações sintéticas')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Provedor local: espera (s) por chamada')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Provedor local: espera aleatória adicional (s) de até este valor')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Provedor local: probabilidade de uma chamada falhar')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Provedor local: consultas atendidas por chamada')
+    return parser
+
+
+def provider_from_args(args):
+    if args.provider == LocalProvider.name:
+        return LocalProvider(
+            recorded_dir=args.recorded_dir,
+            synthetic=not args.no_synthetic,
+            latency=args.latency,
+            jitter=args.jitter,
+            failure_rate=args.failure_rate,
+            max_batch_size=args.batch_size
+        )
+    return YahooFinanceProvider()
@@ -0,0 +1,502 @@
+"""Estado da análise incremental: só os símbolos cujos dados mudaram são recalculados.
+
+Entre uma execução e outra fica em `<data_dir>/state/<intervalo da análise>`:
+
+    indices.npz, stocks.npz   estado por símbolo: últimos preços válidos e seus
+                              dias de negociação, somas
+                              móveis das médias de 5 e 20 pregões, variância dos
+                              retornos pelo método de Welford e soma dos volumes
+    correlations.npz          retornos alinhados por data e co-momentos (n, soma
+                              de x, x² e xy) de cada par de símbolos
+    groups.json               entradas e agregados de cada região e setor
+
+Cada símbolo é identificado por uma impressão digital barata (número de barras,
+primeiro e último timestamp, último fechamento e último volume). Se só houver
+barras novas, ou a última barra (parcial) tiver sido corrigida, o estado do
+símbolo é atualizado com essas barras; se o início da série mudar (como numa
+coleta com --full-refresh), ele é reconstruído a partir da série inteira. As
+barras anteriores à última são consideradas imutáveis, como na coleta
+incremental.
+
+As métricas saem com os mesmos valores da análise em lote, a menos de erros de
+arredondamento de ponto flutuante nas somas acumuladas.
+"""
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import market_analytics
+from market_analytics import LONG_WINDOW, SHORT_WINDOW, WEEK_DAYS, WEEK_OFFSET
+
+STATE_DIR = 'data/state/1d'
+
+# Preços válidos guardados por símbolo: a janela longa mais um, para que a
+# correção da última barra ainda deixe LONG_WINDOW preços conhecidos
+TAIL = max(LONG_WINDOW, WEEK_OFFSET) + 1
+
+
+def _same(a, b):
+    return a == b or (np.isnan(a) and np.isnan(b))
+
+
+def _last(values, default=np.nan):
+    return values[-1] if len(values) else default
+
+
+def fingerprints(records):
+    """Impressão digital de cada registro: barras, primeiro/último timestamp, último fechamento e volume."""
+    n = len(records)
+    fp = {
+        'n_bars': np.zeros(n, dtype=np.int64),
+        'n_volume_bars': np.zeros(n, dtype=np.int64),
+        'first_ts': np.full(n, -1, dtype=np.int64),
+        'last_ts': np.full(n, -1, dtype=np.int64),
+        'last_close': np.full(n, np.nan),
+        'last_volume': np.full(n, np.nan),
+    }
+    for i, record in enumerate(records):
+        closes = market_analytics.quote_column(record, 'close')
+        volumes = market_analytics.quote_column(record, 'volume')
+        timestamps = record.get('timestamp')
+        timestamps = timestamps if timestamps is not None else []
+        fp['n_bars'][i] = len(closes)
+        fp['n_volume_bars'][i] = len(volumes)
+        fp['first_ts'][i] = timestamps[0] if len(timestamps) else -1
+        fp['last_ts'][i] = _last(timestamps, -1)
+        fp['last_close'][i] = _last(closes)
+        fp['last_volume'][i] = _last(volumes)
+    return fp
+
+
+def _changed(old, new, rows):
+    """Máscara das linhas de `new` cuja impressão digital difere de `old` (já reindexado em `rows`)."""
+    changed = rows < 0
+    for key in ('n_bars', 'n_volume_bars', 'first_ts', 'last_ts'):
+        changed |= old[key] != new[key]
+    for key in ('last_close', 'last_volume'):
+        changed |= ~((old[key] == new[key]) | (np.isnan(old[key]) & np.isnan(new[key])))
+    return changed
+
+
+def _load_npz(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _save_npz(path, arrays):
+    # Gravado num arquivo temporário e trocado, para nunca deixar um estado pela metade
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
+
+
+class SymbolState:
+    """Estado das métricas de cada símbolo de um conjunto (índices ou ações), em arrays colunares."""
+
+    FIELDS = {
+        'n_valid': np.int64, 'first_price': np.float64, 'sum_short': np.float64, 'sum_long': np.float64,
+        'ret_n': np.int64, 'ret_mean': np.float64, 'ret_m2': np.float64,
+        'vol_n': np.int64, 'vol_sum': np.float64,
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.symbols = []
+        self.arrays = None
+        saved = _load_npz(path)
+        if saved is not None:
+            self.symbols = [str(symbol) for symbol in saved.pop('symbols')]
+            self.arrays = saved
+
+    def _empty(self, n):
+        arrays = {key: np.zeros(n, dtype=dtype) for key, dtype in self.FIELDS.items()}
+        arrays['first_price'][:] = np.nan
+        arrays['tail'] = np.full((n, TAIL), np.nan)
+        arrays['tail_days'] = np.full((n, TAIL), np.nan)
+        return arrays
+
+    def update(self, records):
+        """Atualiza o estado para `records`; devolve (símbolos atualizados, símbolos reconstruídos)."""
+        symbols = [record['symbol'] for record in records]
+        fp = fingerprints(records)
+        old_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        rows = np.array([old_index.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+
+        arrays = self._empty(len(records))
+        old = {key: np.zeros(len(records), dtype=values.dtype) for key, values in fp.items()}
+        known = rows >= 0
+        if self.arrays is not None and known.any():
+            for key, values in self.arrays.items():
+                target = arrays if key in arrays else old
+                target[key][known] = values[rows[known]]
+        changed = _changed(old, fp, rows)
+
+        self.symbols = symbols
+        self.arrays = arrays
+        rebuild = []
+        for i in np.flatnonzero(changed):
+            if rows[i] < 0 or not self._append(i, records[i], {key: old[key][i] for key in old}):
+                rebuild.append(i)
+        if rebuild:
+            self._rebuild(rebuild, [records[i] for i in rebuild])
+        self.arrays.update(fp)
+        return int(changed.sum()), len(rebuild)
+
+    def _append(self, i, record, old):
+        """Aplica as barras novas (e a correção da última) ao estado; False se for preciso reconstruir."""
+        closes = market_analytics.quote_column(record, 'close')
+        volumes = market_analytics.quote_column(record, 'volume')
+        timestamps = record.get('timestamp')
+        timestamps = timestamps if timestamps is not None else []
+        n_old = old['n_bars']
+        if (len(closes) < n_old or len(volumes) < old['n_volume_bars'] or old['first_ts'] < 0
+                or old['first_ts'] != (timestamps[0] if len(timestamps) else -1)
+                or len(timestamps) < n_old or timestamps[n_old - 1] != old['last_ts']):
+            return False
+
+        days = np.full(len(closes), np.nan)
+        record_days = market_analytics.trading_days(record)[:len(closes)]
+        days[:len(record_days)] = record_days
+        start = n_old
+        if n_old and not _same(closes[n_old - 1], old['last_close']):
+            # A última barra salva era parcial e foi corrigida
+            if not np.isnan(old['last_close']) and not self._pop_close(i):
+                return False
+            start = n_old - 1
+        for price, day in zip(closes[start:], days[start:]):
+            if not np.isnan(price) and not self._push_close(i, price, day):
+                return False
+
+        a = self.arrays
+        n_vol = old['n_volume_bars']
+        start = n_vol
+        if n_vol and not _same(volumes[n_vol - 1], old['last_volume']):
+            if not np.isnan(old['last_volume']):
+                a['vol_n'][i] -= 1
+                a['vol_sum'][i] -= old['last_volume']
+            start = n_vol - 1
+        new_volumes = volumes[start:]
+        new_volumes = new_volumes[~np.isnan(new_volumes)]
+        a['vol_n'][i] += len(new_volumes)
+        a['vol_sum'][i] += new_volumes.sum()
+        return True
+
+    def _push_close(self, i, price, day):
+        a = self.arrays
+        tail, tail_days = a['tail'][i], a['tail_days'][i]
+        n = a['n_valid'][i]
+        if n >= LONG_WINDOW and np.isnan(tail[-LONG_WINDOW]):
+            return False
+        if n:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._add_return(i, price / tail[-1] - 1)
+        else:
+            a['first_price'][i] = price
+        a['sum_short'][i] += price - (tail[-SHORT_WINDOW] if n >= SHORT_WINDOW else 0.0)
+        a['sum_long'][i] += price - (tail[-LONG_WINDOW] if n >= LONG_WINDOW else 0.0)
+        tail[:-1] = tail[1:]
+        tail[-1] = price
+        tail_days[:-1] = tail_days[1:]
+        tail_days[-1] = day
+        a['n_valid'][i] = n + 1
+        return True
+
+    def _pop_close(self, i):
+        a = self.arrays
+        tail, tail_days = a['tail'][i], a['tail_days'][i]
+        n = a['n_valid'][i]
+        if (n >= 2 and np.isnan(tail[-2])) or (n > LONG_WINDOW and np.isnan(tail[-LONG_WINDOW - 1])):
+            return False
+        price = tail[-1]
+        if n >= 2:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._remove_return(i, price / tail[-2] - 1)
+        a['sum_short'][i] += (tail[-SHORT_WINDOW - 1] if n > SHORT_WINDOW else 0.0) - price
+        a['sum_long'][i] += (tail[-LONG_WINDOW - 1] if n > LONG_WINDOW else 0.0) - price
+        tail[1:] = tail[:-1].copy()
+        tail[0] = np.nan
+        tail_days[1:] = tail_days[:-1].copy()
+        tail_days[0] = np.nan
+        a['n_valid'][i] = n - 1
+        if n == 1:
+            a['first_price'][i] = np.nan
+        return True
+
+    def _add_return(self, i, value):
+        # Welford: média e soma dos quadrados dos desvios, um retorno por vez
+        if np.isnan(value):
+            return
+        a = self.arrays
+        count = a['ret_n'][i] + 1
+        delta = value - a['ret_mean'][i]
+        a['ret_mean'][i] += delta / count
+        a['ret_m2'][i] += delta * (value - a['ret_mean'][i])
+        a['ret_n'][i] = count
+
+    def _remove_return(self, i, value):
+        if np.isnan(value):
+            return
+        a = self.arrays
+        count = a['ret_n'][i] - 1
+        if count == 0:
+            a['ret_mean'][i] = a['ret_m2'][i] = 0.0
+        else:
+            mean = (a['ret_mean'][i] * (count + 1) - value) / count
+            a['ret_m2'][i] = max(a['ret_m2'][i] - (value - mean) * (value - a['ret_mean'][i]), 0.0)
+            a['ret_mean'][i] = mean
+        a['ret_n'][i] = count
+
+    def _rebuild(self, rows, records):
+        """Recalcula o estado dos símbolos em `rows` a partir das séries inteiras, de uma vez."""
+        a = self.arrays
+        rows = np.asarray(rows)
+        prices = market_analytics.field_matrix(records, 'close').to_numpy(dtype=np.float64)
+        order = market_analytics.compact_order(prices)
+        prices = np.take_along_axis(prices, order, axis=1)
+        days = np.take_along_axis(market_analytics.day_matrix(records), order, axis=1)
+        n_rows, width = prices.shape
+        counts = (~np.isnan(prices)).sum(axis=1)
+
+        tail = np.full((n_rows, TAIL), np.nan)
+        tail_days = np.full((n_rows, TAIL), np.nan)
+        keep = min(width, TAIL)
+        if keep:
+            tail[:, TAIL - keep:] = prices[:, width - keep:]
+            tail_days[:, TAIL - keep:] = days[:, width - keep:]
+        # Dias das barras sem fechamento não entram na busca pelo preço de uma semana atrás
+        tail_days[np.isnan(tail)] = np.nan
+        a['tail'][rows] = tail
+        a['tail_days'][rows] = tail_days
+        a['n_valid'][rows] = counts
+        first_price = np.full(n_rows, np.nan)
+        if width:
+            first_price = prices[np.arange(n_rows), np.minimum(width - counts, width - 1)]
+        a['first_price'][rows] = first_price
+        a['sum_short'][rows] = np.nansum(tail[:, -SHORT_WINDOW:], axis=1)
+        a['sum_long'][rows] = np.nansum(tail[:, -LONG_WINDOW:], axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = prices[:, 1:] / prices[:, :-1] - 1
+            ret_n = (~np.isnan(returns)).sum(axis=1)
+            mean = np.where(ret_n > 0, np.nansum(returns, axis=1) / ret_n, 0.0)
+            m2 = np.nansum((returns - mean[:, None]) ** 2, axis=1)
+        a['ret_n'][rows] = ret_n
+        a['ret_mean'][rows] = mean
+        a['ret_m2'][rows] = np.where(ret_n > 0, m2, 0.0)
+
+        volumes = market_analytics.field_matrix(records, 'volume').to_numpy(dtype=np.float64)
+        a['vol_n'][rows] = (~np.isnan(volumes)).sum(axis=1)
+        a['vol_sum'][rows] = np.nansum(volumes, axis=1)
+
+    def metrics(self, volumes=False, periods_per_year=None):
+        """Métricas de todos os símbolos a partir do estado, no formato de `compute_metrics`.
+
+        O preço de uma semana atrás é procurado entre os últimos TAIL preços,
+        que cobrem bem mais de WEEK_DAYS dias com barras diárias ou semanais.
+        """
+        a = self.arrays
+        counts = a['n_valid']
+        tail = a['tail']
+        rows = np.arange(len(counts))
+        last_price = tail[:, -1]
+        first_price = a['first_price']
+        usable = (counts >= 2) & (first_price != 0) & (last_price != 0) & ~np.isnan(first_price)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            period_return = (last_price / first_price - 1) * 100
+            tail_days = a['tail_days']
+            known = (~np.isnan(tail)).sum(axis=1)
+            before = (tail_days <= (tail_days[:, -1] - WEEK_DAYS)[:, None]).sum(axis=1)
+            week_ago_price = tail[rows, np.minimum(TAIL - known + np.maximum(before - 1, 0), TAIL - 1)]
+            week_return = np.where(week_ago_price != 0, (last_price / week_ago_price - 1) * 100, 0.0)
+            volatility = np.where(a['ret_n'] > 0, np.sqrt(a['ret_m2'] / a['ret_n']) * 100, 0.0)
+            ma_short = np.where(counts >= SHORT_WINDOW, a['sum_short'] / SHORT_WINDOW, last_price)
+            ma_long = np.where(counts >= LONG_WINDOW, a['sum_long'] / LONG_WINDOW, last_price)
+        trend = np.select([ma_short > ma_long, ma_short < ma_long], ['Alta', 'Baixa'], 'Lateral')
+
+        metrics = pd.DataFrame({
+            'last_price': last_price,
+            'period_return': period_return,
+            'week_return': week_return,
+            'volatility': volatility,
+            'trend': trend
+        }, index=self.symbols)
+        if periods_per_year:
+            metrics['annualized_volatility'] = volatility * np.sqrt(periods_per_year)
+        if volumes:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                metrics['avg_volume'] = np.where(a['vol_n'] > 0, a['vol_sum'] / a['vol_n'], 0.0)
+        return metrics[usable]
+
+    def save(self):
+        if self.arrays is not None:
+            _save_npz(self.path, dict(self.arrays, symbols=np.array(self.symbols, dtype=str)))
+
+
+class CorrelationState:
+    """Retornos alinhados e co-momentos da janela de correlação, atualizados só nas colunas que mudaram.
+
+    Com símbolos novos nos dados, o estado passa a ter colunas alteradas; se o
+    conjunto de símbolos ou a janela mudarem, tudo é recalculado.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.saved = _load_npz(path)
+
+    def update(self, records, window=None):
+        """Devolve (matriz de correlação como DataFrame, número de datas) e o número de colunas recalculadas."""
+        symbols = [record['symbol'] for record in records]
+        fp = fingerprints(records)
+        saved = self.saved
+        window = window or 0
+        if (saved is None or [str(s) for s in saved['symbols']] != symbols
+                or int(saved['window']) != window):
+            days, matrix = market_analytics.aligned_return_matrix(records)
+            moments = market_analytics.comoments(matrix[-window:] if window else matrix)
+            dirty = np.ones(len(records), dtype=bool)
+        else:
+            dirty = _changed({key: saved[key] for key in fp}, fp, np.arange(len(records)))
+            days, matrix, moments = self._update(records, dirty, saved, window)
+
+        self.saved = dict(fp, symbols=np.array(symbols, dtype=str), window=np.int64(window),
+                          days=days, returns=matrix, n=moments[0], sum_x=moments[1],
+                          sum_xx=moments[2], sum_xy=moments[3])
+
+        # Como na análise em lote, ficam de fora símbolos sem nenhum retorno
+        cols = np.flatnonzero(~np.isnan(matrix).all(axis=0)) if len(matrix) else np.empty(0, dtype=np.int64)
+        corr = market_analytics.correlation_from_comoments(*(m[np.ix_(cols, cols)] for m in moments))
+        labels = [symbols[c] for c in cols]
+        return pd.DataFrame(corr, index=labels, columns=labels), len(days), int(dirty.sum())
+
+    def _update(self, records, dirty, saved, window):
+        old_days, old_matrix = saved['days'], saved['returns']
+        moments = [saved[key].copy() for key in ('n', 'sum_x', 'sum_xx', 'sum_xy')]
+        if not dirty.any():
+            return old_days, old_matrix, moments
+
+        cols = np.flatnonzero(dirty)
+        new_days, new_values = market_analytics.aligned_return_matrix([records[c] for c in cols])
+        days = np.union1d(old_days, new_days)
+        matrix = np.full((len(days), len(records)), np.nan)
+        matrix[np.searchsorted(days, old_days)] = old_matrix
+        matrix[:, cols] = np.nan
+        matrix[np.searchsorted(days, new_days)[:, None], cols] = new_values
+
+        empty_rows = np.isnan(matrix).all(axis=1)
+        if empty_rows.any():
+            # Datas que deixaram de existir: recalcula os co-momentos da matriz inteira
+            days, matrix = days[~empty_rows], matrix[~empty_rows]
+            return days, matrix, list(market_analytics.comoments(matrix[-window:] if window else matrix))
+
+        # Datas que saem e entram na janela: atualização de posto baixo de todos os pares
+        old_window = old_days[-window:] if window else old_days
+        new_window = days[-window:] if window else days
+        leaving = old_matrix[np.searchsorted(old_days, np.setdiff1d(old_window, new_window))]
+        entering = matrix[np.searchsorted(days, np.setdiff1d(new_window, old_window))]
+        for rows, sign in ((leaving, -1.0), (entering, 1.0)):
+            if len(rows):
+                for moment, delta in zip(moments, market_analytics.comoments(rows)):
+                    moment += sign * delta
+
+        # Linhas e colunas dos símbolos alterados, recalculadas sobre a janela nova
+        values = matrix[-window:] if window else matrix
+        mask = (~np.isnan(values)).astype(np.float64)
+        x = np.nan_to_num(values)
+        n, sum_x, sum_xx, sum_xy = moments
+        n[cols] = mask[:, cols].T @ mask
+        n[:, cols] = n[cols].T
+        sum_xy[cols] = x[:, cols].T @ x
+        sum_xy[:, cols] = sum_xy[cols].T
+        sum_x[cols] = x[:, cols].T @ mask
+        sum_x[:, cols] = x.T @ mask[:, cols]
+        sum_xx[cols] = (x[:, cols] ** 2).T @ mask
+        sum_xx[:, cols] = (x * x).T @ mask[:, cols]
+        return days, matrix, moments
+
+    def save(self):
+        if self.saved is not None:
+            _save_npz(self.path, self.saved)
+
+
+class GroupState:
+    """Agregados por região e setor; só os grupos com membros ou valores alterados são recalculados."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.groups = json.load(f)
+        except FileNotFoundError:
+            self.groups = {}
+
+    def aggregates(self, kind, rows, group_of, market_caps):
+        """{grupo: (membros, campos de `aggregate_fields`)} na ordem em que os grupos aparecem.
+
+        Devolve também o número de grupos recalculados.
+        """
+        members = market_analytics.group_members(rows, group_of)
+        inputs = {
+            row['symbol']: [group_of.get(row['symbol']), row['period_return'], row['volatility'],
+                            market_caps.get(row['symbol'])]
+            for row in rows
+        }
+        previous = self.groups.get(kind, {'inputs': {}, 'members': {}, 'fields': {}})
+        affected = set()
+        for symbol in set(inputs) | set(previous['inputs']):
+            old, new = previous['inputs'].get(symbol), inputs.get(symbol)
+            if old != new:
+                affected.update(entry[0] for entry in (old, new) if entry and entry[0] is not None)
+        for group, group_rows in members.items():
+            if group not in previous['fields'] or previous['members'].get(group) != [r['symbol'] for r in group_rows]:
+                affected.add(group)
+
+        fields = {}
+        if affected:
+            affected_rows = [row for row in rows if group_of.get(row['symbol']) in affected]
+            aggregates = market_analytics.group_aggregates(affected_rows, group_of, market_caps)
+            fields = {group: market_analytics.aggregate_fields(aggregates, group) for group in aggregates.index}
+
+        result = {group: (group_rows, fields.get(group) or previous['fields'][group])
+                  for group, group_rows in members.items()}
+        self.groups[kind] = {
+            'inputs': inputs,
+            'members': {group: [r['symbol'] for r in group_rows] for group, group_rows in members.items()},
+            'fields': {group: entry[1] for group, entry in result.items()},
+        }
+        return result, len(fields)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.groups, f)
+        os.replace(tmp_path, self.path)
+
+
+class AnalysisState:
+    """O estado completo da análise incremental guardado em `state_dir`."""
+
+    def __init__(self, state_dir=STATE_DIR):
+        self.state_dir = state_dir
+        self.symbols = {
+            dataset: SymbolState(os.path.join(state_dir, f'{dataset}.npz'))
+            for dataset in ('indices', 'stocks')
+        }
+        self.correlations = CorrelationState(os.path.join(state_dir, 'correlations.npz'))
+        self.groups = GroupState(os.path.join(state_dir, 'groups.json'))
+
+    def save(self):
+        for state in self.symbols.values():
+            state.save()
+        self.correlations.save()
+        self.groups.save()
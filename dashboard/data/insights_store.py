@@ -0,0 +1,92 @@
+"""Armazenamento compacto dos insights de ações.
+
+O payload de `YahooFinance/get_stock_insights` tem ~200 KB por símbolo, quase
+todo em `reports` e `secReports`, mas a análise só usa a recomendação e a
+avaliação. O arquivo de análise (stocks_insights.json) guarda apenas os campos
+em ANALYSIS_FIELDS; o restante vai para um arquivo gzip por símbolo em
+ARCHIVE_DIR, lido apenas quando alguém pede o payload completo.
+
+Executado como script, converte um stocks_insights.json no formato antigo:
+
+    python data/insights_store.py
+"""
+import gzip
+import io
+import json
+import os
+
+# Campos do payload mantidos no arquivo de análise
+ANALYSIS_FIELDS = ('symbol', 'instrumentInfo', 'companySnapshot', 'recommendation')
+
+INSIGHTS_PATH = 'data/stocks_insights.json'
+ARCHIVE_DIR = 'data/insights_archive'
+
+
+def archive_path(symbol, archive_dir=ARCHIVE_DIR):
+    # Símbolos como ^GSPC ou PETR4.SA são nomes de arquivo válidos; só evitamos separadores
+    return os.path.join(archive_dir, symbol.replace('/', '_') + '.json.gz')
+
+
+def project_insights(insights):
+    """Mantém do payload apenas os campos usados pela análise."""
+    return {k: insights[k] for k in ANALYSIS_FIELDS if k in insights}
+
+
+def write_archive(symbol, insights, archive_dir=ARCHIVE_DIR):
+    """Grava os campos descartados pela projeção; não faz nada se não houver nenhum."""
+    extra = {k: v for k, v in insights.items() if k not in ANALYSIS_FIELDS}
+    if not extra:
+        return False
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(symbol, archive_dir)
+    tmp_path = path + '.tmp'
+    # mtime=0 deixa o arquivo idêntico entre execuções com o mesmo conteúdo
+    with gzip.GzipFile(tmp_path, 'wb', mtime=0) as raw, io.TextIOWrapper(raw, encoding='utf-8') as f:
+        json.dump(extra, f)
+    os.replace(tmp_path, path)
+    return True
+
+
+def slim_record(record, archive_dir=ARCHIVE_DIR):
+    """Arquiva os relatórios de um registro {'symbol', 'name', 'insights'} e devolve a versão compacta.
+
+    É idempotente: um registro já compacto é devolvido sem tocar no arquivo.
+    """
+    insights = record.get('insights')
+    if not isinstance(insights, dict):
+        return record
+    write_archive(record['symbol'], insights, archive_dir)
+    slim = dict(record)
+    slim['insights'] = project_insights(insights)
+    return slim
+
+
+def load_archive(symbol, archive_dir=ARCHIVE_DIR):
+    """Lê os campos arquivados de um símbolo, ou None se não houver arquivo."""
+    path = archive_path(symbol, archive_dir)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_full_insights(record, archive_dir=ARCHIVE_DIR):
+    """Reconstrói o payload completo de um registro compacto."""
+    insights = dict(record.get('insights') or {})
+    insights.update(load_archive(record['symbol'], archive_dir) or {})
+    return insights
+
+
+def slim_insights_file(path=INSIGHTS_PATH, archive_dir=ARCHIVE_DIR):
+    """Converte um stocks_insights.json com payloads completos para o formato compacto."""
+    with open(path, 'r') as f:
+        records = json.load(f)
+    records = [slim_record(record, archive_dir) for record in records]
+    with open(path, 'w') as f:
+        json.dump(records, f)
+    return records
+
+
+if __name__ == '__main__':
+    records = slim_insights_file()
+    print(f"{len(records)} insights compactados em {INSIGHTS_PATH}; relatórios em {ARCHIVE_DIR}/")
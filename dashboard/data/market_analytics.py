@@ -0,0 +1,500 @@
+"""Métricas de mercado calculadas em lote para todo o universo de símbolos.
+
+As funções recebem uma matriz de preços (símbolos × datas) e calculam as
+métricas de todos os símbolos em operações NumPy sobre a matriz inteira, sem
+laços por símbolo.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+# Janelas das médias móveis usadas para definir a tendência
+SHORT_WINDOW = 5
+LONG_WINDOW = 20
+
+# Posições até o preço de "uma semana atrás" (5 pregões antes do último),
+# usado quando as datas das barras não são conhecidas
+WEEK_OFFSET = 6
+
+# Com as datas: o último preço até 7 dias corridos antes do último pregão
+WEEK_DAYS = 7
+
+
+def quote_column(record, field):
+    """Coluna `field` de indicators.quote[0] como array float (NaN onde falta valor)."""
+    indicators = record.get('indicators', {})
+    quote = (indicators.get('quote') or [{}])[0]
+    return np.asarray(quote.get(field) if quote.get(field) is not None else [], dtype=np.float64)
+
+
+def series_width(records, field='close'):
+    """Tamanho da maior coluna `field` entre os registros (a largura padrão de `field_matrix`)."""
+    return max((len(quote_column(record, field)) for record in records), default=0)
+
+
+def field_matrix(records, field='close', width=None):
+    """Empilha a coluna `field` de cada registro numa matriz alinhada à direita.
+
+    Séries mais curtas são completadas com NaN à esquerda, de modo que a última
+    coluna é sempre a barra mais recente de cada símbolo. A matriz tem `width`
+    colunas (por padrão, a maior série), o que permite montar fatias de um
+    universo com a largura do universo inteiro. Devolve um DataFrame com os
+    símbolos no índice.
+    """
+    columns = [quote_column(record, field) for record in records]
+    width = max((len(c) for c in columns), default=0) if width is None else width
+    matrix = np.full((len(columns), width), np.nan)
+    for row, values in enumerate(columns):
+        if len(values):
+            matrix[row, width - len(values):] = values
+    return pd.DataFrame(matrix, index=[record['symbol'] for record in records])
+
+
+def day_matrix(records, field='close', width=None):
+    """Dia de negociação de cada valor de `field`, alinhado como em `field_matrix` (NaN no preenchimento)."""
+    lengths = [len(quote_column(record, field)) for record in records]
+    width = max(lengths, default=0) if width is None else width
+    matrix = np.full((len(records), width), np.nan)
+    for row, (record, n) in enumerate(zip(records, lengths)):
+        days = trading_days(record)[:n]
+        matrix[row, width - n:width - n + len(days)] = days
+    return matrix
+
+
+def compute_metrics(closes, volumes=None, days=None, periods_per_year=None):
+    """Calcula as métricas de desempenho de todos os símbolos de uma vez.
+
+    `closes` é um DataFrame (ou array 2-D) símbolos × datas. Valores ausentes
+    (NaN) são pulados: os retornos ligam cada preço válido ao anterior, as médias
+    móveis usam os últimos preços válidos e o último preço é o último válido.
+    Só ficam de fora símbolos com menos de dois preços ou com preço inicial/final
+    zero.
+
+    Com `days` (a matriz de `day_matrix`), o preço de uma semana atrás é o
+    último até WEEK_DAYS dias corridos antes do último pregão, e não o de
+    WEEK_OFFSET posições antes. Com `periods_per_year`, inclui também a
+    volatilidade anualizada.
+
+    Devolve um DataFrame indexado pelo símbolo com last_price, period_return,
+    week_return, volatility, trend e, se `volumes` for informado, avg_volume.
+    Os valores não são arredondados.
+    """
+    if not isinstance(closes, pd.DataFrame):
+        closes = pd.DataFrame(closes)
+    prices = closes.to_numpy(dtype=np.float64)
+    n_rows, width = prices.shape
+    rows = np.arange(n_rows)
+    if width == 0:
+        return pd.DataFrame(columns=['last_price', 'period_return', 'week_return', 'volatility', 'trend'])
+
+    # Com os preços válidos encostados à direita, as lacunas viram preenchimento
+    # à esquerda e as métricas posicionais abaixo passam a pular os NaN
+    order = compact_order(prices)
+    prices = np.take_along_axis(prices, order, axis=1)
+    counts = (~np.isnan(prices)).sum(axis=1)
+    usable = counts >= 2
+    first_pos = width - counts
+
+    last_price = prices[:, -1]
+    first_price = prices[rows, np.minimum(first_pos, width - 1)]
+    usable &= (first_price != 0) & (last_price != 0) & ~np.isnan(first_price)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        period_return = (last_price / first_price - 1) * 100
+
+        if days is None:
+            week_pos = width - np.minimum(counts, WEEK_OFFSET)
+        else:
+            # Os preços válidos (e seus dias, em ordem) ficam encostados à direita
+            days = np.take_along_axis(np.asarray(days, dtype=np.float64), order, axis=1)
+            target = days[:, -1] - WEEK_DAYS
+            before = ((days <= target[:, None]) & ~np.isnan(prices)).sum(axis=1)
+            week_pos = first_pos + np.maximum(before - 1, 0)
+        week_ago_price = prices[rows, np.minimum(week_pos, width - 1)]
+        week_return = np.where(week_ago_price != 0, (last_price / week_ago_price - 1) * 100, 0.0)
+
+        # Retornos entre preços válidos consecutivos; o preenchimento gera NaN e é ignorado
+        daily_returns = prices[:, 1:] / prices[:, :-1] - 1
+        has_returns = (~np.isnan(daily_returns)).any(axis=1)
+        volatility = np.zeros(n_rows)
+        if has_returns.any():
+            volatility[has_returns] = np.nanstd(daily_returns[has_returns], axis=1) * 100
+
+        # Tendência (média móvel curta vs longa); sem barras suficientes usa o último preço
+        ma_short = np.where(counts >= SHORT_WINDOW, _tail_mean(prices, SHORT_WINDOW), last_price)
+        ma_long = np.where(counts >= LONG_WINDOW, _tail_mean(prices, LONG_WINDOW), last_price)
+    trend = np.select([ma_short > ma_long, ma_short < ma_long], ['Alta', 'Baixa'], 'Lateral')
+
+    metrics = pd.DataFrame({
+        'last_price': last_price,
+        'period_return': period_return,
+        'week_return': week_return,
+        'volatility': volatility,
+        'trend': trend
+    }, index=closes.index)
+    if periods_per_year:
+        metrics['annualized_volatility'] = volatility * np.sqrt(periods_per_year)
+
+    if volumes is not None:
+        volume_matrix = volumes.to_numpy(dtype=np.float64) if isinstance(volumes, pd.DataFrame) \
+            else np.asarray(volumes, dtype=np.float64)
+        has_volume = (~np.isnan(volume_matrix)).any(axis=1) if volume_matrix.size else np.zeros(n_rows, bool)
+        avg_volume = np.zeros(n_rows)
+        if has_volume.any():
+            avg_volume[has_volume] = np.nanmean(volume_matrix[has_volume], axis=1)
+        metrics['avg_volume'] = avg_volume
+
+    return metrics[usable]
+
+
+def compact_right(matrix):
+    """Move os valores válidos de cada linha para a direita, mantendo a ordem entre eles.
+
+    A ordenação estável pela máscara de NaN faz isso para todas as linhas de uma
+    vez, sem laços por símbolo.
+    """
+    return np.take_along_axis(matrix, compact_order(matrix), axis=1)
+
+
+def compact_order(matrix):
+    """Permutação de cada linha usada por `compact_right`, para aplicar a outras matrizes alinhadas."""
+    return np.argsort(~np.isnan(matrix), axis=1, kind='stable')
+
+
+def _tail_mean(prices, window):
+    """Média das últimas `window` colunas de cada linha (NaN se faltar algum valor)."""
+    return prices[:, -window:].mean(axis=1)
+
+
+def index_by_symbol(records):
+    """{símbolo: registro}, para junções O(1) em vez de uma busca linear por símbolo."""
+    return {record['symbol']: record for record in records}
+
+
+def group_members(rows, group_of):
+    """Agrupa as linhas pelo grupo de cada símbolo (`group_of`: símbolo → grupo) numa única passada.
+
+    Linhas sem grupo ficam de fora; dentro de cada grupo a ordem das linhas é mantida.
+    """
+    members = {}
+    for row in rows:
+        group = group_of.get(row['symbol'])
+        if group is not None:
+            members.setdefault(group, []).append(row)
+    return members
+
+
+def insight_fields(stock_insight):
+    """Recomendação e avaliação de um registro de stocks_insights.json (ou None)."""
+    recommendation = None
+    valuation = None
+
+    if stock_insight and 'insights' in stock_insight:
+        insights = stock_insight['insights']
+
+        # Recomendação
+        if 'recommendation' in insights and insights['recommendation']:
+            recommendation = {
+                'rating': insights['recommendation'].get('rating'),
+                'targetPrice': insights['recommendation'].get('targetPrice')
+            }
+
+        # Avaliação
+        if 'instrumentInfo' in insights and 'valuation' in insights['instrumentInfo']:
+            valuation = {
+                'description': insights['instrumentInfo']['valuation'].get('description'),
+                'discount': insights['instrumentInfo']['valuation'].get('discount')
+            }
+
+    return recommendation, valuation
+
+
+def analysis_rows(records, metrics, taxonomy, insights=None, risk_fields=None):
+    """Linhas dos arquivos de análise a partir de `metrics_by_symbol`, na ordem de `records`.
+
+    Com `insights` (símbolo → registro de insights), as linhas são de ações e
+    ganham volume médio, recomendação e avaliação; `risk_fields` são os campos
+    de risk_analytics por símbolo. Devolve (linhas, nomes dos registros sem
+    dados suficientes).
+    """
+    rows, insufficient = [], []
+    for record in records:
+        symbol_metrics = metrics.get(record['symbol'])
+        if symbol_metrics is None:
+            insufficient.append(record['name'])
+            continue
+        row = {
+            'symbol': record['symbol'],
+            'name': record['name'],
+            'region': resolve_region(record, taxonomy),
+            'last_price': symbol_metrics['last_price'],
+            'period_return': round(symbol_metrics['period_return'], 2),
+            'week_return': round(symbol_metrics['week_return'], 2),
+            'volatility': round(symbol_metrics['volatility'], 2),
+            'annualized_volatility': round(symbol_metrics['annualized_volatility'], 2),
+        }
+        if insights is None:
+            row['trend'] = symbol_metrics['trend']
+        else:
+            recommendation, valuation = insight_fields(insights.get(record['symbol']))
+            row['avg_volume'] = int(symbol_metrics['avg_volume'])
+            row['trend'] = symbol_metrics['trend']
+            row['recommendation'] = recommendation
+            row['valuation'] = valuation
+        if risk_fields is not None:
+            row.update(risk_fields[record['symbol']])
+        rows.append(row)
+    return rows, insufficient
+
+
+def metrics_by_symbol(metrics):
+    """Converte o resultado de `compute_metrics` em {símbolo: {métrica: valor}}.
+
+    Os valores continuam escalares NumPy, de modo que `round()` sobre eles segue
+    o arredondamento do NumPy, o mesmo usado pelos arquivos de análise.
+    """
+    columns = {col: metrics[col].to_numpy() for col in metrics.columns}
+    return {
+        symbol: {col: values[i] for col, values in columns.items()}
+        for i, symbol in enumerate(metrics.index)
+    }
+
+
+# Mínimo de retornos em comum para que a correlação de um par seja calculada
+MIN_CORRELATION_PERIODS = 3
+
+# Colunas por bloco nos produtos de matrizes dos co-momentos (e dos betas)
+COMOMENT_BLOCK = 256
+
+SECONDS_PER_DAY = 86400
+
+
+def trading_days(record):
+    """Dia de negociação (dias desde 1970-01-01, no fuso da bolsa) de cada barra do registro."""
+    timestamps = np.asarray(record.get('timestamp') if record.get('timestamp') is not None else [], dtype=np.int64)
+    offset = int(record.get('meta', {}).get('gmtoffset') or 0)
+    return (timestamps + offset) // SECONDS_PER_DAY
+
+
+def aligned_returns(records, field='close'):
+    """Retornos de cada símbolo alinhados pela data de negociação.
+
+    Cada retorno liga um preço válido ao anterior do mesmo símbolo e é colocado
+    na data do preço mais recente. Devolve um DataFrame datas × símbolos, com
+    NaN nas datas em que o símbolo não negociou.
+    """
+    days, matrix = aligned_return_matrix(records, field)
+    return pd.DataFrame(matrix, index=pd.to_datetime(days, unit='D'),
+                        columns=[record['symbol'] for record in records])
+
+
+def aligned_return_matrix(records, field='close', days=None):
+    """Como `aligned_returns`, mas devolve (dias desde 1970-01-01, matriz datas × registros).
+
+    Com `days` (ordenados), as linhas são essas datas e retornos em outras ficam de fora.
+    """
+    return_days, codes, returns = [], [], []
+    for code, record in enumerate(records):
+        prices = quote_column(record, field)
+        record_days = trading_days(record)[:len(prices)]
+        valid = ~np.isnan(prices[:len(record_days)])
+        prices, record_days = prices[:len(record_days)][valid], record_days[valid]
+        if len(prices) < 2:
+            continue
+        return_days.append(record_days[1:])
+        codes.append(np.full(len(prices) - 1, code))
+        returns.append(prices[1:] / prices[:-1] - 1)
+
+    if days is not None:
+        days = np.asarray(days, dtype=np.int64)
+    if not return_days:
+        days = np.empty(0, dtype=np.int64) if days is None else days
+        return days, np.full((len(days), len(records)), np.nan)
+    return_days, codes, returns = np.concatenate(return_days), np.concatenate(codes), np.concatenate(returns)
+    if days is None:
+        days, day_idx = np.unique(return_days, return_inverse=True)
+    else:
+        day_idx = np.minimum(np.searchsorted(days, return_days), max(len(days) - 1, 0))
+        keep = days[day_idx] == return_days if len(days) else np.zeros(len(return_days), dtype=bool)
+        day_idx, codes, returns = day_idx[keep], codes[keep], returns[keep]
+    matrix = np.full((len(days), len(records)), np.nan)
+    matrix[day_idx, codes] = returns
+    return days, matrix
+
+
+def correlation_matrix(returns, window=None, min_periods=MIN_CORRELATION_PERIODS):
+    """Correlação de Pearson entre todas as colunas de `returns`, par a par.
+
+    Cada par usa só as datas em que os dois têm retorno, como DataFrame.corr, mas
+    o cálculo é feito com produtos de matrizes sobre os co-momentos (somas de x,
+    x² e xy), o que escala para universos grandes. Com `window`, usa apenas as
+    últimas `window` datas (a janela móvel mais recente). Pares com menos de
+    `min_periods` observações em comum ficam NaN.
+    """
+    if window:
+        returns = returns.iloc[-window:]
+    corr = correlation_from_comoments(*comoments(returns.to_numpy(dtype=np.float64)), min_periods=min_periods)
+    return pd.DataFrame(corr, index=returns.columns, columns=returns.columns)
+
+
+def comoments(values, start=0, stop=None):
+    """Co-momentos (n, soma de x, de x² e de xy) de cada par de colunas, só nas datas com os dois valores.
+
+    Devolve as linhas `start`..`stop` (por padrão todas), calculadas em blocos
+    de COMOMENT_BLOCK colunas; com `start` múltiplo de COMOMENT_BLOCK, cada
+    linha sai igual bit a bit à da matriz inteira (ver parallel_analytics).
+    """
+    mask = (~np.isnan(values)).astype(np.float64)
+    x = np.nan_to_num(values)
+    stop = values.shape[1] if stop is None else stop
+    blocks = []
+    for lo, hi in block_bounds(start, stop):
+        # Cópias contíguas: o produto de cada bloco não depende de onde ele está na matriz
+        block_mask, block_x = np.ascontiguousarray(mask[:, lo:hi]), np.ascontiguousarray(x[:, lo:hi])
+        blocks.append((
+            block_mask.T @ mask,
+            block_x.T @ mask,       # sum_x[i, j]: soma de x_i nas datas em que j também tem valor
+            (block_x * block_x).T @ mask,
+            block_x.T @ x,
+        ))
+    if not blocks:
+        return tuple(np.empty((0, values.shape[1])) for _ in range(4))
+    return tuple(np.vstack(moment) for moment in zip(*blocks))
+
+
+def block_bounds(start, stop, size=None):
+    """Limites [início, fim) dos blocos de `size` (COMOMENT_BLOCK) linhas entre `start` e `stop`."""
+    size = size or COMOMENT_BLOCK
+    return [(lo, min(lo + size, stop)) for lo in range(start, stop, size)]
+
+
+def correlation_from_comoments(n, sum_x, sum_xx, sum_xy, min_periods=MIN_CORRELATION_PERIODS):
+    """Matriz de correlação a partir dos co-momentos de `comoments`."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_i = sum_xx - sum_x ** 2 / n
+        corr = cov / np.sqrt(var_i * var_i.T)
+    corr[n < max(min_periods, 2)] = np.nan
+    corr = np.clip(corr, -1.0, 1.0)
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+def upper_triangle(corr):
+    """Valores acima da diagonal, linha a linha: (0,1), (0,2), ..., (1,2), ..."""
+    rows, cols = np.triu_indices(len(corr), k=1)
+    return corr.to_numpy()[rows, cols]
+
+
+def top_correlated(corr, k):
+    """Os `k` pares mais e menos correlacionados de cada símbolo.
+
+    Devolve dois arrays de posições (símbolos × k), ordenados do maior para o
+    menor e do menor para o maior; posições -1 indicam falta de pares válidos.
+    """
+    values = corr.to_numpy(dtype=np.float64).copy()
+    np.fill_diagonal(values, np.nan)
+    k = min(k, max(len(values) - 1, 0))
+    if k == 0:
+        empty = np.empty((len(values), 0), dtype=np.int64)
+        return empty, empty
+    missing = np.isnan(values)
+
+    def select(scores):
+        # argpartition escolhe os k melhores de cada linha sem ordenar a linha inteira
+        scores = np.where(missing, np.inf, scores)
+        picked = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(scores, picked, axis=1), axis=1, kind='stable')
+        picked = np.take_along_axis(picked, order, axis=1)
+        return np.where(np.take_along_axis(missing, picked, axis=1), -1, picked)
+
+    return select(-values), select(values)
+
+
+TAXONOMY_PATH = 'data/reference/taxonomy.json'
+
+
+def load_taxonomy(path=TAXONOMY_PATH):
+    """Lê o arquivo de referência de setores/regiões; sem arquivo, devolve uma taxonomia vazia.
+
+    Formato: {"symbols": {símbolo: {"sector": ..., "region": ..., "market_cap": ...}},
+              "sector_names": {setor em inglês (insights): nome usado na análise}}
+    Os valores de mercado estão todos na moeda e na data de "market_cap_currency"
+    e "market_cap_date", para que os pesos de um grupo sejam comparáveis.
+    """
+    try:
+        with open(path, 'r') as f:
+            taxonomy = json.load(f)
+    except FileNotFoundError:
+        taxonomy = {}
+    taxonomy.setdefault('symbols', {})
+    taxonomy.setdefault('sector_names', {})
+    return taxonomy
+
+
+def resolve_region(record, taxonomy):
+    """Região do arquivo de referência, ou a gravada pelo coletor."""
+    return taxonomy['symbols'].get(record['symbol'], {}).get('region') or record.get('region')
+
+
+def resolve_sector(symbol, stock_insight, taxonomy):
+    """Setor do arquivo de referência, ou o setor informado nos insights (traduzido por sector_names)."""
+    sector = taxonomy['symbols'].get(symbol, {}).get('sector')
+    if sector:
+        return sector
+    insights = (stock_insight or {}).get('insights') or {}
+    sector = (insights.get('instrumentInfo', {}).get('technicalEvents', {}).get('sector')
+              or insights.get('companySnapshot', {}).get('sectorInfo'))
+    if not sector:
+        return None
+    return taxonomy['sector_names'].get(sector, sector)
+
+
+def group_aggregates(rows, group_of, market_caps=None):
+    """Agregados de cada grupo calculados numa única passada de groupby.
+
+    `rows` são linhas de análise (com symbol, period_return e volatility),
+    `group_of` mapeia símbolo → grupo e `market_caps` símbolo → valor de mercado.
+    Devolve um DataFrame indexado pelo grupo, na ordem em que os grupos aparecem,
+    com count, avg_return, avg_volatility e as médias ponderadas pelo valor de
+    mercado (NaN quando nenhum membro do grupo tem valor de mercado).
+    """
+    frame = pd.DataFrame(rows, columns=['symbol', 'period_return', 'volatility'])
+    frame['group'] = frame['symbol'].map(group_of)
+    frame = frame[frame['group'].notna()]
+    weights = frame['symbol'].map(market_caps or {}).astype(np.float64)
+    frame = frame.assign(
+        weight=weights.fillna(0.0),
+        weighted_return=(weights * frame['period_return']).fillna(0.0),
+        weighted_volatility=(weights * frame['volatility']).fillna(0.0)
+    )
+
+    aggregates = frame.groupby('group', sort=False).agg(
+        count=('symbol', 'size'),
+        avg_return=('period_return', 'mean'),
+        avg_volatility=('volatility', 'mean'),
+        weight=('weight', 'sum'),
+        weighted_return=('weighted_return', 'sum'),
+        weighted_volatility=('weighted_volatility', 'sum')
+    )
+    total = aggregates['weight'].where(aggregates['weight'] > 0)
+    aggregates['cap_weighted_return'] = aggregates['weighted_return'] / total
+    aggregates['cap_weighted_volatility'] = aggregates['weighted_volatility'] / total
+    return aggregates[['count', 'avg_return', 'avg_volatility', 'cap_weighted_return', 'cap_weighted_volatility']]
+
+
+def aggregate_fields(aggregates, group):
+    """Campos JSON de um grupo de `group_aggregates`, arredondados a 2 casas (NaN vira None).
+
+    As médias ponderadas só aparecem quando algum membro do grupo tem valor de
+    mercado (os índices, por exemplo, não têm).
+    """
+    row = aggregates.loc[group]
+    fields = {'count': int(row['count'])}
+    for col in ('avg_return', 'avg_volatility', 'cap_weighted_return', 'cap_weighted_volatility'):
+        value = np.round(row[col], 2)
+        if np.isnan(value) and col.startswith('cap_weighted'):
+            continue
+        fields[col] = None if np.isnan(value) else value
+    return fields
@@ -0,0 +1,82 @@
+"""Coleta e análise em sequência, no mesmo processo.
+
+Os dados coletados passam direto para a análise, sem serem relidos do disco.
+Com `--every`, o processo fica ativo e repete o ciclo no intervalo dado,
+reaproveitando módulos já importados, o índice do cache de respostas, os
+registros gravados no ciclo anterior (o histórico da coleta seguinte), a
+taxonomia e o estado incremental da análise:
+
+    python data/market_pipeline.py --every 900
+
+Com `--incremental`, cada ciclo recalcula só os símbolos que receberam barras
+novas, o que permite atualizações intradiárias frequentes:
+
+    python data/market_pipeline.py --every 60 --incremental
+"""
+import argparse
+import time
+
+import analyze_market_data
+import collect_market_data
+import run_metrics
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description='Coleta e analisa os dados do mercado financeiro global.',
+        parents=[collect_market_data.build_arg_parser(), analyze_market_data.build_arg_parser()],
+        conflict_handler='resolve'
+    )
+    parser.add_argument('--every', type=float, default=None,
+                        help='Repete o ciclo a cada N segundos em vez de executar uma vez')
+    parser.add_argument('--skip-collect', action='store_true',
+                        help='Apenas analisa os dados já salvos em --data-dir')
+    return parser
+
+
+def run_once(collector, args, analyzer=None):
+    """Um ciclo de coleta e análise, com um relatório de métricas próprio.
+
+    Devolve o analisador, que pode ser passado de novo no ciclo seguinte.
+    """
+    metrics = run_metrics.metrics_from_args(args)
+    try:
+        data = {}
+        if collector is not None:
+            collector.metrics = metrics
+            data = collector.run()
+        if analyzer is None:
+            analyzer = analyze_market_data.analyzer_from_args(args, metrics, **data)
+        else:
+            analyzer.next_cycle(metrics, **data)
+        return analyzer.run()
+    finally:
+        run_metrics.write_reports(metrics, args)
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    collector = None if args.skip_collect else collect_market_data.collector_from_args(args, parser)
+
+    if args.every is None:
+        run_once(collector, args)
+        return
+
+    analyzer = None
+    while True:
+        started = time.monotonic()
+        try:
+            analyzer = run_once(collector, args, analyzer)
+        except Exception as e:
+            # Um ciclo com erro não derruba o agendador; o próximo tenta de novo,
+            # com um analisador novo (o estado incremental em memória pode ter ficado pela metade)
+            print(f"Erro no ciclo de coleta e análise: {str(e)}")
+            analyzer = None
+        elapsed = time.monotonic() - started
+        print(f"Ciclo concluído em {elapsed:.1f}s; próximo em {max(0.0, args.every - elapsed):.1f}s")
+        time.sleep(max(0.0, args.every - elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Rankings pré-calculados para o dashboard, em páginas JSON pequenas.
+
+Em vez de o navegador carregar e ordenar os arquivos de análise inteiros, a
+análise grava só os N primeiros de cada ranking (retorno, volatilidade, volume
+e setor), já ordenados, em páginas de poucos itens com um índice:
+
+    analysis/rankings/index.json               rankings, totais e páginas de cada um
+    analysis/rankings/<ranking>/page-001.json  itens 1..page_size
+
+A seleção usa um heap (O(n log N)) em vez de ordenar todas as linhas; empates
+são desfeitos pelo símbolo (ou nome do grupo), então as páginas não mudam entre
+execuções com os mesmos dados.
+"""
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+
+DEFAULT_TOP = 100
+DEFAULT_PAGE_SIZE = 25
+
+# Ranking: (conjunto, métrica, ordem decrescente?)
+RANKINGS = {
+    'stocks-return-best': ('stocks', 'period_return', True),
+    'stocks-return-worst': ('stocks', 'period_return', False),
+    'stocks-week-return-best': ('stocks', 'week_return', True),
+    'stocks-week-return-worst': ('stocks', 'week_return', False),
+    'stocks-volatility-highest': ('stocks', 'volatility', True),
+    'stocks-volatility-lowest': ('stocks', 'volatility', False),
+    'stocks-volume': ('stocks', 'avg_volume', True),
+    'indices-return-best': ('indices', 'period_return', True),
+    'indices-return-worst': ('indices', 'period_return', False),
+    'indices-volatility-highest': ('indices', 'volatility', True),
+    'sectors-return': ('sectors', 'avg_return', True),
+    'regions-return': ('regions', 'avg_return', True),
+}
+# Melhores ações de cada setor, por retorno no período
+SECTOR_RANKING = 'sector-{}-return'
+
+# Campos de cada item; o restante das linhas continua só nos arquivos de análise
+ENTRY_FIELDS = {
+    'stocks': ('symbol', 'name', 'region', 'last_price', 'period_return', 'week_return',
+               'volatility', 'avg_volume', 'trend'),
+    'indices': ('symbol', 'name', 'region', 'last_price', 'period_return', 'week_return',
+                'volatility', 'trend'),
+    'sectors': ('sector', 'count', 'avg_return', 'avg_volatility', 'cap_weighted_return'),
+    'regions': ('region', 'count', 'avg_return', 'avg_volatility', 'cap_weighted_return'),
+}
+KEY_FIELD = {'stocks': 'symbol', 'indices': 'symbol', 'sectors': 'sector', 'regions': 'region'}
+
+
+def slug(text):
+    """Nome de diretório para um grupo: 'Serviços Financeiros' -> 'servicos-financeiros'."""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'outros'
+
+
+def _finite(value):
+    return isinstance(value, (int, float)) and math.isfinite(value)
+
+
+def top_rows(rows, metric, n, descending=True, key='symbol'):
+    """Os `n` primeiros de `rows` por `metric`, sem ordenar a lista inteira.
+
+    Linhas sem valor numérico finito na métrica ficam de fora. Devolve
+    (selecionadas em ordem, total de candidatas).
+    """
+    candidates = [row for row in rows if _finite(row.get(metric))]
+    sign = -1 if descending else 1
+    return heapq.nsmallest(n, candidates, key=lambda row: (sign * row[metric], row[key])), len(candidates)
+
+
+def _ranking(dataset, rows, metric, descending, n):
+    selected, total = top_rows(rows, metric, n, descending, KEY_FIELD[dataset])
+    entries = [dict({'rank': rank}, **{f: row[f] for f in ENTRY_FIELDS[dataset] if f in row})
+               for rank, row in enumerate(selected, 1)]
+    return {'dataset': dataset, 'metric': metric, 'order': 'desc' if descending else 'asc',
+            'total': total, 'entries': entries}
+
+
+def build_rankings(indices_analysis, stocks_analysis, regions, sectors_analysis, top=DEFAULT_TOP):
+    """Monta todos os rankings a partir dos resultados da análise.
+
+    `regions` e `sectors_analysis` são os dicionários por nome da análise; os
+    rankings por setor usam a lista de ações de cada setor.
+    """
+    datasets = {
+        'indices': indices_analysis or [],
+        'stocks': stocks_analysis or [],
+        'regions': [dict(fields, region=name) for name, fields in (regions or {}).items()],
+        'sectors': [dict(fields, sector=name) for name, fields in (sectors_analysis or {}).items()],
+    }
+    rankings = {name: _ranking(dataset, datasets[dataset], metric, descending, top)
+                for name, (dataset, metric, descending) in RANKINGS.items()}
+
+    stock_by_symbol = {stock['symbol']: stock for stock in datasets['stocks']}
+    for sector in sorted(sectors_analysis or {}):
+        name = SECTOR_RANKING.format(slug(sector))
+        suffix = 2
+        while name in rankings:
+            name = SECTOR_RANKING.format(f'{slug(sector)}-{suffix}')
+            suffix += 1
+        members = [stock_by_symbol[s] for s in sectors_analysis[sector]['stocks'] if s in stock_by_symbol]
+        rankings[name] = dict(_ranking('stocks', members, 'period_return', True, top), sector=sector)
+    return rankings
+
+
+def write_rankings(rankings, rankings_dir, page_size=DEFAULT_PAGE_SIZE, top=DEFAULT_TOP, date=None):
+    """Grava as páginas e o índice; remove páginas de execuções anteriores que sobraram.
+
+    Devolve o caminho do índice.
+    """
+    manifest = {'date': date, 'top': top, 'page_size': page_size, 'rankings': {}}
+    written = set()
+    for name, ranking in rankings.items():
+        entries = ranking['entries']
+        pages = [entries[start:start + page_size] for start in range(0, len(entries), page_size)]
+        os.makedirs(os.path.join(rankings_dir, name), exist_ok=True)
+        paths = []
+        for number, page in enumerate(pages, 1):
+            relative = f'{name}/page-{number:03d}.json'
+            with open(os.path.join(rankings_dir, relative), 'w') as f:
+                json.dump({'ranking': name, 'page': number, 'pages': len(pages), 'entries': page}, f)
+            written.add(os.path.normpath(os.path.join(rankings_dir, relative)))
+            paths.append(relative)
+        info = {k: v for k, v in ranking.items() if k != 'entries'}
+        manifest['rankings'][name] = dict(info, size=len(entries), pages=paths)
+
+    # Rankings que encolheram (ou setores que sumiram) não podem deixar páginas antigas
+    for root, _, names in os.walk(rankings_dir, topdown=False):
+        for file_name in names:
+            path = os.path.normpath(os.path.join(root, file_name))
+            if re.fullmatch(r'page-\d+\.json', file_name) and path not in written:
+                os.remove(path)
+        if root != rankings_dir and not os.listdir(root):
+            os.rmdir(root)
+
+    index_path = os.path.join(rankings_dir, 'index.json')
+    with open(index_path, 'w') as f:
+        json.dump(manifest, f)
+    return index_path
@@ -0,0 +1,212 @@
+"""Reamostragem de barras OHLCV por calendário (intradiário → diário → semanal).
+
+As barras são agrupadas pelo dia (ou pela semana, de segunda a domingo) no fuso
+da bolsa, e não por deslocamento de posição, então feriados e pregões
+incompletos não deslocam as barras seguintes. O cálculo é vetorizado sobre as
+colunas de todos os símbolos concatenadas (como no armazenamento colunar),
+com `reduceat` nos limites de cada grupo, sem laços por símbolo ou por barra:
+
+    open      primeira abertura válida do grupo
+    high/low  máxima e mínima, ignorando NaN
+    close     último fechamento válido (idem adjclose)
+    volume    soma dos volumes válidos (NaN se nenhum)
+    timestamp o da primeira barra do grupo
+"""
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+# Intervalos aceitos pela API de gráficos, em segundos
+INTERVAL_SECONDS = {
+    '1m': 60, '2m': 120, '5m': 300, '15m': 900, '30m': 1800,
+    '60m': 3600, '90m': 5400, '1h': 3600, '1d': SECONDS_PER_DAY, '1wk': 7 * SECONDS_PER_DAY,
+}
+INTRADAY_INTERVALS = tuple(name for name, seconds in INTERVAL_SECONDS.items() if seconds < SECONDS_PER_DAY)
+
+# Intervalos em que a análise pode ser feita e quantos períodos cabem num ano
+ANALYSIS_INTERVALS = ('1d', '1wk')
+PERIODS_PER_YEAR = {'1d': 252, '1wk': 52}
+
+
+def granularity(record):
+    """Intervalo das barras de um registro (meta.dataGranularity), '1d' se não informado."""
+    return (record.get('meta') or {}).get('dataGranularity') or '1d'
+
+
+def needs_resample(interval, target):
+    return INTERVAL_SECONDS.get(interval, SECONDS_PER_DAY) < INTERVAL_SECONDS[target]
+
+
+def bucket_keys(timestamps, gmtoffsets, target='1d'):
+    """Dia (ou semana) do calendário local de cada barra, como inteiro crescente."""
+    days = (np.asarray(timestamps, dtype=np.int64) + gmtoffsets) // SECONDS_PER_DAY
+    if target == '1wk':
+        # 1970-01-01 foi uma quinta-feira; as semanas começam na segunda
+        return (days + 3) // 7
+    return days
+
+
+def resample_columns(timestamps, columns, codes, gmtoffsets, target='1d'):
+    """Reamostra colunas concatenadas de vários símbolos.
+
+    `timestamps`, cada coluna de `columns` e `codes` (o número do símbolo de
+    cada linha) têm o mesmo tamanho, com as linhas ordenadas por símbolo e
+    depois por timestamp. `gmtoffsets` é o deslocamento do fuso por linha (ou
+    um escalar). Devolve (timestamps, colunas, códigos) das barras reamostradas.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+    n = len(timestamps)
+    if n == 0:
+        return timestamps[:0], {col: np.empty(0) for col in columns}, codes[:0]
+
+    keys = bucket_keys(timestamps, gmtoffsets, target)
+    boundary = np.empty(n, dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (keys[1:] != keys[:-1]) | (codes[1:] != codes[:-1])
+    starts = np.flatnonzero(boundary)
+    positions = np.arange(n)
+
+    def first_valid(values):
+        valid = ~np.isnan(values)
+        pos = np.minimum.reduceat(np.where(valid, positions, n), starts)
+        return np.where(pos < n, values[np.minimum(pos, n - 1)], np.nan)
+
+    def last_valid(values):
+        valid = ~np.isnan(values)
+        pos = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+        return np.where(pos >= 0, values[np.maximum(pos, 0)], np.nan)
+
+    resampled = {}
+    for col, values in columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        if col == 'open':
+            resampled[col] = first_valid(values)
+        elif col == 'high':
+            resampled[col] = np.fmax.reduceat(values, starts)
+        elif col == 'low':
+            resampled[col] = np.fmin.reduceat(values, starts)
+        elif col == 'volume':
+            valid = ~np.isnan(values)
+            total = np.add.reduceat(np.where(valid, values, 0.0), starts)
+            resampled[col] = np.where(np.add.reduceat(valid.astype(np.int64), starts) > 0, total, np.nan)
+        else:
+            resampled[col] = last_valid(values)
+    return timestamps[starts], resampled, codes[starts]
+
+
+def resample_records(records, target='1d'):
+    """Registros no formato da API com as barras mais finas que `target` reamostradas.
+
+    Registros já no intervalo pedido (ou mais largo) são devolvidos como estão.
+    Os reamostrados trazem arrays float nas colunas e meta.dataGranularity = `target`.
+    """
+    pending = [i for i, record in enumerate(records) if needs_resample(granularity(record), target)]
+    if not pending:
+        return records
+
+    parts = {'timestamp': [], 'code': [], 'offset': []}
+    columns = {}
+    for code, i in enumerate(pending):
+        record = records[i]
+        timestamps = np.asarray(record.get('timestamp') if record.get('timestamp') is not None else [],
+                                dtype=np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        parts['timestamp'].append(timestamps[order])
+        parts['code'].append(np.full(len(timestamps), code))
+        parts['offset'].append(np.full(len(timestamps), int((record.get('meta') or {}).get('gmtoffset') or 0)))
+        quote = (record.get('indicators', {}).get('quote') or [{}])[0]
+        adjclose = (record.get('indicators', {}).get('adjclose') or [{}])[0].get('adjclose')
+        for col, values in list(quote.items()) + ([('adjclose', adjclose)] if adjclose is not None else []):
+            column = np.full(len(timestamps), np.nan)
+            values = np.asarray(values if values is not None else [], dtype=np.float64)[:len(timestamps)]
+            column[:len(values)] = values
+            columns.setdefault(col, {})[code] = column[order]
+
+    sizes = [len(t) for t in parts['timestamp']]
+    flat = {col: np.concatenate([by_code.get(code, np.full(size, np.nan)) for code, size in enumerate(sizes)])
+            for col, by_code in columns.items()}
+    timestamps, resampled, codes = resample_columns(
+        np.concatenate(parts['timestamp']), flat, np.concatenate(parts['code']),
+        np.concatenate(parts['offset']), target)
+    return _replace_series(records, pending, timestamps, resampled, codes, target)
+
+
+def _replace_series(records, pending, timestamps, resampled, codes, target):
+    bounds = np.searchsorted(codes, np.arange(len(pending) + 1))
+    output = list(records)
+    for code, i in enumerate(pending):
+        lo, hi = bounds[code], bounds[code + 1]
+        record = dict(records[i])
+        record['meta'] = dict(record.get('meta') or {}, dataGranularity=target)
+        record['timestamp'] = timestamps[lo:hi]
+        quote = {col: values[lo:hi] for col, values in resampled.items() if col != 'adjclose'}
+        record['indicators'] = {'quote': [quote]}
+        if 'adjclose' in resampled:
+            record['indicators']['adjclose'] = [{'adjclose': resampled['adjclose'][lo:hi]}]
+        output[i] = record
+    return output
+
+
+def resample_store(store, columns, target='1d', start=0, stop=None):
+    """Reamostra todos os símbolos mais finos que `target` de um `TimeSeriesStore`.
+
+    Lê cada coluna mapeada uma única vez, em ordem, sem montar um registro por
+    símbolo antes; `start` e `stop` limitam a leitura a uma faixa dos símbolos
+    do manifesto. Devolve {símbolo: {'timestamp': ..., coluna: ...}} só dos
+    símbolos reamostrados.
+    """
+    entries = [entry for entry in store.manifest['symbols'][start:stop]
+               if needs_resample(granularity(entry), target) and entry['stop'] > entry['start']]
+    if not entries:
+        return {}
+    lengths = np.array([entry['stop'] - entry['start'] for entry in entries])
+    rows = np.concatenate([np.arange(entry['start'], entry['stop']) for entry in entries])
+    # Intervalos contíguos (o caso comum, todos os símbolos intradiários) são lidos como fatias
+    contiguous = rows[-1] - rows[0] + 1 == len(rows)
+
+    def read(name):
+        column = store.column(name)
+        return column[rows[0]:rows[-1] + 1] if contiguous else column[rows]
+
+    codes = np.repeat(np.arange(len(entries)), lengths)
+    offsets = np.repeat([int((entry.get('meta') or {}).get('gmtoffset') or 0) for entry in entries], lengths)
+    timestamps, resampled, codes = resample_columns(
+        read('timestamp'), {col: read(col) for col in columns}, codes, offsets, target)
+    bounds = np.searchsorted(codes, np.arange(len(entries) + 1))
+    return {
+        entry['symbol']: dict({'timestamp': timestamps[bounds[i]:bounds[i + 1]]},
+                              **{col: values[bounds[i]:bounds[i + 1]] for col, values in resampled.items()})
+        for i, entry in enumerate(entries)
+    }
+
+
+def store_records(store, columns, target='1d', start=0, stop=None):
+    """Registros no formato da API dos símbolos `start`..`stop` de um `TimeSeriesStore`.
+
+    As colunas são views sobre os arquivos mapeados em memória, sem cópia; os
+    símbolos mais finos que `target` chegam reamostrados, com
+    meta.dataGranularity = `target`.
+    """
+    resampled = resample_store(store, columns, target, start, stop)
+    records = []
+    for entry in store.manifest['symbols'][start:stop]:
+        symbol = entry['symbol']
+        series = resampled.get(symbol)
+        meta = entry['meta']
+        if series is None:
+            series = store.read(symbol, columns=columns)
+        else:
+            meta = dict(meta, dataGranularity=target)
+        records.append({
+            'symbol': symbol,
+            'name': entry['name'],
+            'region': entry['region'],
+            'meta': meta,
+            'timestamp': series['timestamp'],
+            'indicators': {
+                'quote': [{col: series[col] for col in columns if col != 'adjclose'}],
+                'adjclose': [{'adjclose': series['adjclose']}]
+            }
+        })
+    return records
@@ -0,0 +1,172 @@
+"""Análise em vários processos, por fatias do universo de símbolos.
+
+Os registros são divididos em fatias contíguas e cada processo faz, sobre a
+sua fatia, todo o trabalho por símbolo do modo de um processo só: monta as
+matrizes (field_matrix, day_matrix, quote_matrices), calcula as métricas e o
+pacote de risco com as mesmas funções em lote (market_analytics,
+risk_analytics) e já devolve as linhas prontas da análise, com as junções de
+insights feitas. O processo principal só junta as linhas na ordem das fatias.
+Registros lidos do armazenamento colunar não são enviados aos processos: cada
+um recebe só a faixa de símbolos e lê a sua fatia dos arquivos mapeados.
+
+Para que o resultado seja idêntico ao de um processo, cada fatia monta as
+matrizes com a largura do universo inteiro, os betas usam as datas dos
+benchmarks (que não dependem da fatia) e as fatias são formadas por blocos
+inteiros de COMOMENT_BLOCK símbolos, os mesmos blocos dos produtos de matrizes
+nos dois modos. Na correlação, a matriz de retornos vai para os processos uma
+única vez, num arquivo mapeado em memória, e cada um calcula os co-momentos das
+colunas da sua fatia contra todas as demais.
+
+Os agregados por região e setor continuam no processo principal: são somas
+sobre poucas linhas já arredondadas, e somar parciais de cada fatia mudaria a
+ordem das somas de ponto flutuante.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import market_analytics
+import ohlcv_resample
+import risk_analytics
+import timeseries_store
+
+
+def resolve_workers(workers):
+    """Número de processos; 0 usa todos os núcleos."""
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+def shard_bounds(n, shards, block=1):
+    """Limites [início, fim) de até `shards` fatias contíguas de tamanhos parecidos.
+
+    Com `block`, as fatias começam em múltiplos de `block`.
+    """
+    n_blocks = -(-n // block)
+    shards = max(1, min(shards, n_blocks))
+    edges = [min(n_blocks * i // shards * block, n) for i in range(shards + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# Funções executadas nos processos (precisam estar no nível do módulo)
+
+def _shard_records(shard):
+    """Registros de uma fatia: a lista recebida ou, para (armazenamento, intervalo, início, fim), lidos dele."""
+    if isinstance(shard, list):
+        return shard
+    store_path, interval, start, stop = shard
+    return ohlcv_resample.store_records(
+        timeseries_store.TimeSeriesStore(store_path), timeseries_store.COLUMNS, interval, start, stop)
+
+
+def _risk_fields(shard, benchmarks, periods_per_year, risk_free_rate, width):
+    return risk_analytics.risk_fields_by_symbol(*risk_analytics.compute_risk_metrics(
+        _shard_records(shard), benchmarks, periods_per_year, risk_free_rate, width))
+
+
+def _rows_shard(shard, widths, periods_per_year, taxonomy, insights, benchmarks, risk_free_rate):
+    records = _shard_records(shard)
+    closes = market_analytics.field_matrix(records, 'close', widths['close'])
+    volumes = market_analytics.field_matrix(records, 'volume', widths['volume']) if insights is not None else None
+    days = market_analytics.day_matrix(records, width=widths['close'])
+    metrics = market_analytics.metrics_by_symbol(
+        market_analytics.compute_metrics(closes, volumes, days=days, periods_per_year=periods_per_year))
+    risk_fields = None if benchmarks is None else \
+        _risk_fields(records, benchmarks, periods_per_year, risk_free_rate, widths['risk'])
+    return market_analytics.analysis_rows(records, metrics, taxonomy, insights, risk_fields)
+
+
+def _comoments_shard(path, start, stop):
+    return market_analytics.comoments(np.load(path, mmap_mode='r'), start, stop)
+
+
+class ShardedExecutor:
+    """Distribui os cálculos por símbolo da análise por um pool de processos.
+
+    O pool é criado no primeiro uso e reaproveitado pelas etapas; `close`
+    encerra os processos.
+    """
+
+    def __init__(self, workers):
+        self.workers = resolve_workers(workers)
+        self.shards = 0
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def map_shards(self, task, n, block=market_analytics.COMOMENT_BLOCK):
+        """Executa no pool a tarefa de cada fatia de `n` itens; resultados na ordem das fatias.
+
+        `task(início, fim)` devolve a tupla (função, *argumentos) da fatia.
+        """
+        futures = [self.pool.submit(*task(lo, hi)) for lo, hi in shard_bounds(n, self.workers, block)]
+        self.shards += len(futures)
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def shard(records, start, stop, store=None, interval='1d'):
+        """O que vai para o processo de uma fatia: os registros ou, se vieram de `store`, a faixa a ler dele."""
+        return (store, interval, start, stop) if store else records[start:stop]
+
+    def analysis_rows(self, records, taxonomy, periods_per_year, insights=None, benchmarks=None,
+                      risk_free_rate=0.0, store=None, interval='1d'):
+        """Linhas de `market_analytics.analysis_rows` para `records`, calculadas por fatia.
+
+        Com `insights`, as linhas são de ações; com `benchmarks`, incluem o
+        pacote de risco. Se `records` são os de `store` (ver
+        `ohlcv_resample.store_records`), cada processo lê deles a sua fatia.
+        Devolve (linhas, nomes sem dados suficientes).
+        """
+        records = list(records)
+        benchmarks = None if benchmarks is None else list(benchmarks)
+        widths = {
+            'close': market_analytics.series_width(records, 'close'),
+            'volume': market_analytics.series_width(records, 'volume') if insights is not None else None,
+            'risk': risk_analytics.quote_width(records) if benchmarks is not None else None,
+        }
+
+        def task(lo, hi):
+            shard_insights = None if insights is None else {
+                record['symbol']: insights.get(record['symbol']) for record in records[lo:hi]}
+            return (_rows_shard, self.shard(records, lo, hi, store, interval), widths, periods_per_year,
+                    taxonomy, shard_insights, benchmarks, risk_free_rate)
+
+        parts = self.map_shards(task, len(records))
+        return ([row for rows, _ in parts for row in rows],
+                [name for _, insufficient in parts for name in insufficient])
+
+    def risk_fields(self, records, benchmarks=(), periods_per_year=252, risk_free_rate=0.0,
+                    store=None, interval='1d'):
+        """Como `risk_analytics.risk_fields_by_symbol` do pacote de `records`, calculado por fatia."""
+        records, benchmarks = list(records), list(benchmarks)
+        width = risk_analytics.quote_width(records)
+        fields = {}
+        for part in self.map_shards(lambda lo, hi: (_risk_fields, self.shard(records, lo, hi, store, interval),
+                                                    benchmarks, periods_per_year, risk_free_rate, width),
+                                    len(records)):
+            fields.update(part)
+        return fields
+
+    def correlation_matrix(self, returns, window=None, min_periods=market_analytics.MIN_CORRELATION_PERIODS):
+        """Como `market_analytics.correlation_matrix`, com os co-momentos calculados por blocos de colunas."""
+        if window:
+            returns = returns.iloc[-window:]
+        values = returns.to_numpy(dtype=np.float64)
+        with tempfile.TemporaryDirectory(prefix='rp_finances_returns_') as tmp_dir:
+            path = os.path.join(tmp_dir, 'returns.npy')
+            np.save(path, values)
+            parts = self.map_shards(lambda lo, hi: (_comoments_shard, path, lo, hi), values.shape[1])
+        comoments = [np.vstack(part) for part in zip(*parts)]
+        corr = market_analytics.correlation_from_comoments(*comoments, min_periods=min_periods)
+        return pd.DataFrame(corr, index=returns.columns, columns=returns.columns)
@@ -0,0 +1,179 @@
+"""Registros por símbolo em NDJSON (um objeto JSON por linha).
+
+No modo streaming a coleta não monta listas com o universo inteiro: cada
+registro é acrescentado a `<arquivo>.ndjson.partial` assim que o símbolo
+termina, e o arquivo é descarregado a cada linha, de modo que uma queda do
+processo no meio da coleta não perde os símbolos já concluídos. Ao final,
+`NDJSONWriter.finish` grava `<arquivo>.ndjson` na ordem da lista de ativos,
+copiando as linhas por deslocamento, sem carregá-las todas.
+
+`NDJSONReader` lê os registros sob demanda: iterando o arquivo linha a linha
+ou buscando um símbolo pelo deslocamento guardado num índice.
+"""
+import json
+import os
+import threading
+
+NDJSON_SUFFIX = '.ndjson'
+PARTIAL_SUFFIX = '.partial'
+
+
+def ndjson_path(json_path):
+    """Caminho NDJSON equivalente a um arquivo .json (stocks_data.json → stocks_data.ndjson)."""
+    root, _ = os.path.splitext(json_path)
+    return root + NDJSON_SUFFIX
+
+
+def newest(json_path):
+    """O mais recente entre `json_path` e sua versão NDJSON, ou None se nenhum existir.
+
+    Assim, alternar entre o modo streaming e o normal nunca faz a leitura
+    pegar um arquivo antigo do outro formato.
+    """
+    candidates = [path for path in (json_path, ndjson_path(json_path)) if os.path.exists(path)]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def _scan(f):
+    """Percorre um arquivo NDJSON aberto em modo binário, devolvendo (deslocamento, tamanho, registro).
+
+    Uma última linha incompleta (gravação interrompida) é ignorada.
+    """
+    f.seek(0)
+    offset = 0
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        yield offset, len(line), json.loads(line)
+        offset += len(line)
+
+
+class NDJSONReader:
+    """Leitura preguiçosa de um arquivo NDJSON de registros com a chave 'symbol'."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._offsets = None
+        self._file = None
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            for _, _, record in _scan(f):
+                yield record
+
+    def _index(self):
+        if self._offsets is None:
+            offsets = {}
+            with open(self.path, 'rb') as f:
+                for offset, _, record in _scan(f):
+                    offsets[record['symbol']] = offset
+            self._offsets = offsets
+        return self._offsets
+
+    @property
+    def symbols(self):
+        with self.lock:
+            return list(self._index())
+
+    def __len__(self):
+        # Também define o valor lógico: um arquivo sem registros conta como vazio
+        with self.lock:
+            return len(self._index())
+
+    def get(self, symbol, default=None):
+        with self.lock:
+            offset = self._index().get(symbol)
+            if offset is None:
+                return default
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            self._file.seek(offset)
+            return json.loads(self._file.readline())
+
+    def close(self):
+        with self.lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class Layered:
+    """Busca por símbolo em várias fontes (objetos com `get`), na ordem dada."""
+
+    def __init__(self, *sources):
+        self.sources = sources
+
+    def get(self, symbol, default=None):
+        for source in self.sources:
+            record = source.get(symbol)
+            if record is not None:
+                return record
+        return default
+
+
+class NDJSONWriter:
+    """Acrescenta registros a `<path>.partial` e, ao final, grava `path` em ordem determinística.
+
+    Se um `.partial` de uma execução interrompida já existir, ele é retomado:
+    seus registros completos continuam disponíveis por `get` e são mantidos
+    no arquivo final, a menos que um registro novo do mesmo símbolo os substitua.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.recovered = 0
+        if os.path.exists(self.partial_path):
+            self._recover()
+        self.file = open(self.partial_path, 'ab')
+        self._reader = None
+
+    def _recover(self):
+        with open(self.partial_path, 'r+b') as f:
+            end = 0
+            for offset, length, record in _scan(f):
+                self.offsets[record['symbol']] = offset
+                end = offset + length
+            # Descarta a linha incompleta deixada pela queda
+            f.truncate(end)
+        self.recovered = len(self.offsets)
+
+    def write(self, record):
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+            self.offsets[record['symbol']] = offset
+
+    def get(self, symbol, default=None):
+        """Registro já gravado (nesta execução ou na interrompida) para o símbolo."""
+        with self.lock:
+            offset = self.offsets.get(symbol)
+            if offset is None:
+                return default
+            if self._reader is None:
+                self._reader = open(self.partial_path, 'rb')
+            self._reader.seek(offset)
+            return json.loads(self._reader.readline())
+
+    def finish(self, order):
+        """Grava `path` com os registros na ordem dos símbolos em `order` e remove o parcial."""
+        with self.lock:
+            self.file.close()
+            if self._reader:
+                self._reader.close()
+            tmp_path = self.path + '.tmp'
+            with open(self.partial_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for symbol in order:
+                    offset = self.offsets.get(symbol)
+                    if offset is None:
+                        continue
+                    src.seek(offset)
+                    dst.write(src.readline())
+            os.replace(tmp_path, self.path)
+            os.remove(self.partial_path)
+        return NDJSONReader(self.path)
@@ -0,0 +1,204 @@
+"""Métricas de risco e indicadores técnicos calculados em lote.
+
+Como em market_analytics, tudo sai de matrizes símbolos × datas com os preços
+válidos de cada linha encostados à direita, sem laços por símbolo. As médias
+exponenciais (RSI, MACD e ATR) avançam juntas numa única passada pelas datas,
+cada passo atualizando todos os símbolos:
+
+    max_drawdown        maior queda desde um topo anterior, em %
+    sharpe_ratio        retorno médio em excesso / desvio padrão, anualizados
+    sortino_ratio       idem, com o desvio só dos retornos abaixo da taxa livre de risco
+    beta                {índice: beta} contra cada índice, nas datas em comum
+    rsi                 índice de força relativa de RSI_WINDOW períodos (Wilder)
+    ema_fast, ema_slow  médias exponenciais de MACD_FAST e MACD_SLOW períodos
+    macd, macd_signal, macd_histogram
+    atr                 média de Wilder do true range (máxima, mínima e fechamento)
+
+As médias partem do primeiro valor, como `ewm(adjust=False)` do pandas (as de
+Wilder, portanto, não da média simples dos primeiros períodos), e valores
+ausentes não alteram a média. Indicadores sem barras suficientes para a
+janela ficam None.
+"""
+import numpy as np
+import pandas as pd
+
+from market_analytics import (MIN_CORRELATION_PERIODS, aligned_return_matrix, block_bounds,
+                              compact_order, field_matrix, series_width)
+
+RSI_WINDOW = 14
+ATR_WINDOW = 14
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+
+# Casas decimais de cada campo nos arquivos de análise
+RISK_DIGITS = {
+    'max_drawdown': 2, 'sharpe_ratio': 2, 'sortino_ratio': 2, 'rsi': 2,
+    'ema_fast': 4, 'ema_slow': 4, 'macd': 4, 'macd_signal': 4, 'macd_histogram': 4, 'atr': 4,
+}
+BETA_DIGITS = 2
+
+
+def _exponential_indicators(closes, previous, true_range):
+    """Últimos valores das médias exponenciais, numa passada pelas datas.
+
+    Camadas: ganho e perda médios (RSI), ATR, EMA rápida e lenta; a linha de
+    sinal do MACD acompanha a mesma passada, sobre o MACD de cada data. Cada
+    média fica NaN até ter tantos valores quanto a sua janela.
+    """
+    n_rows, width = closes.shape
+    windows = np.array([RSI_WINDOW, RSI_WINDOW, ATR_WINDOW, MACD_FAST, MACD_SLOW])[:, None]
+    alpha = np.array([1 / RSI_WINDOW, 1 / RSI_WINDOW, 1 / ATR_WINDOW,
+                      2 / (MACD_FAST + 1), 2 / (MACD_SLOW + 1)])[:, None]
+    signal_alpha = 2 / (MACD_SIGNAL + 1)
+    # Em ordem de datas, cada passo lê linhas contíguas
+    closes_by_date = np.ascontiguousarray(closes.T)
+    change_by_date = np.ascontiguousarray((closes - previous).T)
+    range_by_date = np.ascontiguousarray(true_range.T)
+
+    mean = np.zeros((len(windows), n_rows))
+    seen = np.zeros((len(windows), n_rows), dtype=np.int64)
+    signal = np.zeros(n_rows)
+    signal_seen = np.zeros(n_rows, dtype=np.int64)
+    for t in range(width):
+        change = change_by_date[t]
+        x = np.stack([np.clip(change, 0, None), np.clip(-change, 0, None), range_by_date[t],
+                      closes_by_date[t], closes_by_date[t]])
+        valid = ~np.isnan(x)
+        mean = np.where(valid, np.where(seen > 0, mean + alpha * (x - mean), x), mean)
+        seen += valid
+        has_macd = valid[4] & (seen[4] >= MACD_SLOW)
+        macd = mean[3] - mean[4]
+        signal = np.where(has_macd, np.where(signal_seen > 0, signal + signal_alpha * (macd - signal), macd), signal)
+        signal_seen += has_macd
+    mean = np.where(seen >= windows, mean, np.nan)
+    return mean, np.where(signal_seen >= MACD_SIGNAL, signal, np.nan)
+
+
+def quote_width(records, fields=('close', 'high', 'low')):
+    """Largura comum das matrizes de `quote_matrices`: a maior série entre os campos."""
+    return max(series_width(records, field) for field in fields)
+
+
+def quote_matrices(records, fields, width=None):
+    """Matrizes de `fields` alinhadas à direita e com a mesma largura (por padrão, `quote_width`)."""
+    width = quote_width(records, fields) if width is None else width
+    return [field_matrix(records, field, width).to_numpy(dtype=np.float64) for field in fields]
+
+
+def betas(returns, benchmark_returns, min_periods=MIN_CORRELATION_PERIODS):
+    """Beta de cada coluna de `returns` contra cada coluna de `benchmark_returns`.
+
+    As duas matrizes são datas × símbolos, alinhadas pelas mesmas datas. Cada
+    par usa só as datas em que ambos têm retorno; as somas de todos os pares
+    saem de produtos de matrizes, em blocos de COMOMENT_BLOCK símbolos como em
+    `comoments`. Devolve a matriz símbolos × benchmarks.
+    """
+    benchmark_valid = ~np.isnan(benchmark_returns)
+    b = np.where(benchmark_valid, benchmark_returns, 0.0)
+    benchmark_mask = benchmark_valid.astype(np.float64)
+    blocks = [np.empty((0, b.shape[1]))]
+    for lo, hi in block_bounds(0, returns.shape[1]):
+        block = np.ascontiguousarray(returns[:, lo:hi])
+        valid = ~np.isnan(block)
+        x, mask = np.where(valid, block, 0.0), valid.astype(np.float64)
+        n = mask.T @ benchmark_mask
+        sum_x = x.T @ benchmark_mask
+        sum_b = mask.T @ b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = x.T @ b - sum_x * sum_b / n
+            var = mask.T @ (b * b) - sum_b ** 2 / n
+            beta = cov / var
+        blocks.append(np.where((n >= min_periods) & (var > 0), beta, np.nan))
+    return np.vstack(blocks)
+
+
+def compute_risk_metrics(records, benchmarks=(), periods_per_year=252, risk_free_rate=0.0, width=None):
+    """Calcula o pacote de risco de todos os `records` de uma vez.
+
+    `benchmarks` são os registros (índices) usados no beta e `risk_free_rate`
+    é a taxa livre de risco anual, em fração; `width` é a de `quote_matrices`.
+    Devolve (DataFrame de métricas, DataFrame de betas símbolos × benchmarks),
+    ambos indexados pelo símbolo e sem arredondamento.
+    """
+    symbols = [record['symbol'] for record in records]
+    closes, highs, lows = quote_matrices(records, ('close', 'high', 'low'), width)
+    metrics = risk_metrics(symbols, closes, highs, lows, periods_per_year, risk_free_rate)
+
+    # Beta sobre os retornos alinhados por data, como na correlação. Só as datas
+    # com retorno de algum benchmark contam, então elas são as linhas da matriz,
+    # que assim não dependem de quais outros registros estão em `records`
+    benchmarks = list(benchmarks)
+    benchmark_days, benchmark_returns = aligned_return_matrix(benchmarks)
+    _, returns = aligned_return_matrix(records, days=benchmark_days)
+    beta = pd.DataFrame(betas(returns, benchmark_returns),
+                        index=symbols, columns=[record['symbol'] for record in benchmarks])
+    return metrics, beta
+
+
+def risk_metrics(symbols, closes, highs, lows, periods_per_year=252, risk_free_rate=0.0):
+    """Campos do pacote, exceto o beta, a partir das matrizes de `quote_matrices`.
+
+    Cada linha é calculada de forma independente das demais.
+    """
+    n_rows, width = closes.shape
+
+    # Como em compute_metrics: barras sem fechamento saem e as demais encostam à direita
+    order = compact_order(closes)
+    closes, highs, lows = (np.take_along_axis(m, order, axis=1) for m in (closes, highs, lows))
+    previous = np.concatenate([np.full((n_rows, min(width, 1)), np.nan), closes[:, :-1]], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak = np.fmax.accumulate(closes, axis=1)
+        max_drawdown = np.fmin.reduce(closes / peak - 1, axis=1) * 100 if width else np.full(n_rows, np.nan)
+
+        returns = closes / previous - 1
+        valid = ~np.isnan(returns)
+        n_returns = valid.sum(axis=1)
+        excess = np.where(valid, returns - risk_free_rate / periods_per_year, 0.0)
+        mean_excess = excess.sum(axis=1) / n_returns
+        std = np.sqrt((np.where(valid, excess - mean_excess[:, None], 0.0) ** 2).sum(axis=1) / n_returns)
+        downside = np.sqrt((np.minimum(excess, 0.0) ** 2).sum(axis=1) / n_returns)
+        annualize = np.sqrt(periods_per_year)
+        sharpe = np.where((n_returns >= 2) & (std > 0), mean_excess / std * annualize, np.nan)
+        sortino = np.where((n_returns >= 2) & (downside > 0), mean_excess / downside * annualize, np.nan)
+
+        # True range: a primeira barra válida (sem fechamento anterior) usa só máxima - mínima
+        true_range = np.fmax(highs, previous) - np.fmin(lows, previous)
+        true_range[np.isnan(highs) | np.isnan(lows)] = np.nan
+
+        (avg_gain, avg_loss, atr, ema_fast, ema_slow), macd_signal = \
+            _exponential_indicators(closes, previous, true_range)
+        rsi = np.where(avg_loss > 0, 100 - 100 / (1 + avg_gain / avg_loss),
+                       np.where(avg_gain > 0, 100.0, 50.0))
+        rsi[np.isnan(avg_gain) | np.isnan(avg_loss)] = np.nan
+        macd = ema_fast - ema_slow
+
+    metrics = pd.DataFrame({
+        'max_drawdown': max_drawdown,
+        'sharpe_ratio': sharpe,
+        'sortino_ratio': sortino,
+        'rsi': rsi,
+        'ema_fast': ema_fast,
+        'ema_slow': ema_slow,
+        'macd': macd,
+        'macd_signal': macd_signal,
+        'macd_histogram': macd - macd_signal,
+        'atr': atr,
+    }, index=symbols)
+    return metrics
+
+
+def _value(value, digits):
+    return None if not np.isfinite(value) else round(float(value), digits)
+
+
+def risk_fields_by_symbol(metrics, beta):
+    """Converte o resultado de `compute_risk_metrics` em {símbolo: campos}, prontos para o JSON."""
+    columns = {col: metrics[col].to_numpy() for col in metrics.columns}
+    beta_values = beta.to_numpy()
+    fields = {}
+    for i, symbol in enumerate(metrics.index):
+        fields[symbol] = {col: _value(values[i], RISK_DIGITS[col]) for col, values in columns.items()}
+        fields[symbol]['beta'] = {b: _value(v, BETA_DIGITS) for b, v in zip(beta.columns, beta_values[i])}
+    return fields
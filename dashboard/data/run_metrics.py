@@ -0,0 +1,268 @@
+"""Métricas estruturadas de uma execução da coleta e da análise.
+
+`RunMetrics` acumula, de forma segura entre threads:
+
+- a duração de cada etapa (total e própria, descontadas as etapas internas);
+- um histograma de latência das chamadas ao provedor, por endpoint;
+- novas tentativas e falhas por símbolo;
+- bytes lidos e gravados em disco;
+- contadores avulsos (acertos de cache, símbolos sem dados, ...).
+
+O relatório sai em JSON (`write_json`) ou no formato textfile do Prometheus
+(`write_prometheus`, para o textfile collector do node_exporter). Com
+`profile_dir`, cada etapa é perfilada com cProfile (sem o tempo das etapas
+internas) e gravada em `<profile_dir>/<etapa>.prof`; o cProfile só enxerga a
+thread principal, então o tempo das threads de coleta aparece como espera.
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+# Limites superiores (s) dos baldes do histograma de latência
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_PREFIX = 'rp_finances'
+
+
+def stage(name):
+    """Decora um método de um objeto com atributo `metrics` para medir a etapa `name`."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def path_size(path):
+    """Tamanho em bytes de um arquivo, ou da soma dos arquivos de um diretório."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class RunMetrics:
+    """Coletor das métricas de uma execução; uma instância pode ser compartilhada por coleta e análise."""
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.profilers = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self.started_at = time.time()
+        self.stages = {}
+        self.calls = {}
+        self.symbols = {}
+        self.bytes_read = {}
+        self.bytes_written = {}
+        self.counters = {}
+
+    # Etapas
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        profiler = None
+        if self.profile_dir and threading.current_thread() is threading.main_thread():
+            # Um perfil por etapa: o da etapa externa pausa enquanto a interna roda
+            if stack and stack[-1]['profiler']:
+                stack[-1]['profiler'].disable()
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        frame = {'children': 0.0, 'profiler': profiler}
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1]['children'] += elapsed
+            if profiler:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, name + '.prof'))
+                if stack and stack[-1]['profiler']:
+                    stack[-1]['profiler'].enable()
+            with self.lock:
+                entry = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0})
+                entry['calls'] += 1
+                entry['seconds'] += elapsed
+                entry['self_seconds'] += elapsed - frame['children']
+
+    # Chamadas ao provedor
+
+    def observe_call(self, endpoint, seconds, ok=True, batch_size=1):
+        with self.lock:
+            entry = self.calls.setdefault(endpoint, {
+                'count': 0, 'errors': 0, 'queries': 0, 'sum': 0.0, 'max': 0.0,
+                'buckets': [0] * len(LATENCY_BUCKETS)
+            })
+            entry['count'] += 1
+            entry['queries'] += batch_size
+            entry['errors'] += 0 if ok else 1
+            entry['sum'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+                    break
+
+    def _symbol(self, symbol):
+        return self.symbols.setdefault(symbol, {'retries': 0, 'failures': 0, 'errors': []})
+
+    def retry(self, symbols):
+        with self.lock:
+            for symbol in symbols:
+                self._symbol(symbol)['retries'] += 1
+            self.counters['retries'] = self.counters.get('retries', 0) + len(symbols)
+
+    def failure(self, symbol, kind, error=None):
+        """Registra que `kind` (chart, insights, ...) de um símbolo não foi obtido."""
+        with self.lock:
+            entry = self._symbol(symbol)
+            entry['failures'] += 1
+            entry['errors'].append(f'{kind}: {error}' if error else kind)
+            key = f'failures.{kind}'
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    # Disco e contadores
+
+    def read(self, path, size=None):
+        with self.lock:
+            self.bytes_read[path] = self.bytes_read.get(path, 0) + (path_size(path) if size is None else size)
+
+    def written(self, path, size=None):
+        with self.lock:
+            self.bytes_written[path] = self.bytes_written.get(path, 0) + (path_size(path) if size is None else size)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # Relatório
+
+    def to_dict(self):
+        with self.lock:
+            calls = {}
+            for endpoint, entry in self.calls.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(LATENCY_BUCKETS, entry['buckets']):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                buckets['+Inf'] = entry['count']
+                calls[endpoint] = {
+                    'count': entry['count'],
+                    'queries': entry['queries'],
+                    'errors': entry['errors'],
+                    'seconds_sum': round(entry['sum'], 6),
+                    'seconds_max': round(entry['max'], 6),
+                    'buckets': buckets,
+                }
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': round(time.time() - self.started_at, 6),
+                'stages': {name: {'calls': entry['calls'],
+                                  'seconds': round(entry['seconds'], 6),
+                                  'self_seconds': round(entry['self_seconds'], 6)}
+                           for name, entry in self.stages.items()},
+                'api_calls': calls,
+                'symbols': {symbol: dict(entry, errors=list(entry['errors']))
+                            for symbol, entry in sorted(self.symbols.items())},
+                'bytes_read': dict(self.bytes_read),
+                'bytes_written': dict(self.bytes_written),
+                'counters': dict(self.counters),
+            }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.to_prometheus())
+
+    def to_prometheus(self):
+        """Relatório no formato texto do Prometheus (falhas agregadas por tipo, não por símbolo)."""
+        report = self.to_dict()
+        p = PROMETHEUS_PREFIX
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f'{p}_{name}{suffix}{{{label_text}}} {value}' if label_text
+                             else f'{p}_{name}{suffix} {value}')
+
+        metric('run_started_timestamp_seconds', 'gauge', 'Início da execução (época Unix).',
+               [('', {}, report['started_at'])])
+        metric('run_duration_seconds', 'gauge', 'Duração da execução.',
+               [('', {}, report['duration_seconds'])])
+        metric('stage_seconds', 'gauge', 'Duração total de cada etapa, incluindo etapas internas.',
+               [('', {'stage': name}, entry['seconds']) for name, entry in report['stages'].items()])
+        metric('stage_self_seconds', 'gauge', 'Duração própria de cada etapa.',
+               [('', {'stage': name}, entry['self_seconds']) for name, entry in report['stages'].items()])
+
+        samples = []
+        for endpoint, entry in report['api_calls'].items():
+            for bound, count in entry['buckets'].items():
+                samples.append(('_bucket', {'endpoint': endpoint, 'le': bound}, count))
+            samples.append(('_sum', {'endpoint': endpoint}, entry['seconds_sum']))
+            samples.append(('_count', {'endpoint': endpoint}, entry['count']))
+        metric('api_call_seconds', 'histogram', 'Latência das chamadas ao provedor.', samples)
+        metric('api_call_errors_total', 'counter', 'Chamadas ao provedor que falharam.',
+               [('', {'endpoint': endpoint}, entry['errors']) for endpoint, entry in report['api_calls'].items()])
+
+        metric('bytes_read_total', 'counter', 'Bytes lidos do disco.',
+               [('', {}, sum(report['bytes_read'].values()))])
+        metric('bytes_written_total', 'counter', 'Bytes gravados em disco.',
+               [('', {}, sum(report['bytes_written'].values()))])
+        metric('events_total', 'counter', 'Contadores da execução (novas tentativas, falhas por tipo, cache...).',
+               [('', {'name': name}, value) for name, value in sorted(report['counters'].items())])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path, text):
+    # O textfile collector pode ler o arquivo a qualquer momento
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-json', default=None,
+                        help='Grava o relatório de métricas da execução em JSON')
+    parser.add_argument('--metrics-prom', default=None,
+                        help='Grava as métricas no formato textfile do Prometheus')
+    parser.add_argument('--profile-dir', default=None,
+                        help='Perfila cada etapa com cProfile e grava <etapa>.prof neste diretório')
+    return parser
+
+
+def metrics_from_args(args):
+    return RunMetrics(profile_dir=args.profile_dir)
+
+
+def write_reports(metrics, args):
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+        print(f"Métricas da execução salvas em {args.metrics_json}")
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+        print(f"Métricas Prometheus salvas em {args.metrics_prom}")
@@ -0,0 +1,175 @@
+"""Armazenamento colunar das séries OHLCV em arquivos NumPy mapeados em memória.
+
+Cada conjunto (índices, ações) é um diretório com um arquivo .npy por coluna e
+uma linha por (símbolo, timestamp), ordenada por símbolo e depois por timestamp:
+
+    data/timeseries/stocks/
+        manifest.json       símbolos, metadados e o intervalo [start, stop) de linhas
+        timestamp.npy       int64, segundos Unix
+        open.npy ... adjclose.npy   float64, NaN onde a API não trouxe valor
+
+Como as colunas são abertas com mmap_mode='r', ler um símbolo ou um intervalo de
+datas devolve fatias (views) sem copiar nem ler o restante do arquivo. Os JSON
+no formato da API continuam disponíveis via `to_records`.
+"""
+import json
+import os
+import shutil
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+# Colunas de preço/volume; 'timestamp' é tratada à parte por ser inteira
+COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'adjclose')
+
+STORE_DIR = 'data/timeseries'
+
+
+def _series_columns(record):
+    """Extrai timestamps e colunas de um registro no formato da API, ordenados por timestamp."""
+    timestamps = record.get('timestamp')
+    timestamps = np.asarray(timestamps if timestamps is not None else [], dtype=np.int64)
+    n = len(timestamps)
+    indicators = record.get('indicators', {})
+    quote = (indicators.get('quote') or [{}])[0]
+    adjclose = (indicators.get('adjclose') or [{}])[0].get('adjclose')
+
+    columns = {}
+    for col in COLUMNS:
+        values = adjclose if col == 'adjclose' else quote.get(col)
+        # dtype=float converte None em NaN
+        column = np.full(n, np.nan)
+        if values is not None and len(values):
+            values = np.asarray(values[:n], dtype=np.float64)
+            column[:len(values)] = values
+        columns[col] = column
+
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], {col: values[order] for col, values in columns.items()}
+
+
+def write_store(records, path):
+    """Grava registros no formato da API (lista de dicts) como um conjunto colunar.
+
+    A gravação é feita em um diretório temporário e trocada no final, para que
+    leitores nunca vejam um conjunto pela metade.
+    """
+    tmp_path = path.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    symbols = []
+    timestamp_parts = []
+    column_parts = {col: [] for col in COLUMNS}
+    row = 0
+    for record in records:
+        timestamps, columns = _series_columns(record)
+        symbols.append({
+            'symbol': record['symbol'],
+            'name': record.get('name'),
+            'region': record.get('region'),
+            'meta': record.get('meta', {}),
+            'start': row,
+            'stop': row + len(timestamps)
+        })
+        row += len(timestamps)
+        timestamp_parts.append(timestamps)
+        for col in COLUMNS:
+            column_parts[col].append(columns[col])
+
+    np.save(os.path.join(tmp_path, 'timestamp.npy'),
+            np.concatenate(timestamp_parts) if timestamp_parts else np.empty(0, dtype=np.int64))
+    for col in COLUMNS:
+        np.save(os.path.join(tmp_path, col + '.npy'),
+                np.concatenate(column_parts[col]) if column_parts[col] else np.empty(0))
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump({'columns': list(COLUMNS), 'rows': row, 'symbols': symbols}, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def _to_epoch(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class TimeSeriesStore:
+    """Leitura de um conjunto gravado por `write_store`.
+
+    Aceita datas como segundos Unix, `date`/`datetime` ou strings ISO (UTC).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        self.index = {entry['symbol']: entry for entry in self.manifest['symbols']}
+        self._columns = {}
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'manifest.json'))
+
+    @staticmethod
+    def modified(path):
+        """Data de modificação do conjunto (a do manifesto, gravado por último)."""
+        return os.path.getmtime(os.path.join(path, 'manifest.json'))
+
+    @property
+    def symbols(self):
+        return [entry['symbol'] for entry in self.manifest['symbols']]
+
+    def column(self, name):
+        """Coluna inteira, mapeada em memória na primeira leitura."""
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    def info(self, symbol):
+        return self.index[symbol]
+
+    def read(self, symbol, start=None, end=None, columns=COLUMNS):
+        """Devolve {'timestamp': ..., coluna: ...} de um símbolo entre start e end (inclusive).
+
+        Os arrays são views somente leitura sobre os arquivos mapeados.
+        """
+        entry = self.index[symbol]
+        lo, hi = entry['start'], entry['stop']
+        timestamps = self.column('timestamp')[lo:hi]
+        start, end = _to_epoch(start), _to_epoch(end)
+        first = int(np.searchsorted(timestamps, start, side='left')) if start is not None else 0
+        last = int(np.searchsorted(timestamps, end, side='right')) if end is not None else hi - lo
+        series = {'timestamp': timestamps[first:last]}
+        for col in columns:
+            series[col] = self.column(col)[lo + first:lo + last]
+        return series
+
+    def to_records(self, symbols=None):
+        """Exporta no formato de lista de dicts da API (NaN volta a ser None)."""
+        records = []
+        for symbol in symbols or self.symbols:
+            entry = self.index[symbol]
+            series = self.read(symbol)
+
+            def as_list(values):
+                return [None if np.isnan(v) else float(v) for v in values]
+
+            quote = {col: as_list(series[col]) for col in COLUMNS if col != 'adjclose'}
+            quote['volume'] = [None if v is None else int(v) for v in quote['volume']]
+            records.append({
+                'symbol': symbol,
+                'name': entry['name'],
+                'region': entry['region'],
+                'meta': entry['meta'],
+                'timestamp': series['timestamp'].tolist(),
+                'indicators': {'quote': [quote], 'adjclose': [{'adjclose': as_list(series['adjclose'])}]}
+            })
+        return records